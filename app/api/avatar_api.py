@@ -8,27 +8,29 @@ from app.services.avatar_generator import (
 
 router = APIRouter()
 
-@router.post("/avatar/{user_id}")
-def generate_avatar_for_user(user_id: str):
+# 要放在 /avatar/{user_id} 前面，不然 "generate-all" 會被當成 user_id
+@router.post("/avatar/generate-all")
+def generate_avatar_for_all_users(limit: int | None = None, job_id: str = "avatars-bulk"):
     """
-    針對單一 user_id 重新產生頭貼（不用 JWT）
+    批次：從 user_preference_vectors 抓 user_id，一次產生一輪頭貼。
+
+    limit：可選，給你測試時先跑 3, 5 個用的。
+    job_id：同一個 job 中斷後再呼叫會從上次的進度繼續。
     """
     try:
-        url = generate_and_save_avatar(user_id)
-        return {"user_id": user_id, "avatarUrl": url}
+        success, failed = bulk_generate_and_save_avatars(limit=limit, job_id=job_id)
+        return {"job_id": job_id, "success": success, "failed": failed}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.post("/avatar/generate-all")
-def generate_avatar_for_all_users(limit: int | None = None):
+@router.post("/avatar/{user_id}")
+def generate_avatar_for_user(user_id: str):
     """
-    批次：從 user_preference_vectors 抓 user_id，一次產生一輪頭貼。
-
-    limit：可選，給你測試時先跑 3, 5 個用的。
+    針對單一 user_id 重新產生頭貼（不用 JWT）
     """
     try:
-        success, failed = bulk_generate_and_save_avatars(limit=limit)
-        return {"success": success, "failed": failed}
+        variants = generate_and_save_avatar(user_id)
+        return {"user_id": user_id, "avatarUrl": variants["large"], "variants": variants}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -2,13 +2,17 @@
 from fastapi import APIRouter, Depends, HTTPException
 from app.services.heartbeat_pubsub import publish_heartbeat
 from app.services.spotify_token_service import (
-    get_spotify_token,
+    get_valid_spotify_token,
     refresh_spotify_token
 )
 from app.services.spotify_now_playing import fetch_now_playing
 from app.services.user_auth import get_current_user
 import time
 from app.services.redis_service import HeartbeatRedisService
+from app.services.image_variants import avatar_url_for
+from app.services.nearby_push import publish_nearby_event
+from app.services.taste_vectors import rank_nearby_by_taste
+from app.config.settings import HEARTBEAT_REPLAY_SEC, NEARBY_PAGE_SIZE
 
 router = APIRouter()
 
@@ -19,7 +23,7 @@ async def heartbeat_auto(payload: dict, user=Depends(get_current_user)):
 
     user_id = user["user_id"]
     display_name = user.get("display_name")
-    avatarUrl = user.get("avatarUrl")
+    avatarUrl = avatar_url_for(user, "small")
 
     lat = payload.get("lat")
     lng = payload.get("lng")
@@ -27,16 +31,18 @@ async def heartbeat_auto(payload: dict, user=Depends(get_current_user)):
     if lat is None or lng is None:
         raise HTTPException(status_code=400, detail="lat/lng required")
 
-    # 1. 取 token
-    token = get_spotify_token(user_id)
-    if not token:
-        raise HTTPException(status_code=401, detail="Spotify not linked")
+    # adaptive=true：半徑隨人潮密度調整、結果排序並限量（limit 最多 100）
+    adaptive = bool(payload.get("adaptive"))
+    try:
+        limit = max(1, min(100, int(payload.get("limit") or NEARBY_PAGE_SIZE)))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="limit must be an integer")
+    nearby_variant = f"adaptive:{limit}" if adaptive else None
 
-    now = int(time.time())
-    if token["expires_at"] < now + 30:
-        token = refresh_spotify_token(user_id)
-        if not token:
-            raise HTTPException(status_code=401, detail="Token refresh failed")
+    # 1. 取 token（process 內快取；背景 refresher 會在到期前先換好）
+    token = get_valid_spotify_token(user_id)
+    if not token:
+        raise HTTPException(status_code=401, detail="Spotify token unavailable")
 
     access_token = token["access_token"]
 
@@ -45,7 +51,9 @@ async def heartbeat_auto(payload: dict, user=Depends(get_current_user)):
 
     # Token 過期 → Refresh 再 call 一次
     if item == "TOKEN_EXPIRED":
-        token = refresh_spotify_token(user_id)
+        token = refresh_spotify_token(user_id, rejected_access_token=access_token)
+        if not token:
+            raise HTTPException(status_code=401, detail="Token refresh failed")
         access_token = token["access_token"]
         item = fetch_now_playing(access_token)
 
@@ -69,23 +77,50 @@ async def heartbeat_auto(payload: dict, user=Depends(get_current_user)):
         "lng": lng
     }
 
-    # 4. 存到 Redis
-    redis_service.set_heartbeat(user_id, heartbeat)
-    
-    groups = redis_service.get_nearby_music_groups(
-        my_user_id=user_id,
-        my_track_id=item["id"],
-        my_artist_id=item["artists"][0]["id"],
-        my_lat=lat,
-        my_lng=lng
-    )
-
-    publish_heartbeat(heartbeat)
+    # 4. Change detection：同一首歌、同一個位置 → 只續 TTL，不重算 nearby、不發 Pub/Sub
+    now = heartbeat["timestamp"]
+    prev_state, cached_groups = redis_service.get_play_state(user_id, nearby_variant)
+    state = redis_service.play_state_of(heartbeat, started_at=now)
+    # WebSocket（nearby_ws）讀 nearby 快取時要知道這個 client 用的是哪一份
+    state["nearby_variant"] = nearby_variant
+    replay_after = item["duration_ms"] / 1000 if item.get("duration_ms") else HEARTBEAT_REPLAY_SEC
+    changed = redis_service.is_play_change(prev_state, state, now, replay_after_sec=replay_after)
+
+    if not changed:
+        state["started_at"] = prev_state["started_at"]
+
+    # 5. 存到 Redis（heartbeat + play_state 一次 pipeline）
+    redis_service.save_heartbeat_state(user_id, heartbeat, state, changed=changed, previous=prev_state)
+
+    # 6. nearby：沒變且快取還在就直接回（快取只活 NEARBY_CACHE_SEC 秒，別人的移動很快就會反映）
+    groups = None if changed else cached_groups
+    if groups is None:
+        nearby = redis_service.get_nearby_adaptive if adaptive else redis_service.get_nearby_music_groups
+        extra = {"limit": limit} if adaptive else {}
+        groups = nearby(
+            my_user_id=user_id,
+            my_track_id=item["id"],
+            my_artist_id=item["artists"][0]["id"],
+            my_lat=lat,
+            my_lng=lng,
+            **extra
+        )
+        # 每組依口味相似度排序（快取的 preference 向量矩陣，一次 1 × N 矩陣乘法）
+        groups = rank_nearby_by_taste(user_id, groups)
+        redis_service.cache_nearby_groups(user_id, groups, nearby_variant)
+
+    # 7. 只有真的換歌 / 換地方才送 Pub/Sub（→ BigQuery），並推給附近連著 WebSocket 的人
+    if changed:
+        publish_heartbeat(heartbeat)
+        publish_nearby_event(heartbeat, previous=prev_state)
 
     return {
         "status": "ok",
         "sent": heartbeat,
+        "play_changed": changed,
         "same_track": groups["same_track"],
         "same_artist": groups["same_artist"],
-        "just_near": groups["just_near"]
+        "just_near": groups["just_near"],
+        # adaptive 模式才有：實際用到的半徑、掃了幾圈、半徑內總人數
+        **{k: groups[k] for k in ("radius_m", "rings", "total_nearby") if k in groups}
     }
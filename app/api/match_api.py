@@ -1,10 +1,19 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.concurrency import run_in_threadpool
 import logging
-from typing import List
+from typing import List, Optional
 
 from app.services.user_auth import get_current_user
-from app.models.match_models import SwipeRequest, SwipeResponse, PendingLikesResponse, LikedMeUserItem, SentLikesResponse, SentLikeUserItem
-from app.services.match_service import process_swipe_transaction, get_users_who_liked_me, get_users_i_liked
+from app.models.match_models import SwipeRequest, SwipeResponse, BulkSwipeRequest, BulkSwipeResponse, PendingLikesResponse, LikedMeUserItem, SentLikesResponse, SentLikeUserItem, UnseenMatchesResponse, MarkMatchesSeenRequest
+from app.services.match_events import verify_push_request, decode_push_message, handle_match_event, get_unseen_matches, mark_matches_seen
+from app.services.match_service import (
+    process_swipe_transaction,
+    process_swipe_batch,
+    get_users_who_liked_me,
+    get_users_i_liked,
+    count_users_who_liked_me,
+    count_users_i_liked,
+)
 
 router = APIRouter()
 
@@ -51,15 +60,46 @@ def swipe_user(
         logger.error(f"Swipe Error: User {current_user_id} -> {payload.target_user_id}: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
     
+@router.post("/swipe/bulk", response_model=BulkSwipeResponse)
+def swipe_users_bulk(
+    payload: BulkSwipeRequest,
+    user: dict = Depends(get_current_user)
+):
+    """
+    一次送出多個滑動（快速連滑時 client 先排隊再整批送）
+    - Body: { "swipes": [{ "target_user_id": "...", "action": "PASS" }, ...] }
+    - PASS 和不可能配對的 LIKE 用 batch 寫入，只有可能配對的 LIKE 才開交易
+    - 回傳每個 target 的結果（同一個 target 出現多次只算最後一次）
+    """
+    current_user_id = user["user_id"]
+
+    if any(s.target_user_id == current_user_id for s in payload.swipes):
+        raise HTTPException(status_code=400, detail="You cannot swipe yourself.")
+
+    try:
+        results = process_swipe_batch(
+            from_user_id=current_user_id,
+            swipes=[(s.target_user_id, s.action.value) for s in payload.swipes]
+        )
+        return BulkSwipeResponse(status="success", results=results)
+
+    except Exception as e:
+        logger.error(f"Bulk Swipe Error: User {current_user_id} ({len(payload.swipes)} swipes): {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
 @router.get("/liked-me", response_model=PendingLikesResponse)
-def get_pending_likes(user: dict = Depends(get_current_user)):
+def get_pending_likes(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="上一頁回傳的 next_cursor"),
+    user: dict = Depends(get_current_user)
+):
     """
     取得「喜歡我」但「我還沒處理」的使用者列表 (含名字與照片)。
     """
     current_user_id = user["user_id"]
 
     try:
-        results = get_users_who_liked_me(current_user_id)
+        results, next_cursor = get_users_who_liked_me(current_user_id, limit=limit, cursor=cursor)
         
         response_list = [
             LikedMeUserItem(
@@ -73,16 +113,23 @@ def get_pending_likes(user: dict = Depends(get_current_user)):
         ]
 
         return PendingLikesResponse(
-            count=len(response_list),
-            users=response_list
+            count=count_users_who_liked_me(current_user_id),
+            users=response_list,
+            next_cursor=next_cursor
         )
 
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error fetching pending likes for {current_user_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
     
 @router.get("/my-likes", response_model=SentLikesResponse)
-def get_my_sent_likes(user: dict = Depends(get_current_user)):
+def get_my_sent_likes(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = Query(None, description="上一頁回傳的 next_cursor"),
+    user: dict = Depends(get_current_user)
+):
     """
     取得「我喜歡」但「尚未配對成功」的使用者列表 (My Sent Likes)。
     這會過濾掉已經 Match 的人。
@@ -90,7 +137,7 @@ def get_my_sent_likes(user: dict = Depends(get_current_user)):
     current_user_id = user["user_id"]
 
     try:
-        results = get_users_i_liked(current_user_id)
+        results, next_cursor = get_users_i_liked(current_user_id, limit=limit, cursor=cursor)
         
         response_list = [
             SentLikeUserItem(
@@ -103,10 +150,68 @@ def get_my_sent_likes(user: dict = Depends(get_current_user)):
         ]
 
         return SentLikesResponse(
-            count=len(response_list),
-            users=response_list
+            count=count_users_i_liked(current_user_id),
+            users=response_list,
+            next_cursor=next_cursor
         )
 
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error fetching sent likes for {current_user_id}: {e}")
-        raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
+
+
+@router.get("/match-notifications", response_model=UnseenMatchesResponse)
+def get_match_notifications(user: dict = Depends(get_current_user)):
+    """
+    還沒看過的新配對（配對事件 consumer 預先寫好，一次 HGETALL，不查 matches）。
+    """
+    current_user_id = user["user_id"]
+    try:
+        matches = get_unseen_matches(current_user_id)
+        return UnseenMatchesResponse(count=len(matches), matches=matches)
+    except Exception as e:
+        logger.error(f"Error fetching match notifications for {current_user_id}: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+
+@router.post("/match-notifications/seen")
+def mark_match_notifications_seen(
+    payload: MarkMatchesSeenRequest,
+    user: dict = Depends(get_current_user)
+):
+    mark_matches_seen(user["user_id"], payload.match_ids)
+    return {"status": "success"}
+
+
+@router.post("/internal/match-events")
+async def receive_match_event(request: Request, token: Optional[str] = Query(None)):
+    """
+    Pub/Sub push subscription（match-events-topic）的 endpoint。
+    - 驗證見 verify_push_request（OIDC JWT 或 ?token=；都沒設定就 403）
+    - 格式不對：回 200（ack），避免 Pub/Sub 一直重送
+    - consumer 失敗：回 500，讓 Pub/Sub 重送（consumer 都是 idempotent）
+    """
+    # OIDC JWT 驗證會抓 Google 的公鑰（有快取），一樣丟到 threadpool
+    if not await run_in_threadpool(verify_push_request, request.headers.get("Authorization"), token):
+        raise HTTPException(status_code=403, detail="Invalid push credentials")
+
+    try:
+        envelope = await request.json()
+    except ValueError:
+        envelope = None
+
+    event = decode_push_message(envelope)
+    if event is None:
+        logger.warning("Ignoring malformed match event push")
+        return {"status": "ignored"}
+
+    try:
+        # consumer 是同步的 Redis / Firestore 呼叫，丟到 threadpool 不擋 event loop
+        await run_in_threadpool(handle_match_event, event)
+    except Exception as e:
+        logger.error(f"Match event consumer failed for {event.get('match_id')}: {e}")
+        raise HTTPException(status_code=500, detail="Consumer failed")
+
+    return {"status": "success"}
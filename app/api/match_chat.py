@@ -1,53 +1,58 @@
 # app/api/match_chat.py
-from fastapi import APIRouter, HTTPException
-from app.services.firestore_client import get_db
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Query, Depends
+from app.models.match_models import MatchMessageRequest
+from app.services.match_service import get_match_list as load_match_list, send_match_message
+from app.services.user_auth import get_current_user
 
 router = APIRouter()
 
 
 @router.get("/match-list/{user_id}")
-def get_match_list(user_id: str):
-    db = get_db()
-
+def get_match_list(
+    user_id: str,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="上一頁回傳的 next_cursor"),
+):
     # -----------------------------------
-    # 1. 找出所有 matches 中包含 user_id 的文件
+    # 讀 users/{user_id}/match_index（配對成立 / 送訊息時同步維護）
+    # 已依最後活動時間新到舊排序，只投影列表需要的欄位，一次一頁
     # -----------------------------------
-    matches_ref = db.collection("matches")
-    query = matches_ref.where("users", "array_contains", user_id).stream()
-
-    match_results = []
-
-    for doc in query:
-        data = doc.to_dict()
-        match_id = doc.id
-
-        users = data.get("users", [])
-        if len(users) != 2:
-            # 保險處理：若資料結構錯誤
-            continue
-
-        # 另一個 user_id
-        other_id = users[0] if users[1] == user_id else users[1]
-
-        # -----------------------------------
-        # 2. 到 users 集合抓另一個使用者資訊
-        # -----------------------------------
-        other_doc = db.collection("users").document(other_id).get()
-        if not other_doc.exists:
-            other_profile = {"user_id": other_id, "missing": True}
-        else:
-            other_profile = other_doc.to_dict()
-            other_profile["user_id"] = other_id
-
-        # -----------------------------------
-        # 3. 回傳 match 內容 + 對方資料
-        # -----------------------------------
-        match_results.append({
-            "match_id": match_id,
-            "last_message": data.get("last_message", ""),
-            "last_message_time": data.get("last_message_time"),
-            "is_active": data.get("is_active", True),
-            "other_user": other_profile
-        })
-
-    return {"matches": match_results}
\ No newline at end of file
+    try:
+        entries, next_cursor = load_match_list(user_id, limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    match_results = [
+        {
+            "match_id": entry.get("match_id"),
+            "last_message": entry.get("last_message", ""),
+            "last_message_time": entry.get("last_message_time"),
+            "is_active": entry.get("is_active", True),
+            "other_user": {
+                "user_id": entry.get("user_id"),
+                "display_name": entry.get("display_name"),
+                "avatarUrl": entry.get("avatarUrl"),
+            }
+        }
+        for entry in entries
+    ]
+
+    return {"matches": match_results, "next_cursor": next_cursor}
+
+
+@router.post("/match/{match_id}/messages")
+def post_match_message(
+    match_id: str,
+    payload: MatchMessageRequest,
+    user: dict = Depends(get_current_user)
+):
+    """
+    送出聊天訊息，同時更新 match 的 last_message 與雙方的聊天列表。
+    """
+    try:
+        return send_match_message(match_id, user["user_id"], payload.text)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
@@ -1,7 +1,12 @@
 # app/api/match_history.py
 
 from fastapi import APIRouter, HTTPException
-from app.models.match_history_models import MatchCandidatesResponse, RebuildAllVectorsResponse
+from app.models.match_history_models import (
+    MatchCandidatesResponse,
+    RebuildAllVectorsResponse,
+    SwipeDeckResponse,
+    RebuildSwipeDecksResponse,
+)
 from app.services.user_vector_service import compute_user_vector, save_user_vector
 from app.services.match_utils_optimized import (
     get_all_active_users,
@@ -12,6 +17,8 @@ from app.services.match_utils_optimized import (
     compute_shared_tracks_map,
     compute_similarity_candidates
 )
+from app.services.swipe_deck_service import build_all_swipe_decks, get_swipe_deck
+from app.services.swipe_index_service import get_swiped_ids
 router = APIRouter()
 
 # ======================================================
@@ -57,6 +64,12 @@ def get_match_candidates(user_id: str, top_k: int = 10):
 
     artists_map = compute_shared_artists_map()
     tracks_map = compute_shared_tracks_map()
+    try:
+        swiped_ids = get_swiped_ids(user_id)
+    except Exception as e:
+        # Redis 掛了照樣回候選（只是可能包含滑過的人），不要整個 500
+        print(f"Swipe index read failed, not excluding swiped users: {e}")
+        swiped_ids = set()
 
     # 3. 計算相似度 candidate 結果
     candidates = compute_similarity_candidates(
@@ -67,7 +80,33 @@ def get_match_candidates(user_id: str, top_k: int = 10):
         top_songs=top_songs,
         artists_map=artists_map,
         tracks_map=tracks_map,
-        top_k=top_k
+        top_k=top_k,
+        excluded_ids=swiped_ids
     )
 
-    return {"candidates": candidates}
\ No newline at end of file
+    return {"candidates": candidates}
+
+
+# ======================================================
+# API 3: 批次重建所有人的 swipe deck（存 Redis）
+# ======================================================
+@router.post("/rebuild-swipe-decks", response_model=RebuildSwipeDecksResponse)
+def rebuild_swipe_decks(top_k: int = 100):
+    total, written = build_all_swipe_decks(top_k=top_k)
+    return {
+        "status": "ok",
+        "total_users": total,
+        "decks_written": written,
+    }
+
+
+# ======================================================
+# API 4: 讀取預先算好的 swipe deck（一次 key lookup）
+# ======================================================
+@router.get("/deck/{user_id}", response_model=SwipeDeckResponse)
+def get_precomputed_deck(user_id: str):
+    deck = get_swipe_deck(user_id)
+    if deck is None:
+        raise HTTPException(404, "Swipe deck not built yet")
+
+    return {"user_id": user_id, **deck}
@@ -0,0 +1,123 @@
+# app/api/nearby_ws.py
+import asyncio
+from fastapi import APIRouter, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
+from app.services.nearby_push import NearbyConnection, get_nearby_hub
+from app.services.redis_service import HeartbeatRedisService
+from app.services.user_auth import decode_user_token
+
+router = APIRouter()
+
+redis_service = HeartbeatRedisService()
+
+# 這麼久沒有任何 event，就檢查一次已推送的人是不是都還在
+PRUNE_INTERVAL_SEC = 30
+
+# 等 Redis 回 subscribe 確認最多這麼久；等不到也照樣送 snapshot（頂多漏掉中間幾筆，下次 resync 會補）
+SUBSCRIBE_TIMEOUT_SEC = 5
+
+
+async def _wait_disconnect(websocket: WebSocket):
+    # client 不需要送任何東西；讀到 disconnect 就結束
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        return
+
+
+async def _wait_subscribed(ready):
+    if not ready.is_set():
+        await run_in_threadpool(ready.wait, SUBSCRIBE_TIMEOUT_SEC)
+
+
+def _initial_groups(user_id, me):
+    """heartbeat_auto 剛算好的 nearby 快取；過期了才自己算一次"""
+    _, groups = redis_service.get_latest_nearby(user_id)
+    if groups is None:
+        groups = redis_service.get_nearby_music_groups(
+            my_user_id=user_id,
+            my_track_id=me["track_id"],
+            my_artist_id=me["artist_id"],
+            my_lat=me["lat"],
+            my_lng=me["lng"],
+        )
+    return groups
+
+
+@router.websocket("/ws/nearby")
+async def nearby_ws(websocket: WebSocket, token: str = Query(None)):
+    """
+    Nearby push：連上之後先送一次 snapshot（same_track / same_artist），
+    之後只送差異：
+        {"type": "upsert", "group": "same_track" | "same_artist", "user": heartbeat}
+        {"type": "remove", "user_id": ...}
+
+    token 放 query string（瀏覽器的 WebSocket 不能自訂 Authorization header）。
+    """
+    if not token:
+        authorization = websocket.headers.get("authorization", "")
+        token = authorization[7:] if authorization.startswith("Bearer ") else None
+
+    try:
+        user_id = decode_user_token(token or "")
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+
+    hub = get_nearby_hub()
+    conn = NearbyConnection(user_id, asyncio.get_running_loop())
+
+    # Redis 都是同步呼叫，丟到 threadpool，不擋住同一個 worker 上的其他 request / socket
+    me = (await run_in_threadpool(redis_service.get_heartbeats, [user_id])).get(user_id)
+    conn.me = me
+
+    # 先訂閱（等 Redis 確認）再拿 snapshot：中間有人 publish 的話會排在 queue 裡，之後照樣套用（重複的 upsert 會被 _diff 濾掉）
+    ready = hub.register(conn)
+    disconnect = None
+
+    try:
+        await _wait_subscribed(ready)
+        if me:
+            groups = await run_in_threadpool(_initial_groups, user_id, me)
+            await websocket.send_json(conn.snapshot(groups))
+        else:
+            await websocket.send_json(conn.snapshot({}))
+
+        disconnect = asyncio.create_task(_wait_disconnect(websocket))
+
+        while True:
+            next_event = asyncio.create_task(conn.queue.get())
+            done, _ = await asyncio.wait(
+                {next_event, disconnect}, timeout=PRUNE_INTERVAL_SEC, return_when=asyncio.FIRST_COMPLETED
+            )
+
+            if disconnect in done:
+                next_event.cancel()
+                break
+
+            if next_event in done:
+                hb = next_event.result()
+                if hb.get("user_id") == user_id:
+                    # 自己換歌 / 移動：先換訂閱的 cell，再拿 heartbeat_auto 剛快取好的 nearby 結果對齊
+                    conn.me = hb
+                    await _wait_subscribed(hub.refresh(conn))
+                    _, groups = await run_in_threadpool(redis_service.get_latest_nearby, user_id)
+                    messages = conn.apply(hb, my_groups=groups)
+                else:
+                    messages = conn.apply(hb)
+            else:
+                next_event.cancel()
+                messages = await run_in_threadpool(conn.prune, redis_service)
+
+            for message in messages:
+                await websocket.send_json(message)
+
+    except WebSocketDisconnect:
+        pass
+    finally:
+        hub.unregister(conn)
+        if disconnect is not None:
+            disconnect.cancel()
@@ -1,11 +1,10 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from google.cloud import bigquery
 from app.services.match_utils import get_ranking_region  
+from app.services.bigquery_client import get_bq_client
 
 PROJECT_ID = "spotify-match-project"
 router = APIRouter()
-bq_client = bigquery.Client(project=PROJECT_ID)
 
 class LocationRequest(BaseModel):
     lat: float
@@ -39,6 +38,7 @@ def get_regional_ranking(location: LocationRequest):
         """
 
         # 4. 設定查詢參數
+        from google.cloud import bigquery
         job_config = bigquery.QueryJobConfig(
             query_parameters=[
                 bigquery.ScalarQueryParameter("region_geohash", "STRING", region_geohash)
@@ -46,7 +46,7 @@ def get_regional_ranking(location: LocationRequest):
         )
 
         # 5. 執行查詢並獲取結果
-        query_job = bq_client.query(query, job_config=job_config)
+        query_job = get_bq_client().query(query, job_config=job_config)
         results = query_job.result()  
 
         # 6. 整理結果
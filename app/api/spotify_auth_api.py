@@ -9,6 +9,7 @@ from fastapi.responses import RedirectResponse
 from app.config.settings import CLIENT_ID, REDIRECT_URI
 from app.services.spotify_token_service import save_spotify_token
 from app.services.user_auth import get_current_user
+from app.services.tracing import span
 from app.models.spotify_auth_models import (
     AuthLoginResponse,
     SpotifyCallbackQuery,
@@ -120,7 +121,8 @@ def callback(
     }
 
     # 4. 跟 Spotify 交換 access_token
-    r = requests.post(token_url, data=payload)
+    with span("spotify", "exchange_token"):
+        r = requests.post(token_url, data=payload)
     token_data = r.json()
 
     if "access_token" not in token_data:
@@ -2,6 +2,63 @@ import os
 import json
 import base64
 import tempfile
+import threading
+
+# 所有 GCP client 共用同一份 credentials（同一個 access token，不會每個 client 各自換一次）
+CLOUD_PLATFORM_SCOPE = "https://www.googleapis.com/auth/cloud-platform"
+
+_lock = threading.Lock()
+_service_account_info = None
+_credentials = None
+
+
+def get_service_account_info() -> dict:
+    """
+    GOOGLE_CLOUD_CREDENTIALS（base64 JSON）只解一次。
+    """
+    global _service_account_info
+
+    if _service_account_info is not None:
+        return _service_account_info
+
+    with _lock:
+        if _service_account_info is None:
+            raw = os.getenv("GOOGLE_CLOUD_CREDENTIALS")
+            if not raw:
+                raise Exception("GOOGLE_CLOUD_CREDENTIALS is missing in environment variables")
+
+            try:
+                _service_account_info = json.loads(base64.b64decode(raw))
+            except Exception as e:
+                raise Exception(f"Failed to decode GOOGLE_CLOUD_CREDENTIALS: {e}")
+
+    return _service_account_info
+
+
+def get_credentials():
+    """
+    Process 內唯一的 service account credentials（已帶 cloud-platform scope，
+    client 不會再各自 with_scopes 複製一份）。
+    """
+    global _credentials
+
+    if _credentials is not None:
+        return _credentials
+
+    info = get_service_account_info()
+
+    with _lock:
+        if _credentials is None:
+            from google.oauth2 import service_account
+            try:
+                _credentials = service_account.Credentials.from_service_account_info(
+                    info, scopes=[CLOUD_PLATFORM_SCOPE]
+                )
+            except Exception as e:
+                raise Exception(f"Failed to create service account credentials: {e}")
+
+    return _credentials
+
 
 def setup_google_credentials():
     encoded = os.getenv("GOOGLE_CLOUD_CREDENTIALS")
@@ -11,7 +68,7 @@ def setup_google_credentials():
         return
 
     try:
-        decoded = json.loads(base64.b64decode(encoded))
+        decoded = get_service_account_info()
 
         # 寫成暫存 credentials.json
         tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".json")
@@ -22,4 +79,4 @@ def setup_google_credentials():
         os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = tmp.name
         print("✔ GOOGLE_APPLICATION_CREDENTIALS set.")
     except Exception as e:
-        print("❌ Failed to load GCP credentials:", e)
\ No newline at end of file
+        print("❌ Failed to load GCP credentials:", e)
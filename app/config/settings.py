@@ -14,11 +14,58 @@ def load_env():
 # Load env now
 load_env()
 
+# Storage backend："gcp"（Firestore / BigQuery / Redis / Pub/Sub）或 "memory"（全部 in-process，本機開發 / benchmark / load test 用）
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "gcp").lower()
+
+
+def use_memory_backend() -> bool:
+    return STORAGE_BACKEND == "memory"
+
+# 啟動後在背景預先建立 client / 載入 SDK，讓第一個 request 不用付冷啟動成本
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+# 啟動後在背景確認讀取端依賴的資料結構存在（BigQuery *_latest 表、Redis swipe index）；都是 idempotent
+SETUP_ON_STARTUP = os.getenv("SETUP_ON_STARTUP", "true").lower() in ("1", "true", "yes")
+
+# BigQuery *_latest 表：每 SNAPSHOT_LATEST_REFRESH_SEC 秒重建（新版本最多晚這麼久才讀得到），
+# 每 SNAPSHOT_PRUNE_INTERVAL_SEC 秒清一次舊版本、只留 SNAPSHOT_KEEP_VERSIONS 版；多個 instance 靠 Redis 只跑一份
+SNAPSHOT_MAINTENANCE = os.getenv("SNAPSHOT_MAINTENANCE", "true").lower() in ("1", "true", "yes")
+SNAPSHOT_LATEST_REFRESH_SEC = int(os.getenv("SNAPSHOT_LATEST_REFRESH_SEC", "900"))
+SNAPSHOT_PRUNE_INTERVAL_SEC = int(os.getenv("SNAPSHOT_PRUNE_INTERVAL_SEC", "86400"))
+SNAPSHOT_KEEP_VERSIONS = int(os.getenv("SNAPSHOT_KEEP_VERSIONS", "3"))
+
 # Spotify
 CLIENT_ID = os.getenv("CLIENT_ID")
 CLIENT_SECRET = os.getenv("CLIENT_SECRET")
 REDIRECT_URI = os.getenv("REDIRECT_URI")
 
+# Spotify access token：process 內快取，背景 thread 在到期前 SPOTIFY_TOKEN_REFRESH_AHEAD 秒先換新
+# （只處理最近 SPOTIFY_TOKEN_ACTIVE_WINDOW 秒內有用過 token 的使用者）
+SPOTIFY_TOKEN_REFRESHER = os.getenv("SPOTIFY_TOKEN_REFRESHER", "true").lower() in ("1", "true", "yes")
+SPOTIFY_TOKEN_REFRESH_AHEAD = int(os.getenv("SPOTIFY_TOKEN_REFRESH_AHEAD", "300"))
+SPOTIFY_TOKEN_ACTIVE_WINDOW = int(os.getenv("SPOTIFY_TOKEN_ACTIVE_WINDOW", "900"))
+SPOTIFY_TOKEN_REFRESH_INTERVAL = int(os.getenv("SPOTIFY_TOKEN_REFRESH_INTERVAL", "60"))
+
+# Spotify Web API：整個 process 每分鐘最多幾個 request（所有 thread 共用，被 429 時依 Retry-After 一起暫停）
+SPOTIFY_REQUESTS_PER_MINUTE = int(os.getenv("SPOTIFY_REQUESTS_PER_MINUTE", "600"))
+# recently-played 同步：同時處理幾個使用者、每個使用者最多往回翻幾頁（一頁 50 首）
+SPOTIFY_SYNC_WORKERS = int(os.getenv("SPOTIFY_SYNC_WORKERS", "8"))
+SPOTIFY_HISTORY_MAX_PAGES = int(os.getenv("SPOTIFY_HISTORY_MAX_PAGES", "20"))
+
+# 背景 recently-played harvester：每 HISTORY_HARVEST_INTERVAL_SEC 秒處理 spotify_tokens 的一個 shard
+# （HISTORY_HARVEST_SHARDS 個 shard 輪流，一輪 = shards × interval），每次最多 HISTORY_HARVEST_MAX_USERS 人；
+# 所有 instance 加起來每分鐘最多 HISTORY_HARVEST_REQUESTS_PER_MINUTE 個 Spotify request（留額度給線上流量）
+HISTORY_HARVESTER = os.getenv("HISTORY_HARVESTER", "false").lower() in ("1", "true", "yes")
+HISTORY_HARVEST_INTERVAL_SEC = int(os.getenv("HISTORY_HARVEST_INTERVAL_SEC", "300"))
+HISTORY_HARVEST_SHARDS = int(os.getenv("HISTORY_HARVEST_SHARDS", "12"))   # 最多 1024（spotify_tokens.harvest_bucket 的範圍）
+HISTORY_HARVEST_MAX_USERS = int(os.getenv("HISTORY_HARVEST_MAX_USERS", "500"))
+HISTORY_HARVEST_WORKERS = int(os.getenv("HISTORY_HARVEST_WORKERS", "8"))
+HISTORY_HARVEST_REQUESTS_PER_MINUTE = int(os.getenv("HISTORY_HARVEST_REQUESTS_PER_MINUTE", "300"))
+# 最近 HISTORY_ACTIVE_WINDOW_SEC 內有 heartbeat 的人每 HISTORY_SYNC_ACTIVE_INTERVAL_SEC 同步一次，
+# 其他人每 HISTORY_SYNC_IDLE_INTERVAL_SEC 一次（recently-played 只保留最近 50 首，常聽的人要勤一點）
+HISTORY_ACTIVE_WINDOW_SEC = int(os.getenv("HISTORY_ACTIVE_WINDOW_SEC", "86400"))
+HISTORY_SYNC_ACTIVE_INTERVAL_SEC = int(os.getenv("HISTORY_SYNC_ACTIVE_INTERVAL_SEC", "3600"))
+HISTORY_SYNC_IDLE_INTERVAL_SEC = int(os.getenv("HISTORY_SYNC_IDLE_INTERVAL_SEC", "43200"))
+
 # JWT
 JWT_SECRET = os.getenv("JWT_SECRET", "PLEASE_SET_SECRET")
 
@@ -26,11 +73,71 @@ JWT_SECRET = os.getenv("JWT_SECRET", "PLEASE_SET_SECRET")
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 
+# Heartbeat change detection：
+# 同一首歌、位置四捨五入到 HEARTBEAT_LOCATION_PRECISION 位小數（3 位 ≈ 110 公尺）沒變 → 不重算 nearby、不發 Pub/Sub；
+# nearby 結果快取 NEARBY_CACHE_SEC 秒；拿不到歌曲長度時，同一首歌超過 HEARTBEAT_REPLAY_SEC 秒視為重播
+HEARTBEAT_TTL_SEC = int(os.getenv("HEARTBEAT_TTL_SEC", "180"))
+HEARTBEAT_LOCATION_PRECISION = int(os.getenv("HEARTBEAT_LOCATION_PRECISION", "3"))
+HEARTBEAT_REPLAY_SEC = int(os.getenv("HEARTBEAT_REPLAY_SEC", "300"))
+NEARBY_CACHE_SEC = int(os.getenv("NEARBY_CACHE_SEC", "15"))
+
+# WebSocket nearby push：Redis pub/sub 一個 geohash cell 一個 channel（precision 7 ≈ 150 公尺見方），
+# 連線訂閱自己所在 cell + 周圍 8 格
+NEARBY_PUSH_PRECISION = int(os.getenv("NEARBY_PUSH_PRECISION", "7"))
+NEARBY_RADIUS_KM = float(os.getenv("NEARBY_RADIUS_KM", "0.150"))
+
+# Adaptive nearby：heartbeat 依 geohash cell（precision 7）建 index，從自己那格一圈一圈往外找，
+# 找到 NEARBY_TARGET_COUNT 人就停（人太多則縮小半徑）；最多 NEARBY_MAX_RINGS 圈，
+# 回傳最多 NEARBY_PAGE_SIZE 人、每組最多 NEARBY_GROUP_CAP 人
+NEARBY_INDEX_PRECISION = int(os.getenv("NEARBY_INDEX_PRECISION", "7"))
+NEARBY_TARGET_COUNT = int(os.getenv("NEARBY_TARGET_COUNT", "30"))
+NEARBY_MAX_RINGS = int(os.getenv("NEARBY_MAX_RINGS", "8"))
+NEARBY_PAGE_SIZE = int(os.getenv("NEARBY_PAGE_SIZE", "50"))
+NEARBY_GROUP_CAP = int(os.getenv("NEARBY_GROUP_CAP", "20"))
+
+# nearby 結果依口味相似度排序用的 user_preference_vectors 快取：多久重新從 BigQuery 載一次（秒）
+TASTE_VECTOR_TTL_SEC = int(os.getenv("TASTE_VECTOR_TTL_SEC", "3600"))
+# 載入失敗後多久再試（避免每個 heartbeat 都打一次 BigQuery）
+TASTE_VECTOR_RETRY_SEC = int(os.getenv("TASTE_VECTOR_RETRY_SEC", "300"))
+
+# 配對事件（match-events-topic）怎麼送到 consumer：
+#   pubsub：publish 到 Pub/Sub，push subscription 打 /api/internal/match-events（有 PUBSUB_EMULATOR_HOST 就走 emulator）
+#   local：process 內的 queue + worker thread（沒有 Pub/Sub 的本機開發；memory backend 一律用這個）
+MATCH_EVENTS_DELIVERY = os.getenv("MATCH_EVENTS_DELIVERY", "pubsub").lower()
+# push endpoint 的驗證（pubsub 模式下兩個都沒設就一律拒絕）：
+# - 建議：push subscription 開 OIDC token，audience / service account 設成一樣的值
+# - 或：push subscription 的 URL 帶 ?token=，值跟 MATCH_EVENTS_PUSH_TOKEN 一樣
+MATCH_EVENTS_PUSH_AUDIENCE = os.getenv("MATCH_EVENTS_PUSH_AUDIENCE")
+MATCH_EVENTS_PUSH_SERVICE_ACCOUNT = os.getenv("MATCH_EVENTS_PUSH_SERVICE_ACCOUNT")
+MATCH_EVENTS_PUSH_TOKEN = os.getenv("MATCH_EVENTS_PUSH_TOKEN")
+
+# Redis 連線池（每個 worker 一個 pool，所有 thread 共用）
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+
+# liked_by 預檢（swipe 不開交易）只在 Redis 不會淘汰沒有 TTL 的 key 時才啟用：
+# auto = 用 CONFIG GET maxmemory-policy 檢查（noeviction / volatile-*）；
+# 託管的 Redis 通常不開放 CONFIG，確認過 policy 之後設 true；false = 一律走 transaction
+SWIPE_INDEX_EVICTION_SAFE = os.getenv("SWIPE_INDEX_EVICTION_SAFE", "auto").lower()
+
+# BigQuery / GCS 的 HTTP 連線池大小
+GCP_HTTP_POOL_SIZE = int(os.getenv("GCP_HTTP_POOL_SIZE", "32"))
+
 # BigQuery
 BQ_PROJECT = os.getenv("GCP_PROJECT_ID", "spotify-match-project")
 BQ_DATASET = os.getenv("BQ_DATASET", "user_event")
 GCP_BUCKET_NAME = os.getenv("GCP_BUCKET_NAME", "spotify-match-avatars")
 
+# Avatar 批次生成：各 stage 的 worker 數，以及 Vertex 每分鐘可以產幾張圖（依專案 quota 調整）
+AVATAR_GENERATE_WORKERS = int(os.getenv("AVATAR_GENERATE_WORKERS", "4"))
+AVATAR_UPLOAD_WORKERS = int(os.getenv("AVATAR_UPLOAD_WORKERS", "8"))
+VERTEX_IMAGES_PER_MINUTE = int(os.getenv("VERTEX_IMAGES_PER_MINUTE", "30"))
+
+# 回傳 avatar URL 時優先給 WebP（client 都支援時再打開）
+AVATAR_PREFER_WEBP = os.getenv("AVATAR_PREFER_WEBP", "false").lower() in ("1", "true", "yes")
+
+# 同一個 prompt 最多產幾張圖；之後同 prompt 的使用者從這 K 張裡分配
+AVATAR_POOL_SIZE = int(os.getenv("AVATAR_POOL_SIZE", "3"))
+
 # Gemini API
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
@@ -2,7 +2,15 @@ from app.config.gcp_credentials import setup_google_credentials
 setup_google_credentials()
 
 # app/main.py
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from app.config.settings import (
+    HISTORY_HARVESTER,
+    SETUP_ON_STARTUP,
+    SNAPSHOT_MAINTENANCE,
+    SPOTIFY_TOKEN_REFRESHER,
+    WARMUP_ON_STARTUP,
+)
 
 # === Import Routers ===
 from app.api.auth_api import router as auth_router            # NEW: Email/Password + JWT
@@ -14,7 +22,51 @@ from app.api.match_history import router as match_history_router
 from app.api.avatar_api import router as avatar_router
 from app.api.match_chat import router as match_chat_router
 from app.api.ranking_router import router as ranking_router
+from app.api.nearby_ws import router as nearby_ws_router
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from app.services.tracing import render_prometheus, tracing_middleware
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 所有 SDK / client 都是 lazy 初始化；需要時可在啟動後於背景先暖好
+    if WARMUP_ON_STARTUP:
+        from app.services.warmup import start_background_warmup
+        start_background_warmup()
+
+    # matching / vector 讀的 BigQuery *_latest 表、swipe 用的 Redis index：不存在就建
+    if SETUP_ON_STARTUP:
+        from app.services.warmup import STARTUP_SETUP_STEPS, start_background_warmup
+        start_background_warmup(STARTUP_SETUP_STEPS)
+
+    # Spotify token 到期前在背景先換好，heartbeat 不用在 request path 上等 refresh
+    refresher = None
+    if SPOTIFY_TOKEN_REFRESHER:
+        from app.services.spotify_token_service import start_token_refresher
+        refresher = start_token_refresher()
+
+    # 定期替所有連過 Spotify 的使用者補 recently-played（多個 instance 靠 Redis lock 只跑一份）
+    harvester = None
+    if HISTORY_HARVESTER:
+        from app.services.history_harvester import start_history_harvester
+        harvester = start_history_harvester()
+
+    # 定期重建 BigQuery *_latest 表、清舊版本（多個 instance 靠 Redis 只跑一份）
+    maintenance = None
+    if SNAPSHOT_MAINTENANCE:
+        from app.services.spotify_snapshots import start_snapshot_maintenance
+        maintenance = start_snapshot_maintenance()
+
+    yield
+
+    if maintenance is not None:
+        maintenance.set()
+    if refresher is not None:
+        refresher.set()
+    if harvester is not None:
+        harvester.set()
+
 
 app = FastAPI(
     title="Spotify Match Backend",
@@ -25,7 +77,8 @@ app = FastAPI(
         "• Heartbeat → Pub/Sub → Redis "
         "• Geo + Music Matching"
     ),
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
 # === CORS Middleware ===
@@ -42,6 +95,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# === Tracing：每個 request 的 latency + 各 dependency 的 span ===
+app.middleware("http")(tracing_middleware)
+
 # === User Auth (JWT 登入 / 註冊) ===
 app.include_router(auth_router, prefix="/auth", tags=["User Auth"])
 
@@ -64,9 +120,18 @@ app.include_router(match_chat_router, prefix = "/api",tags = ["Chat"])
 
 app.include_router(ranking_router, prefix="/api", tags=["Ranking"])
 
+# === WebSocket nearby push（取代 client 一直 poll /heartbeat-auto） ===
+app.include_router(nearby_ws_router, prefix="/api", tags=["Nearby Push"])
+
 @app.get("/")
 def root():
     return {
         "status": "ok",
         "message": "Spotify Match Backend running with JWT + PKCE + Firestore + Redis v2"
-    }
\ No newline at end of file
+    }
+
+
+# === Prometheus metrics（各 dependency / endpoint 的 latency histogram） ===
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
@@ -51,4 +51,24 @@ class RebuildAllVectorsResponse(BaseModel):
     status: str
     total_users: int
     updated: int
-    skipped_no_data: int
\ No newline at end of file
+    skipped_no_data: int
+
+# ======================================================
+# Precomputed Swipe Deck
+# ======================================================
+
+class SwipeDeckEntry(BaseModel):
+    userId: str
+    score: int
+
+
+class SwipeDeckResponse(BaseModel):
+    user_id: str
+    built_at: int
+    candidates: List[SwipeDeckEntry]
+
+
+class RebuildSwipeDecksResponse(BaseModel):
+    status: str
+    total_users: int
+    decks_written: int
@@ -19,6 +19,20 @@ class SwipeResponse(BaseModel):
     is_match: bool = Field(False, description="是否配對成功")
     match_id: Optional[str] = Field(None, description="若配對成功，回傳配對文件 ID")
 
+# 一次送出一串連續滑動（client 先在本機排隊，再整批送）
+class BulkSwipeRequest(BaseModel):
+    swipes: List[SwipeRequest] = Field(..., min_length=1, max_length=200, description="依滑動順序排列")
+
+class BulkSwipeResultItem(BaseModel):
+    target_user_id: str
+    action: SwipeAction
+    is_match: bool = False
+    match_id: Optional[str] = None
+
+class BulkSwipeResponse(BaseModel):
+    status: str
+    results: List[BulkSwipeResultItem]
+
 class LikedMeUserItem(BaseModel):
     user_id: str = Field(..., description="喜歡我的使用者 ID")
     display_name: str = Field(..., description="使用者名稱")
@@ -28,6 +42,7 @@ class LikedMeUserItem(BaseModel):
 class PendingLikesResponse(BaseModel):
     count: int = Field(..., description="總共有多少人喜歡我且未處理")
     users: List[LikedMeUserItem] = Field(..., description="使用者列表")
+    next_cursor: Optional[str] = Field(None, description="下一頁的 cursor，沒有下一頁時為 null")
 
 class SentLikeUserItem(BaseModel):
     user_id: str = Field(..., description="我喜歡的使用者 ID")
@@ -37,4 +52,20 @@ class SentLikeUserItem(BaseModel):
 
 class SentLikesResponse(BaseModel):
     count: int = Field(..., description="總共有多少人我喜歡但尚未配對")
-    users: List[SentLikeUserItem] = Field(..., description="使用者列表")
\ No newline at end of file
+    users: List[SentLikeUserItem] = Field(..., description="使用者列表")
+    next_cursor: Optional[str] = Field(None, description="下一頁的 cursor，沒有下一頁時為 null")
+
+class UnseenMatchItem(BaseModel):
+    match_id: str
+    user_id: str = Field(..., description="配對對象的 user ID")
+    created_at: int = Field(..., description="配對成立時間（unix 秒）")
+
+class UnseenMatchesResponse(BaseModel):
+    count: int = Field(..., description="還沒看過的新配對數")
+    matches: List[UnseenMatchItem]
+
+class MarkMatchesSeenRequest(BaseModel):
+    match_ids: Optional[List[str]] = Field(None, description="要標記已讀的配對；不給就全部標記")
+
+class MatchMessageRequest(BaseModel):
+    text: str = Field(..., min_length=1, max_length=2000, description="訊息內容")
@@ -0,0 +1,94 @@
+# app/services/avatar_cache.py
+"""
+Avatar pool cache：prompt 空間很小（動物 × 氣氛 × 動作 × 服裝 × 風格），
+很多使用者的 prompt 一模一樣。每個 prompt 只產 AVATAR_POOL_SIZE 張圖，
+每張圖的各尺寸 variant 放在 GCS（見 image_variants），索引放在 Firestore avatar_pool/{prompt_hash}：
+
+    { prompt, images: [{small, small_webp, medium, ..., large_webp}, ...], updated_at }
+
+Vertex 的花費跟「不同 prompt 的數量」成正比，而不是使用者數量。
+"""
+import hashlib
+from typing import Callable, Dict, Iterable, List
+
+from google.cloud import firestore
+
+from app.config.settings import AVATAR_POOL_SIZE
+from app.services.firestore_client import get_db
+from app.services.image_variants import upload_variants
+
+AVATAR_POOL_COLLECTION = "avatar_pool"
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:24]
+
+
+def pick_from_pool(images: List[Dict[str, str]], user_id: str) -> Dict[str, str]:
+    """同一個 user 在同一個 pool 裡永遠拿到同一張（user_id hash 取餘數）"""
+    idx = int(hashlib.sha1(user_id.encode("utf-8")).hexdigest(), 16) % len(images)
+    return images[idx]
+
+
+def images_needed(current: int, users: int, pool_size: int = AVATAR_POOL_SIZE) -> int:
+    """pool 還差幾張：目標是 min(pool_size, 使用者數)，不會產得比要分配的人還多"""
+    return max(0, min(pool_size, users) - current)
+
+
+# ======================================================
+# Firestore 索引
+# ======================================================
+def _pool_ref(db, key: str):
+    return db.collection(AVATAR_POOL_COLLECTION).document(key)
+
+
+def load_pools(keys: Iterable[str]) -> Dict[str, List[Dict[str, str]]]:
+    """一次讀多個 pool：{ prompt_hash: [variants] }（不存在的 pool 為 []）"""
+    keys = list(dict.fromkeys(keys))
+    pools = {key: [] for key in keys}
+    if not keys:
+        return pools
+
+    db = get_db()
+    for snap in db.get_all([_pool_ref(db, key) for key in keys], field_paths=["images"]):
+        if snap.exists:
+            pools[snap.id] = list(snap.get("images") or [])
+    return pools
+
+
+def add_to_pool(key: str, prompt: str, images: List[Dict[str, str]], batch=None) -> None:
+    """ArrayUnion：多個 worker 同時加圖不會互相蓋掉"""
+    db = get_db()
+    data = {
+        "prompt": prompt,
+        "images": firestore.ArrayUnion(images),
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    }
+    if batch is not None:
+        batch.set(_pool_ref(db, key), data, merge=True)
+    else:
+        _pool_ref(db, key).set(data, merge=True)
+
+
+# ======================================================
+# 圖片
+# ======================================================
+def store_pool_image(image_bytes: bytes) -> Dict[str, str]:
+    """量化 + 多尺寸 + WebP 後上傳，回傳 { variant: url }"""
+    return upload_variants(image_bytes)
+
+
+def get_or_create_pool_avatar(prompt: str, user_id: str, generate: Callable[[str], bytes]) -> Dict[str, str]:
+    """
+    單一使用者：pool 未滿 → 產一張新的加進 pool 並給這個 user；
+    pool 已滿 → 直接分配現有的圖，不呼叫 Vertex。
+    """
+    key = prompt_hash(prompt)
+    images = load_pools([key])[key]
+
+    if len(images) >= AVATAR_POOL_SIZE:
+        return pick_from_pool(images, user_id)
+
+    variants = store_pool_image(generate(prompt))
+    add_to_pool(key, prompt, [variants])
+    return variants
@@ -1,34 +1,38 @@
 # app/services/avatar_generator.py
 
 import os
-import base64
-import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Dict, Any, List, Tuple
-from google.cloud import bigquery
-from google.oauth2 import service_account
+from google.cloud import firestore
+from app.config.gcp_credentials import get_credentials
 from app.services.bigquery_client import get_bq_client
-from app.services.storage_client import upload_avatar_to_gcs
+from app.services.avatar_cache import (
+    add_to_pool,
+    get_or_create_pool_avatar,
+    images_needed,
+    load_pools,
+    pick_from_pool,
+    prompt_hash,
+    store_pool_image,
+)
 from app.services.firestore_client import get_db
-from app.config.settings import BQ_PROJECT, BQ_DATASET
-
-import vertexai
-from vertexai.preview.vision_models import ImageGenerationModel
+from app.services.rate_limit import RateLimiter
+from app.config.settings import (
+    BQ_PROJECT,
+    BQ_DATASET,
+    AVATAR_GENERATE_WORKERS,
+    AVATAR_UPLOAD_WORKERS,
+    VERTEX_IMAGES_PER_MINUTE,
+)
 
 
 # ======================================================
 # 1. 取得 service account credentials，給 Vertex AI 用
 # ======================================================
 def _get_sa_credentials():
-    raw = os.getenv("GOOGLE_CLOUD_CREDENTIALS")
-    if not raw:
-        raise Exception("GOOGLE_CLOUD_CREDENTIALS missing for Vertex AI")
-
-    try:
-        creds_json = json.loads(base64.b64decode(raw))
-        creds = service_account.Credentials.from_service_account_info(creds_json)
-        return creds
-    except Exception as e:
-        raise Exception(f"Failed to load SA credentials for Vertex AI: {e}")
+    # 跟 Firestore / BigQuery / GCS 共用同一份 credentials（只解析一次）
+    return get_credentials()
 
 
 _image_model = None
@@ -47,6 +51,10 @@ def _get_image_model():
     if _image_model is not None:
         return _image_model
 
+    # vertexai 會拉進整個 aiplatform SDK（import 要 1 秒以上），只在第一次產圖時才載入
+    import vertexai
+    from vertexai.preview.vision_models import ImageGenerationModel
+
     creds = _get_sa_credentials()
     project_id = creds.project_id
     location = os.getenv("VERTEX_LOCATION", "us-central1")
@@ -67,6 +75,8 @@ def fetch_user_preference_vector(user_id: str) -> Dict[str, Any]:
     從 spotify-match-project.user_event.user_preference_vectors
     抓出指定 user_id 的 style / genre / language 向量。
     """
+    from google.cloud import bigquery
+
     client = get_bq_client()
     table = f"`{BQ_PROJECT}.{BQ_DATASET}.user_preference_vectors`"
 
@@ -87,22 +97,54 @@ def fetch_user_preference_vector(user_id: str) -> Dict[str, Any]:
     if df.empty:
         raise ValueError(f"user_preference_vectors: no row for user_id={user_id}")
 
-    row = df.iloc[0]
+    return _row_to_vector(df.iloc[0])
 
-    def _safe(v) -> List[float]:
-        if v is None:
-            return []
-        if isinstance(v, list):
-            return v
-        return list(v)
 
+def _safe_list(v) -> List[float]:
+    if v is None:
+        return []
+    if isinstance(v, list):
+        return v
+    return list(v)
+
+
+def _row_to_vector(row) -> Dict[str, Any]:
     return {
-        "style_vector": _safe(row.get("style_vector")),
-        "genre_vector": _safe(row.get("genre_vector")),
-        "language_vector": _safe(row.get("language_vector")),
+        "style_vector": _safe_list(row.get("style_vector")),
+        "genre_vector": _safe_list(row.get("genre_vector")),
+        "language_vector": _safe_list(row.get("language_vector")),
     }
 
 
+def fetch_user_preference_vectors(user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    一次 query 抓多個 user 的向量（批次生圖用，取代每個 user 一次 query）。
+    :return: { user_id: {style_vector, genre_vector, language_vector} }
+    """
+    if not user_ids:
+        return {}
+
+    from google.cloud import bigquery
+
+    client = get_bq_client()
+    table = f"`{BQ_PROJECT}.{BQ_DATASET}.user_preference_vectors`"
+
+    sql = f"""
+        SELECT user_id, style_vector, genre_vector, language_vector
+        FROM {table}
+        WHERE user_id IN UNNEST(@user_ids)
+    """
+
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ArrayQueryParameter("user_ids", "STRING", list(user_ids))
+        ]
+    )
+    df = client.query(sql, job_config=job_config).to_dataframe()
+
+    return {str(row["user_id"]): _row_to_vector(row) for _, row in df.iterrows()}
+
+
 def fetch_all_user_ids(limit: int | None = None) -> List[str]:
     """
     從 user_preference_vectors 抓出所有 user_id（1 row 就 1 個 user）。
@@ -236,22 +278,44 @@ def build_avatar_prompt_from_vector(vec: Dict[str, Any]) -> str:
 # ======================================================
 # 4. 呼叫 Vertex AI 產生圖片 → 回傳 bytes
 # ======================================================
+_vertex_limiter = RateLimiter(VERTEX_IMAGES_PER_MINUTE)
+
+# 被 quota 擋下（429）時的重試次數與起始等待秒數
+VERTEX_MAX_ATTEMPTS = 4
+VERTEX_BACKOFF_SEC = 5
+
+
+def _call_image_model(prompt: str):
+    from google.api_core.exceptions import ResourceExhausted
+
+    model = _get_image_model()
+
+    for attempt in range(1, VERTEX_MAX_ATTEMPTS + 1):
+        _vertex_limiter.acquire()
+        try:
+            return model.generate_images(
+                prompt=prompt,
+                number_of_images=1,
+                # 如果版本支援，也可以加上：
+                # output_mime_type="image/png",
+            )
+        except ResourceExhausted:
+            if attempt == VERTEX_MAX_ATTEMPTS:
+                raise
+            time.sleep(VERTEX_BACKOFF_SEC * 2 ** (attempt - 1))
+
+
 def generate_avatar_bytes(user_id: str) -> bytes:
     # 1) 抓向量
     vec = fetch_user_preference_vector(user_id)
 
-    # 2) 組 prompt
-    prompt = build_avatar_prompt_from_vector(vec)
+    # 2) 組 prompt → 3) 產圖
+    return generate_avatar_bytes_from_prompt(build_avatar_prompt_from_vector(vec))
 
-    # 3) 呼叫 Vertex AI 圖像模型
-    model = _get_image_model()
 
-    images = model.generate_images(
-        prompt=prompt,
-        number_of_images=1,
-        # 如果版本支援，也可以加上：
-        # output_mime_type="image/png",
-    )
+def generate_avatar_bytes_from_prompt(prompt: str) -> bytes:
+    # 呼叫 Vertex AI 圖像模型（有速率限制 + 429 重試）
+    images = _call_image_model(prompt)
 
     if not images:
         raise Exception("Vertex AI did not return any image")
@@ -269,60 +333,215 @@ def generate_avatar_bytes(user_id: str) -> bytes:
 
 
 # ======================================================
-# 5. 單一使用者：生成圖片 + 上傳 GCS + 更新 Firestore
+# 5. 單一使用者：依 prompt 從 avatar pool 分配（必要時才產圖）+ 更新 Firestore
 # ======================================================
-def generate_and_save_avatar(user_id: str) -> str:
+def _avatar_fields(variants: Dict[str, str]) -> Dict[str, Any]:
+    # avatarUrl 保留給舊 client（large PNG）；列表類 endpoint 用 avatar_variants 挑小圖
+    return {"avatarUrl": variants["large"], "avatar_variants": variants}
+
+
+def generate_and_save_avatar(user_id: str) -> Dict[str, str]:
     """
     主要給 API 或批次程式用的高階函式：
-    1. 用 user_preference_vectors 向量生成頭貼
-    2. 上傳 GCS avatars/{user_id}.png
-    3. 更新 Firestore users/{user_id}.avatarUrl
-    4. 回傳 avatarUrl
+    1. 用 user_preference_vectors 向量組 prompt
+    2. 同 prompt 的 pool 還沒滿 → 生成新圖、做 variants 上傳 GCS；滿了 → 直接分配現有的圖
+    3. 更新 Firestore users/{user_id}.avatarUrl / avatar_variants
+    4. 回傳 variants { small, medium, large, *_webp }
     """
-    # 1) 生成圖片 bytes
-    img_bytes = generate_avatar_bytes(user_id)
-
-    # 2) 上傳到 GCS
-    avatar_url = upload_avatar_to_gcs(
-        user_id=user_id,
-        file_bytes=img_bytes,
-        content_type="image/png",
-    )
+    # 1) 組 prompt
+    prompt = build_avatar_prompt_from_vector(fetch_user_preference_vector(user_id))
+
+    # 2) 從 pool 拿圖（pool 未滿才會呼叫 Vertex）
+    variants = get_or_create_pool_avatar(prompt, user_id, generate_avatar_bytes_from_prompt)
 
-    # 3) Firestore 更新該使用者的 avatarUrl
+    # 3) Firestore 更新該使用者的頭像
     db = get_db()
     (
         db.collection("users")
         .document(user_id)
-        .set({"avatarUrl": avatar_url}, merge=True)
+        .set(_avatar_fields(variants), merge=True)
     )
 
-    return avatar_url
+    return variants
 
 
 # ======================================================
-# 6. 批次：從 BigQuery 抓全部 user_id，逐一生成頭貼
+# 6. 批次：平行 pipeline（Vertex 產圖 → GCS 上傳 → Firestore），可續跑
 # ======================================================
-def bulk_generate_and_save_avatars(limit: int | None = None) -> Tuple[int, int]:
+AVATAR_JOBS_COLLECTION = "avatar_jobs"
+
+# 每個 chunk 跑完才寫 checkpoint；chunk 也限制了同時在記憶體裡的圖片數
+AVATAR_CHUNK_SIZE = 50
+
+# Firestore batch 上限 500，留一點給 job record / pool 索引
+FIRESTORE_BATCH_SIZE = 400
+
+
+def _load_or_create_job(db, job_id: str, total: int) -> Dict[str, Any]:
+    job_ref = db.collection(AVATAR_JOBS_COLLECTION).document(job_id)
+    snap = job_ref.get()
+
+    if snap.exists and snap.to_dict().get("status") != "done":
+        job = snap.to_dict()
+        print(f"[Avatar] Resuming job {job_id} after user_id={job.get('cursor')}")
+        return job
+
+    job = {
+        "status": "running",
+        "total": total,
+        "cursor": None,
+        "success": 0,
+        "failed": 0,
+        "generated": 0,
+        "failed_user_ids": [],
+        "created_at": firestore.SERVER_TIMESTAMP,
+        "updated_at": firestore.SERVER_TIMESTAMP,
+    }
+    job_ref.set(job)
+    return job
+
+
+def _fill_pools(chunk_prompts: Dict[str, str], pools: Dict[str, List[str]], users_total: Dict[str, int],
+                generate_pool, upload_pool):
+    """
+    只替「pool 還沒滿」的 prompt 產圖；產完的圖立刻丟進上傳 pool。
+    pool 目標大小是 min(AVATAR_POOL_SIZE, 這個 job 裡用這個 prompt 的人數)，
+    所以重跑一次不會替已經夠用的 pool 多產圖。
+
+    :param chunk_prompts: { user_id: prompt }
+    :param pools: { prompt_hash: [variants] }，會就地加入新圖
+    :param users_total: { prompt_hash: 整個 job 裡的使用者數 }
+    :return: { prompt_hash: (prompt, [new variants]) }
+    """
+    users_per_key = {}
+    prompt_of = {}
+    for prompt in chunk_prompts.values():
+        key = prompt_hash(prompt)
+        users_per_key[key] = users_per_key.get(key, 0) + 1
+        prompt_of[key] = prompt
+
+    generate_futures = {}
+    for key, users in users_per_key.items():
+        missing = images_needed(len(pools.get(key, [])), users_total[key])
+        for _ in range(min(missing, users)):
+            generate_futures[generate_pool.submit(generate_avatar_bytes_from_prompt, prompt_of[key])] = key
+
+    upload_futures = {}
+    for future in as_completed(generate_futures):
+        key = generate_futures[future]
+        try:
+            img_bytes = future.result()
+        except Exception as e:
+            print(f"[Avatar] Generation failed for prompt {key}: {e}")
+            continue
+        upload_futures[upload_pool.submit(store_pool_image, img_bytes)] = key
+
+    added = {}
+    for future in as_completed(upload_futures):
+        key = upload_futures[future]
+        try:
+            variants = future.result()
+        except Exception as e:
+            print(f"[Avatar] Upload failed for prompt {key}: {e}")
+            continue
+        pools.setdefault(key, []).append(variants)
+        added.setdefault(key, (prompt_of[key], []))[1].append(variants)
+
+    return added
+
+
+def _commit_chunk(db, job_ref, assigned: Dict[str, Dict[str, str]], failed: List[str],
+                  added: Dict[str, Tuple[str, List[Dict[str, str]]]], cursor: str, job: Dict[str, Any]):
+    """把這個 chunk 的頭像、pool 索引和 job checkpoint 寫進 Firestore batch（最後一批帶 checkpoint）"""
+    job["cursor"] = cursor
+    job["success"] += len(assigned)
+    job["failed"] += len(failed)
+    job["generated"] = job.get("generated", 0) + sum(len(new) for _, new in added.values())
+    job["failed_user_ids"] = ((job.get("failed_user_ids") or []) + failed)[-500:]
+
+    # pool 索引先寫，使用者才不會指到索引裡沒有的圖
+    writes = [("pool", key, value) for key, value in added.items()]
+    writes += [("user", uid, variants) for uid, variants in assigned.items()]
+
+    for start in range(0, max(len(writes), 1), FIRESTORE_BATCH_SIZE):
+        batch = db.batch()
+        for kind, key, value in writes[start:start + FIRESTORE_BATCH_SIZE]:
+            if kind == "pool":
+                add_to_pool(key, value[0], value[1], batch=batch)
+            else:
+                batch.set(db.collection("users").document(key), _avatar_fields(value), merge=True)
+
+        if start + FIRESTORE_BATCH_SIZE >= len(writes):
+            batch.set(job_ref, {
+                "cursor": cursor,
+                "success": job["success"],
+                "failed": job["failed"],
+                "generated": job["generated"],
+                "failed_user_ids": job["failed_user_ids"],
+                "updated_at": firestore.SERVER_TIMESTAMP,
+            }, merge=True)
+        batch.commit()
+
+
+def bulk_generate_and_save_avatars(limit: int | None = None, job_id: str = "avatars-bulk") -> Tuple[int, int]:
     """
     不用 JWT，直接從 user_preference_vectors 抓 user_id 批次生圖。
 
+    1. fetch_all_user_ids + 一次 query 抓全部向量 → 每個 user 的 prompt
+    2. 一次讀出所有用到的 avatar pool
+    3. 每個 chunk：只替 pool 未滿的 prompt 產圖
+       （Vertex：AVATAR_GENERATE_WORKERS 個 thread，受 VERTEX_IMAGES_PER_MINUTE 限制；
+        GCS：AVATAR_UPLOAD_WORKERS 個 thread），再從 pool 分配給每個 user
+    4. 每個 chunk 一次 Firestore batch，同時更新 avatar_jobs/{job_id} 的 checkpoint
+
+    同一個 job_id 中斷後再呼叫，會從上次的 cursor 之後繼續；status=done 的 job 會重新開始。
+
     :param limit: 若有值，只處理前 N 個 user，方便測試。
     :return: (成功數, 失敗數)
     """
-    user_ids = fetch_all_user_ids(limit=limit)
+    db = get_db()
+    job_ref = db.collection(AVATAR_JOBS_COLLECTION).document(job_id)
 
-    success = 0
-    failed = 0
+    # 依 user_id 排序，cursor 才有意義
+    user_ids = sorted(fetch_all_user_ids(limit=limit))
+    job = _load_or_create_job(db, job_id, len(user_ids))
 
-    for uid in user_ids:
-        try:
-            print(f"[Avatar] Generating avatar for user_id={uid}")
-            generate_and_save_avatar(uid)
-            success += 1
-        except Exception as e:
-            print(f"[Avatar] Failed for user_id={uid}: {e}")
-            failed += 1
+    if job.get("cursor"):
+        user_ids = [uid for uid in user_ids if uid > job["cursor"]]
+
+    vectors = fetch_user_preference_vectors(user_ids)
+    prompts = {uid: build_avatar_prompt_from_vector(vec) for uid, vec in vectors.items()}
+    users_total = {}
+    for prompt in prompts.values():
+        key = prompt_hash(prompt)
+        users_total[key] = users_total.get(key, 0) + 1
+    pools = load_pools(users_total)
+
+    print(f"[Avatar] {job_id}: {len(user_ids)} users, {len(pools)} distinct prompts")
+
+    with ThreadPoolExecutor(max_workers=AVATAR_GENERATE_WORKERS, thread_name_prefix="avatar-gen") as generate_pool, \
+            ThreadPoolExecutor(max_workers=AVATAR_UPLOAD_WORKERS, thread_name_prefix="avatar-upload") as upload_pool:
+
+        for start in range(0, len(user_ids), AVATAR_CHUNK_SIZE):
+            chunk = user_ids[start:start + AVATAR_CHUNK_SIZE]
+            chunk_prompts = {uid: prompts[uid] for uid in chunk if uid in prompts}
+            added = _fill_pools(chunk_prompts, pools, users_total, generate_pool, upload_pool)
+
+            assigned, failed = {}, []
+            for uid in chunk:
+                pool = pools.get(prompt_hash(chunk_prompts[uid])) if uid in chunk_prompts else None
+                if pool:
+                    assigned[uid] = pick_from_pool(pool, uid)
+                else:
+                    print(f"[Avatar] Failed for user_id={uid}: no avatar available")
+                    failed.append(uid)
+
+            _commit_chunk(db, job_ref, assigned, failed, added, chunk[-1], job)
+
+            print(f"[Avatar] {job_id}: {start + len(chunk)}/{len(user_ids)} "
+                  f"(success={job['success']}, failed={job['failed']}, generated={job['generated']})")
+
+    job_ref.set({"status": "done", "updated_at": firestore.SERVER_TIMESTAMP}, merge=True)
 
-    print(f"[Avatar] Done. success={success}, failed={failed}")
-    return success, failed
\ No newline at end of file
+    print(f"[Avatar] Done. success={job['success']}, failed={job['failed']}, generated={job['generated']}")
+    return job["success"], job["failed"]
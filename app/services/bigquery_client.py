@@ -1,31 +1,42 @@
 # app/services/bigquery_client.py
-import os
-import base64
-import json
-from google.cloud import bigquery
-from google.oauth2 import service_account
+from app.config import settings
+from app.config.gcp_credentials import get_credentials
 from app.config.settings import BQ_PROJECT, BQ_DATASET
+from app.services.client_registry import build_authorized_session, get_or_create
+from app.services.tracing import traced_client
 
-_cached_client = None
+# query() 只是送出 job，真正等結果在 job.result() / to_dataframe()，所以 job 也要追蹤
+_TRACED_METHODS = {"query", "insert_rows_json", "load_table_from_json", "load_table_from_dataframe"}
+_TRACED_JOB_METHODS = {"result", "to_dataframe"}
 
-def get_bq_client():
-    global _cached_client
-    if _cached_client is not None:
-        return _cached_client
 
-    raw = os.getenv("GOOGLE_CLOUD_CREDENTIALS")
-    if not raw:
-        raise Exception("GOOGLE_CLOUD_CREDENTIALS missing")
+def _traced(client):
+    return traced_client(client, "bigquery", methods=_TRACED_METHODS, nested={"query": _TRACED_JOB_METHODS})
+
 
+def _create_client():
     try:
-        creds_json = json.loads(base64.b64decode(raw))
-        creds = service_account.Credentials.from_service_account_info(creds_json)
-        _cached_client = bigquery.Client(credentials=creds, project=creds.project_id)
-        return _cached_client
+        from google.cloud import bigquery
+
+        creds = get_credentials()
+        client = bigquery.Client(
+            credentials=creds,
+            project=creds.project_id,
+            _http=build_authorized_session(creds),
+        )
+        return _traced(client)
     except Exception as e:
         raise Exception(f"Failed to init BigQuery client: {e}")
 
 
+def get_bq_client():
+    if settings.use_memory_backend():
+        from app.services.memory_backend import get_memory_bigquery
+        return _traced(get_memory_bigquery())
+
+    return get_or_create("bigquery", _create_client)
+
+
 def insert_rows_json(table_name: str, rows: list):
     if not rows:
         return
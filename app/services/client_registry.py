@@ -0,0 +1,62 @@
+# app/services/client_registry.py
+"""
+Process 內唯一的 client registry：Firestore / BigQuery / GCS / Pub/Sub / Redis
+每種 client 只建立一次，所有 thread 共用。
+
+gRPC channel 和 HTTP / Redis 連線不能跨 fork 共用，uvicorn / gunicorn 多 worker
+是先 import 再 fork，所以在子行程裡清空 registry，讓每個 worker 自己重建。
+"""
+import os
+import threading
+
+from app.config.settings import GCP_HTTP_POOL_SIZE
+
+_clients = {}
+_lock = threading.RLock()
+
+
+def get_or_create(name: str, factory):
+    """
+    double-checked locking：已建立的 client 不用拿 lock；
+    第一次建立時只有一個 thread 會跑 factory。
+    """
+    client = _clients.get(name)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(name)
+        if client is None:
+            client = factory()
+            _clients[name] = client
+        return client
+
+
+def reset_clients():
+    global _lock
+    _clients.clear()
+    _lock = threading.RLock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_clients)
+
+
+# ======================================================
+# HTTP-based client（BigQuery / GCS）共用的 session：帶 credentials + 加大連線池
+# ======================================================
+def build_authorized_session(credentials):
+    """
+    requests 預設每個 host 只留 10 條連線，多 thread 同時查 BigQuery / 上傳 GCS 時
+    會一直重開 TLS 連線；改成 GCP_HTTP_POOL_SIZE。
+    """
+    import requests
+    from google.auth.transport.requests import AuthorizedSession
+
+    session = AuthorizedSession(credentials)
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=GCP_HTTP_POOL_SIZE,
+        pool_maxsize=GCP_HTTP_POOL_SIZE,
+    )
+    session.mount("https://", adapter)
+    return session
@@ -0,0 +1,57 @@
+# app/services/geo_cells.py
+"""
+Geohash cell 小工具：nearby push 的 channel、以及 adaptive nearby 的 cell index 共用。
+"""
+import math
+
+import geohash2
+
+KM_PER_DEG_LAT = 111.32
+
+
+def cell_of(lat, lng, precision):
+    return geohash2.encode(float(lat), float(lng), precision=precision)
+
+
+def ring_cells(cell, k):
+    """跟 cell 的 Chebyshev 距離剛好是 k 的那一圈（k=0 就是自己）"""
+    lat, lng, lat_err, lng_err = geohash2.decode_exactly(cell)
+    cells = set()
+    for dy in range(-k, k + 1):
+        for dx in range(-k, k + 1):
+            if max(abs(dx), abs(dy)) != k:
+                continue
+            cell_lat = lat + dy * 2 * lat_err
+            # 超過南北極就沒有格子了
+            if abs(cell_lat) > 90:
+                continue
+            cell_lng = (lng + dx * 2 * lng_err + 180) % 360 - 180
+            cells.add(geohash2.encode(cell_lat, cell_lng, precision=len(cell)))
+    return cells
+
+
+def neighbor_cells(cell):
+    """自己 + 周圍 8 格"""
+    return ring_cells(cell, 0) | ring_cells(cell, 1)
+
+
+def cell_size_km(cell):
+    """(南北高度, 東西寬度)，單位公里"""
+    lat, _, lat_err, lng_err = geohash2.decode_exactly(cell)
+    height = 2 * lat_err * KM_PER_DEG_LAT
+    width = 2 * lng_err * KM_PER_DEG_LAT * math.cos(math.radians(lat))
+    return height, width
+
+
+def covered_radius_km(lat, lng, cell, k):
+    """
+    掃完第 0..k 圈之後，保證「這個距離內的人一定都看過了」的半徑：
+    自己到所在 cell 邊界的最短距離 + k 個 cell 的寬度（取高、寬較小者）。
+    """
+    c_lat, c_lng, lat_err, lng_err = geohash2.decode_exactly(cell)
+    height, width = cell_size_km(cell)
+    to_edge = min(
+        (lat_err - abs(float(lat) - c_lat)) * KM_PER_DEG_LAT,
+        (lng_err - abs(float(lng) - c_lng)) * KM_PER_DEG_LAT * math.cos(math.radians(c_lat)),
+    )
+    return max(0.0, to_edge) + k * min(height, width)
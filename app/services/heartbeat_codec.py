@@ -0,0 +1,206 @@
+# app/services/heartbeat_codec.py
+"""
+Heartbeat 的 compact binary 編碼（Redis {user_id}:heartbeat、Pub/Sub heartbeat-topic 共用）。
+
+v1 layout（little-endian）：
+
+    B  version (=1)
+    I  timestamp（unix 秒）
+    f  lat（float32，誤差 < 1 公尺；沒有位置 = NaN）
+    f  lng
+    B  popularity（0–100）
+    B+bytes  user_id / track_id / artist_id（各一個長度 byte + UTF-8）
+
+display_name / avatarUrl / 歌名這些「顯示用」欄位不放進 hot record：
+Redis 另存 {user_id}:hb_meta（只有換歌時才寫），Pub/Sub 放 message attributes。
+nearby 查詢先用 decode_heartbeats() 一次解成 NumPy 陣列做過濾，只替命中的人讀 meta。
+
+格式改動時 HEARTBEAT_CODEC_VERSION 要加一，decode 端依 version byte 分流；
+舊的 JSON 值（第一個 byte 是 "{"）也能讀，升級期間不用清 Redis。
+"""
+import json
+import math
+import struct
+from typing import Dict, Iterable, Optional, Tuple
+
+HEARTBEAT_CODEC_VERSION = 1
+PUBSUB_ENCODING = "heartbeat-v1"
+
+_HEADER = struct.Struct("<BIffB")
+# 同一個 header 的 NumPy 版本（packed，無 alignment），批次解碼用
+_HEADER_DTYPE = [("version", "u1"), ("timestamp", "<u4"), ("lat", "<f4"), ("lng", "<f4"), ("popularity", "u1")]
+
+HOT_FIELDS = ("user_id", "track_id", "artist_id", "timestamp", "lat", "lng", "popularity")
+ID_FIELDS = ("user_id", "track_id", "artist_id")
+
+# 使用者的 profile：Pub/Sub 不送（下游用不到，每次重複送很浪費）
+PROFILE_FIELDS = ("display_name", "avatarUrl")
+
+
+# ======================================================
+# 單筆
+# ======================================================
+def encode_heartbeat(heartbeat: Dict) -> bytes:
+    parts = [_HEADER.pack(
+        HEARTBEAT_CODEC_VERSION,
+        int(heartbeat.get("timestamp") or 0),
+        _coord(heartbeat.get("lat")),
+        _coord(heartbeat.get("lng")),
+        max(0, min(255, int(heartbeat.get("popularity") or 0))),
+    )]
+    for field in ID_FIELDS:
+        raw = str(heartbeat.get(field) or "").encode("utf-8")
+        if len(raw) > 255:
+            raise ValueError(f"{field} too long for heartbeat record: {len(raw)} bytes")
+        parts.append(bytes((len(raw),)) + raw)
+    return b"".join(parts)
+
+
+def _coord(value):
+    return math.nan if value is None else float(value)
+
+
+def decode_heartbeat(raw) -> Optional[Dict]:
+    """bytes → hot 欄位的 dict；壞掉或不認得的版本回傳 None"""
+    if not raw:
+        return None
+    if isinstance(raw, str):
+        raw = raw.encode("utf-8")
+
+    # 舊格式：整包 JSON
+    if raw[:1] == b"{":
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return None
+
+    if raw[0] != HEARTBEAT_CODEC_VERSION or len(raw) < _HEADER.size:
+        return None
+
+    ids = _decode_ids(raw)
+    if ids is None:
+        return None
+
+    _, ts, lat, lng, popularity = _HEADER.unpack_from(raw)
+    hb = {
+        "timestamp": ts,
+        "lat": None if math.isnan(lat) else lat,
+        "lng": None if math.isnan(lng) else lng,
+        "popularity": popularity,
+    }
+    hb.update(zip(ID_FIELDS, ids))
+    return hb
+
+
+def _decode_ids(raw: bytes):
+    ids = []
+    offset = _HEADER.size
+    try:
+        for _ in ID_FIELDS:
+            n = raw[offset]
+            ids.append(raw[offset + 1:offset + 1 + n].decode("utf-8"))
+            offset += 1 + n
+    except (IndexError, UnicodeDecodeError):
+        return None
+    return ids
+
+
+def split_heartbeat(heartbeat: Dict) -> Tuple[Dict, Dict]:
+    """(hot 欄位, 其他顯示用欄位)"""
+    hot = {k: heartbeat.get(k) for k in HOT_FIELDS}
+    meta = {k: v for k, v in heartbeat.items() if k not in HOT_FIELDS and v is not None}
+    return hot, meta
+
+
+# ======================================================
+# 批次 → NumPy（nearby 查詢用）
+# ======================================================
+def decode_heartbeats(values: Iterable) -> Dict[str, "np.ndarray"]:
+    """
+    一次解一批 Redis 值（None / 壞掉的略過），回傳欄位 → 陣列：
+        user_id / track_id / artist_id: object
+        timestamp: int64, lat / lng: float64, popularity: uint8
+
+    固定長度的 header 全部接起來一次 np.frombuffer，只有三個 id 需要逐筆切。
+    """
+    import numpy as np
+
+    binary, ids, legacy = [], [], []
+    for raw in values:
+        if not raw:
+            continue
+        if isinstance(raw, str):
+            raw = raw.encode("utf-8")
+        if raw[:1] == b"{":
+            hb = decode_heartbeat(raw)
+            if hb and hb.get("lat") is not None:
+                legacy.append(hb)
+        # 沒有位置的（NaN）留在陣列裡，距離比較時自然會被濾掉
+        elif raw[0] == HEARTBEAT_CODEC_VERSION and len(raw) >= _HEADER.size:
+            record_ids = _decode_ids(raw)
+            if record_ids is not None:
+                binary.append(raw[:_HEADER.size])
+                ids.append(record_ids)
+
+    header = np.frombuffer(b"".join(binary), dtype=np.dtype(_HEADER_DTYPE))
+    ids += [[hb.get(f) for f in ID_FIELDS] for hb in legacy]
+
+    def column(name, dtype):
+        legacy_values = np.array([hb.get(name) or 0 for hb in legacy], dtype=dtype)
+        return np.concatenate([header[name].astype(dtype), legacy_values])
+
+    batch = {
+        field: np.array([row[i] for row in ids], dtype=object)
+        for i, field in enumerate(ID_FIELDS)
+    }
+    batch["timestamp"] = column("timestamp", np.int64)
+    batch["lat"] = column("lat", np.float64)
+    batch["lng"] = column("lng", np.float64)
+    batch["popularity"] = column("popularity", np.uint8)
+    return batch
+
+
+def batch_row(batch: Dict, i: int) -> Dict:
+    """把陣列中的第 i 筆轉回 dict（只給最後要回傳的那幾筆用）"""
+    return {
+        "user_id": batch["user_id"][i],
+        "track_id": batch["track_id"][i],
+        "artist_id": batch["artist_id"][i],
+        "timestamp": int(batch["timestamp"][i]),
+        "lat": float(batch["lat"][i]),
+        "lng": float(batch["lng"][i]),
+        "popularity": int(batch["popularity"][i]),
+    }
+
+
+# ======================================================
+# Pub/Sub message
+# ======================================================
+def encode_pubsub_message(heartbeat: Dict) -> Tuple[bytes, Dict[str, str]]:
+    """
+    data = hot record；歌名 / 歌手名 / genre 等放 attributes（BigQuery 要用），
+    display_name / avatarUrl 不送。
+    """
+    hot, meta = split_heartbeat(heartbeat)
+    attributes = {"encoding": PUBSUB_ENCODING}
+    for key, value in meta.items():
+        if key not in PROFILE_FIELDS:
+            attributes[key] = str(value)
+    return encode_heartbeat(hot), attributes
+
+
+def decode_pubsub_message(data: bytes, attributes: Optional[Dict[str, str]] = None) -> Optional[Dict]:
+    attributes = attributes or {}
+    if attributes.get("encoding") != PUBSUB_ENCODING:
+        # 舊 publisher 送的 JSON
+        try:
+            return json.loads(data.decode("utf-8"))
+        except ValueError:
+            return None
+
+    hb = decode_heartbeat(data)
+    if hb is None:
+        return None
+    hb.update({k: v for k, v in attributes.items() if k != "encoding"})
+    return hb
+
@@ -1,48 +1,98 @@
 # app/services/heartbeat_pubsub.py
 import os
-import json
-from google.cloud import pubsub_v1
+from app.config import settings
+from app.config.gcp_credentials import get_credentials
+from app.services.client_registry import get_or_create
+from app.services.heartbeat_codec import encode_pubsub_message
+from app.services.tracing import traced_client
 
 TOPIC_ID = "heartbeat-topic"
 
-_publisher = None
-_topic_path = None
 
+def _traced(publisher):
+    # publish() 只是排入 batch，等 future.result() 才是真的送到 Pub/Sub
+    return traced_client(publisher, "pubsub", methods={"publish"}, nested={"publish": {"result"}})
 
-def get_publisher():
+def _project_id():
+    return (
+        os.getenv("GCP_PROJECT")
+        or os.getenv("GOOGLE_CLOUD_PROJECT")
+        or os.getenv("PUBSUB_PROJECT_ID")
+        or "spotify-match-project"
+    )
+
+
+def _create_publisher():
+    from google.cloud import pubsub_v1
+
+    # 有 GOOGLE_CLOUD_CREDENTIALS 就共用同一份 credentials；否則（Cloud Run / Functions）走 ADC
+    try:
+        credentials = get_credentials()
+    except Exception:
+        credentials = None
+
+    return _traced(pubsub_v1.PublisherClient(credentials=credentials))
+
+
+def get_publisher(topic_id: str = TOPIC_ID):
     """
     惰性初始化 Pub/Sub Publisher，避免 import 時就連線。
     在 Cloud Functions 上會用 GCP_PROJECT / GOOGLE_CLOUD_PROJECT，
     本地端沒有就 fallback 固定 project_id。
+    所有 topic 共用同一個 PublisherClient，topic_id 只決定回傳的 topic path。
     """
-    global _publisher, _topic_path
-
-    if _publisher is None:
-        project_id = (
-            os.getenv("GCP_PROJECT")
-            or os.getenv("GOOGLE_CLOUD_PROJECT")
-            or os.getenv("PUBSUB_PROJECT_ID")
-            or "spotify-match-project"
-        )
-        _publisher = pubsub_v1.PublisherClient()
-        _topic_path = _publisher.topic_path(project_id, TOPIC_ID)
+    if settings.use_memory_backend():
+        from app.services.memory_backend import get_memory_publisher
+        publisher = get_memory_publisher()
+        return _traced(publisher), publisher.topic_path("memory-project", topic_id)
 
-    return _publisher, _topic_path
+    publisher = get_or_create("pubsub_publisher", _create_publisher)
+    return publisher, publisher.topic_path(_project_id(), topic_id)
 
 
 def publish_heartbeat(data: dict):
     """
-    將 heartbeat JSON 丟到 Pub/Sub topic。
+    將 heartbeat 丟到 Pub/Sub topic：data 是 compact binary record，
+    歌名等欄位放 attributes，display_name / avatarUrl 不送（見 heartbeat_codec）。
     """
-    message = json.dumps(data).encode("utf-8")
-
     try:
+        message, attributes = encode_pubsub_message(data)
         publisher, topic_path = get_publisher()
-        future = publisher.publish(topic_path, message)
+        future = publisher.publish(topic_path, message, **attributes)
         future.result()
         return True
 
     except Exception as e:
         # 不要讓 Render Crash，應該回傳 False
         print("Pub/Sub publish error:", e)
-        return False
\ No newline at end of file
+        return False
+
+
+def publish_heartbeats(items) -> list:
+    """
+    批次版：先全部 publish（client 會自己合併成少數幾個 request），最後才一起等 future。
+    :return: 每筆是否成功（和 items 同順序）
+    """
+    try:
+        publisher, topic_path = get_publisher()
+    except Exception as e:
+        print("Pub/Sub publish error:", e)
+        return [False] * len(items)
+
+    futures = []
+    for data in items:
+        try:
+            message, attributes = encode_pubsub_message(data)
+            futures.append(publisher.publish(topic_path, message, **attributes))
+        except Exception as e:
+            print("Pub/Sub publish error:", e)
+            futures.append(None)
+
+    results = []
+    for future in futures:
+        try:
+            results.append(future is not None and bool(future.result()))
+        except Exception as e:
+            print("Pub/Sub publish error:", e)
+            results.append(False)
+    return results
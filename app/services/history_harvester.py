@@ -0,0 +1,195 @@
+# app/services/history_harvester.py
+"""
+背景 recently-played harvester：不用等使用者打開 App 呼叫 /spotify/sync-recent，
+listening_history 和地區排行也能持續更新。
+
+每個 tick：
+1. 拿到 Redis lock（多個 instance 同時只有一個在跑）
+2. 輪到下一個 shard：spotify_tokens 文件的 harvest_bucket（crc32，0 ~ 1023）切成 HISTORY_HARVEST_SHARDS 段連續範圍，
+   每個 tick 只用 range query 讀自己那段的文件 ID，不用每次掃完整個 collection
+3. 依「該同步了多久」排優先順序：最近有 heartbeat 的人同步間隔短，
+   從沒同步過的人最優先；還沒到期的跳過
+4. sync_recently_played_many 並行同步（全域 Spotify 額度 + process 內限速），
+   last_history_sync_at 最後一次 batch 寫回
+"""
+import math
+import threading
+import time
+import uuid
+
+from app.config.settings import (
+    HISTORY_ACTIVE_WINDOW_SEC,
+    HISTORY_HARVEST_INTERVAL_SEC,
+    HISTORY_HARVEST_MAX_USERS,
+    HISTORY_HARVEST_REQUESTS_PER_MINUTE,
+    HISTORY_HARVEST_SHARDS,
+    HISTORY_HARVEST_WORKERS,
+    HISTORY_SYNC_ACTIVE_INTERVAL_SEC,
+    HISTORY_SYNC_IDLE_INTERVAL_SEC,
+)
+from app.services.firestore_client import get_db
+from app.services.rate_limit import SharedMinuteBudget
+from app.services.redis_service import LAST_ACTIVE_KEY, get_redis
+from app.services.spotify_history import load_sync_users, sync_recently_played_many
+from app.services.spotify_token_service import HARVEST_BUCKET_FIELD, HARVEST_BUCKETS, harvest_bucket_of
+
+HARVEST_LOCK_KEY = "history_harvest:lock"
+HARVEST_SHARD_KEY = "history_harvest:shard"
+
+# 所有 instance 共用的 Spotify 額度
+harvest_budget = SharedMinuteBudget("spotify_history_harvest", HISTORY_HARVEST_REQUESTS_PER_MINUTE)
+
+
+def _shard_range(shard: int, shards: int):
+    """shard 負責的 bucket 範圍 [lo, hi)；shards 最多 HARVEST_BUCKETS 個"""
+    shards = min(max(shards, 1), HARVEST_BUCKETS)
+    lo = math.ceil(shard * HARVEST_BUCKETS / shards)
+    hi = math.ceil((shard + 1) * HARVEST_BUCKETS / shards)
+    return lo, hi
+
+
+def shard_of(user_id: str, shards: int = HISTORY_HARVEST_SHARDS) -> int:
+    shards = min(max(shards, 1), HARVEST_BUCKETS)
+    return harvest_bucket_of(user_id) * shards // HARVEST_BUCKETS
+
+
+def list_token_user_ids(shard: int = None, shards: int = HISTORY_HARVEST_SHARDS):
+    """
+    有連 Spotify 的使用者（spotify_tokens 的文件 ID；不讀 token 內容）。
+    給 shard 就只讀那個 shard 的 bucket 範圍；沒有 harvest_bucket 的舊文件要先跑 backfill_harvest_buckets()。
+    """
+    query = get_db().collection("spotify_tokens")
+    if shard is not None:
+        lo, hi = _shard_range(shard, shards)
+        query = query.where(HARVEST_BUCKET_FIELD, ">=", lo).where(HARVEST_BUCKET_FIELD, "<", hi)
+    return [doc.id for doc in query.select([]).stream()]
+
+
+def backfill_harvest_buckets():
+    """
+    替還沒有 harvest_bucket 的 spotify_tokens 文件補上（上線前存的 token）。
+    一次性的：之後 save_spotify_token 每次都會寫。
+    :return: 補上的文件數
+    """
+    db = get_db()
+    missing = [
+        doc.id for doc in db.collection("spotify_tokens").select([HARVEST_BUCKET_FIELD]).stream()
+        if (doc.to_dict() or {}).get(HARVEST_BUCKET_FIELD) is None
+    ]
+    for start in range(0, len(missing), 400):
+        batch = db.batch()
+        for user_id in missing[start:start + 400]:
+            batch.set(
+                db.collection("spotify_tokens").document(user_id),
+                {HARVEST_BUCKET_FIELD: harvest_bucket_of(user_id)},
+                merge=True,
+            )
+        batch.commit()
+    print(f"[Harvest] backfilled harvest_bucket for {len(missing)} tokens")
+    return len(missing)
+
+
+def _last_active(user_ids):
+    pipe = get_redis().pipeline(transaction=False)
+    for user_id in user_ids:
+        pipe.hget(LAST_ACTIVE_KEY, user_id)
+    return {uid: float(ts or 0) for uid, ts in zip(user_ids, pipe.execute())}
+
+
+# ======================================================
+# 排優先順序
+# ======================================================
+def plan_shard(user_ids, users, last_active, now=None):
+    """
+    :return: 該同步的 user_id，最久沒同步（超過到期時間最多）的排前面；
+             同樣逾期時最近活躍的人優先
+    """
+    now = now or time.time()
+    due = []
+    for user_id in user_ids:
+        active_at = last_active.get(user_id, 0)
+        is_active = now - active_at <= HISTORY_ACTIVE_WINDOW_SEC
+        interval = HISTORY_SYNC_ACTIVE_INTERVAL_SEC if is_active else HISTORY_SYNC_IDLE_INTERVAL_SEC
+
+        last_sync = (users.get(user_id) or {}).get("last_history_sync_at", 0) or 0
+        overdue = now - (last_sync + interval)
+        if overdue >= 0:
+            due.append((-overdue, -active_at, user_id))
+
+    due.sort()
+    return [user_id for _, _, user_id in due]
+
+
+def harvest_shard(shard: int, shards: int = HISTORY_HARVEST_SHARDS, max_users: int = HISTORY_HARVEST_MAX_USERS,
+                  workers: int = HISTORY_HARVEST_WORKERS, user_ids=None):
+    """
+    :param user_ids: 全部有 token 的使用者；沒給就只讀這個 shard 的
+    :return: 統計 dict
+    """
+    if user_ids is None:
+        members = list_token_user_ids(shard, shards)
+    else:
+        members = [uid for uid in user_ids if shard_of(uid, shards) == shard]
+    if not members:
+        return {"shard": shard, "users": 0, "due": 0, "synced_users": 0, "tracks": 0, "errors": 0}
+
+    # 沒有 users 文件的人（只剩 token）不同步：checkpoint 寫不進去，每個 tick 都會重抓重送
+    users = load_sync_users(get_db(), members)
+    syncable = [uid for uid in members if uid in users]
+    due = plan_shard(syncable, users, _last_active(syncable))
+    picked = due[:max_users]
+
+    results = sync_recently_played_many(picked, workers=workers, users=users, budget=harvest_budget)
+
+    stats = {
+        "shard": shard,
+        "users": len(members),
+        "due": len(due),
+        "synced_users": sum(1 for r in results.values() if r.get("status") == "ok"),
+        "tracks": sum(r.get("synced_count", 0) for r in results.values()),
+        "errors": sum(1 for r in results.values() if r.get("status") != "ok"),
+    }
+    print(f"[Harvest] shard {shard}/{shards}: {stats}")
+    return stats
+
+
+# ======================================================
+# 排程：一個 tick 處理下一個 shard
+# ======================================================
+def run_harvest_tick(shards: int = HISTORY_HARVEST_SHARDS):
+    """
+    拿不到 lock（別的 instance 正在跑）就回傳 None。
+    """
+    r = get_redis()
+    token = uuid.uuid4().hex
+    if not r.set(HARVEST_LOCK_KEY, token, ex=max(HISTORY_HARVEST_INTERVAL_SEC * 3, 600), nx=True):
+        return None
+
+    try:
+        shard = (r.incr(HARVEST_SHARD_KEY) - 1) % max(shards, 1)
+        return harvest_shard(shard, shards)
+    finally:
+        # 只放掉自己的 lock（跑太久 lock 過期、被別人拿走的話不要刪）
+        if r.get(HARVEST_LOCK_KEY) == token:
+            r.delete(HARVEST_LOCK_KEY)
+
+
+def harvest_all(shards: int = HISTORY_HARVEST_SHARDS):
+    """一次跑完所有 shard（script / 手動補資料用，不拿 lock）"""
+    return [harvest_shard(shard, shards) for shard in range(shards)]
+
+
+def _harvester_loop(stop_event: threading.Event):
+    while not stop_event.wait(HISTORY_HARVEST_INTERVAL_SEC):
+        try:
+            run_harvest_tick()
+        except Exception as e:
+            print(f"[Harvest] tick failed: {e}")
+
+
+def start_history_harvester() -> threading.Event:
+    """在 daemon thread 裡定期跑 run_harvest_tick；回傳的 event set() 之後停止"""
+    stop_event = threading.Event()
+    thread = threading.Thread(target=_harvester_loop, args=(stop_event,), name="history-harvester", daemon=True)
+    thread.start()
+    return stop_event
@@ -0,0 +1,83 @@
+# app/services/image_variants.py
+"""
+Avatar 圖片處理：Vertex 回傳的是 1024px 的 PNG，但列表只需要小縮圖。
+
+- 像素風的圖顏色很少 → 先做 palette 量化（PNG 會小很多）
+- 縮成 small / medium / large（NEAREST，像素邊緣不會糊掉），各一份 PNG + WebP
+- 檔名含內容 hash，可以放心設一年的 immutable cache header
+"""
+import hashlib
+import io
+from typing import Dict, Optional
+
+from app.config.settings import AVATAR_PREFER_WEBP
+from app.services.storage_client import upload_image_to_gcs
+
+# 邊長（px）；small 給列表縮圖，medium 給配對卡片，large 給個人頁
+AVATAR_VARIANT_SIZES = {
+    "small": 96,
+    "medium": 256,
+    "large": 512,
+}
+AVATAR_PALETTE_COLORS = 64
+AVATAR_CACHE_CONTROL = "public, max-age=31536000, immutable"
+AVATAR_VARIANT_PATH = "avatars/v/{digest}/{name}.{ext}"
+
+# 改了量化 / 縮圖參數就要加版本，不然同一個 hash 會對到舊的 cache
+VARIANTS_VERSION = "1"
+
+
+def _content_digest(image_bytes: bytes) -> str:
+    h = hashlib.sha256(image_bytes)
+    h.update(VARIANTS_VERSION.encode())
+    return h.hexdigest()[:20]
+
+
+def build_variants(image_bytes: bytes) -> Dict[str, tuple]:
+    """
+    :return: { "small": (bytes, content_type, ext), "small_webp": (...), ... }
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(image_bytes)) as src:
+        base = src.convert("RGB")
+
+    variants = {}
+    for name, px in AVATAR_VARIANT_SIZES.items():
+        resized = base.resize((px, px), Image.NEAREST) if base.size != (px, px) else base
+
+        png = io.BytesIO()
+        resized.quantize(colors=AVATAR_PALETTE_COLORS, method=Image.Quantize.MEDIANCUT)\
+            .save(png, format="PNG", optimize=True)
+        variants[name] = (png.getvalue(), "image/png", "png")
+
+        webp = io.BytesIO()
+        resized.save(webp, format="WEBP", lossless=True, method=6)
+        variants[f"{name}_webp"] = (webp.getvalue(), "image/webp", "webp")
+
+    return variants
+
+
+def upload_variants(image_bytes: bytes) -> Dict[str, str]:
+    """
+    產生所有 variant 並上傳 GCS（內容 hash 命名 + 長效 cache header）。
+    :return: { "small": url, "small_webp": url, "medium": url, ... }
+    """
+    digest = _content_digest(image_bytes)
+    urls = {}
+
+    for name, (data, content_type, ext) in build_variants(image_bytes).items():
+        path = AVATAR_VARIANT_PATH.format(digest=digest, name=name, ext=ext)
+        urls[name] = upload_image_to_gcs(path, data, content_type, cache_control=AVATAR_CACHE_CONTROL)
+
+    return urls
+
+
+def avatar_url_for(user_data: dict, size: str = "small") -> Optional[str]:
+    """
+    依 endpoint 需要的尺寸挑 URL；舊使用者沒有 variants 就退回原本的 avatarUrl。
+    """
+    variants = user_data.get("avatar_variants") or {}
+    if AVATAR_PREFER_WEBP and variants.get(f"{size}_webp"):
+        return variants[f"{size}_webp"]
+    return variants.get(size) or user_data.get("avatarUrl") or user_data.get("photo_url")
@@ -0,0 +1,289 @@
+# app/services/match_events.py
+"""
+配對事件 fan-out：swipe 的交易只負責 swipe / match / 收件匣 / 聊天列表，
+其他「配對之後要順便更新」的衍生資料交給 consumer 非同步處理，request path 不變慢。
+
+    process_swipe_batch（配對成立）
+        → publish_match_event()
+        → Pub/Sub match-events-topic → push → /api/internal/match-events
+          （或 local：process 內的 queue + worker thread）
+        → handle_match_event() → MATCH_EVENT_CONSUMERS 逐一執行
+
+consumer 必須 idempotent（Pub/Sub 至少送一次，同一個事件可能收到兩次）。
+"""
+import json
+import queue
+import threading
+import time
+
+from app.config import settings
+from app.config.settings import (
+    MATCH_EVENTS_DELIVERY,
+    MATCH_EVENTS_PUSH_AUDIENCE,
+    MATCH_EVENTS_PUSH_SERVICE_ACCOUNT,
+    MATCH_EVENTS_PUSH_TOKEN,
+)
+from app.services.client_registry import get_or_create
+from app.services.redis_service import get_redis
+
+TOPIC_ID = "match-events-topic"
+EVENT_MATCH_CREATED = "match_created"
+
+# 每個使用者一個 hash：還沒看過的新配對 { match_id: {"user_id": 對方, "created_at": unix 秒} }
+UNSEEN_MATCHES_KEY = "match_unseen:{user_id}"
+# 已讀 watermark：{ match_id: 看過的那次配對的 created_at }；同一個事件重送時 created_at 不會比它新，直接略過
+SEEN_MATCHES_KEY = "match_seen:{user_id}"
+# 兩個 hash 每次寫都續期；比 Pub/Sub 最長保留時間（31 天）長，重送的事件一定還認得出來
+MATCH_NOTIFY_TTL_SEC = 35 * 24 * 3600
+
+
+def _use_local_delivery():
+    return settings.use_memory_backend() or MATCH_EVENTS_DELIVERY == "local"
+
+
+# ======================================================
+# Publish
+# ======================================================
+def publish_match_event(match_id: str, users, created_at=None):
+    """
+    swipe 的交易 commit 之後呼叫；失敗只記 log，不影響這次 swipe。
+    Pub/Sub 模式不等 future.result()（不把 publish 的 round trip 加到 swipe latency 上）。
+    """
+    event = {
+        "type": EVENT_MATCH_CREATED,
+        "match_id": match_id,
+        "users": list(users),
+        "created_at": int(created_at or time.time()),
+    }
+
+    try:
+        if _use_local_delivery():
+            _ensure_local_worker()
+            _local_queue.put(event)
+            return
+
+        from app.services.heartbeat_pubsub import get_publisher
+        publisher, topic_path = get_publisher(TOPIC_ID)
+        future = publisher.publish(topic_path, json.dumps(event).encode("utf-8"), type=EVENT_MATCH_CREATED)
+        if hasattr(future, "add_done_callback"):
+            future.add_done_callback(_log_publish_error)
+    except Exception as e:
+        print(f"[MatchEvents] publish failed for {match_id}: {e}")
+
+
+def _log_publish_error(future):
+    try:
+        future.result()
+    except Exception as e:
+        print(f"[MatchEvents] publish failed: {e}")
+
+
+# ======================================================
+# Local stand-in：沒有 Pub/Sub 時，process 內一個 worker thread 依序處理
+# ======================================================
+_local_queue = queue.Queue()
+_local_worker = None
+_local_lock = threading.Lock()
+
+
+def _ensure_local_worker():
+    global _local_worker
+    with _local_lock:
+        if _local_worker is None or not _local_worker.is_alive():
+            _local_worker = threading.Thread(target=_run_local_worker, name="match-events", daemon=True)
+            _local_worker.start()
+
+
+def _run_local_worker():
+    while True:
+        event = _local_queue.get()
+        try:
+            handle_match_event(event)
+        except Exception as e:
+            print(f"[MatchEvents] local consumer failed for {event.get('match_id')}: {e}")
+        finally:
+            _local_queue.task_done()
+
+
+def drain_local_events(timeout=5.0):
+    """等 local queue 處理完（測試 / script 用）"""
+    deadline = time.time() + timeout
+    while _local_queue.unfinished_tasks and time.time() < deadline:
+        time.sleep(0.01)
+    return _local_queue.unfinished_tasks == 0
+
+
+# ======================================================
+# Consume
+# ======================================================
+def verify_push_request(authorization=None, token=None) -> bool:
+    """
+    push endpoint 的驗證，fail closed：
+    - local delivery / memory backend：沒有 Pub/Sub 會打進來，直接放行
+    - 有設 MATCH_EVENTS_PUSH_AUDIENCE：驗 push subscription 帶的 OIDC JWT（Authorization: Bearer）
+    - 有設 MATCH_EVENTS_PUSH_TOKEN：比對 ?token=
+    - 都沒設：拒絕
+    抓不到 Google 公鑰（TransportError）直接往上丟 → 500，Pub/Sub 會重送
+    """
+    if _use_local_delivery():
+        return True
+
+    if MATCH_EVENTS_PUSH_AUDIENCE and authorization and authorization.startswith("Bearer "):
+        if _verify_push_jwt(authorization[len("Bearer "):]):
+            return True
+
+    if MATCH_EVENTS_PUSH_TOKEN and token:
+        import hmac
+        return hmac.compare_digest(token, MATCH_EVENTS_PUSH_TOKEN)
+
+    return False
+
+
+def _cert_request():
+    """Google 公鑰依 Cache-Control 快取，不是每個 push 都重抓"""
+    def create():
+        import cachecontrol
+        import requests
+        from google.auth.transport import requests as google_requests
+
+        return google_requests.Request(session=cachecontrol.CacheControl(requests.Session()))
+
+    return get_or_create("pubsub_push_certs", create)
+
+
+def _verify_push_jwt(jwt: str) -> bool:
+    from google.oauth2 import id_token
+
+    try:
+        claims = id_token.verify_oauth2_token(jwt, _cert_request(), audience=MATCH_EVENTS_PUSH_AUDIENCE)
+    except ValueError as e:
+        print(f"[MatchEvents] invalid push JWT: {e}")
+        return False
+
+    if MATCH_EVENTS_PUSH_SERVICE_ACCOUNT:
+        return claims.get("email") == MATCH_EVENTS_PUSH_SERVICE_ACCOUNT and bool(claims.get("email_verified"))
+    return True
+
+
+def decode_push_message(envelope: dict):
+    """
+    Pub/Sub push 的 body：{"message": {"data": base64, "attributes": {...}}, "subscription": ...}
+    :return: event dict；格式不對回傳 None
+    """
+    import base64
+
+    message = (envelope or {}).get("message") or {}
+    try:
+        event = json.loads(base64.b64decode(message.get("data") or ""))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(event, dict) or len(event.get("users") or []) != 2:
+        return None
+    return event
+
+
+def handle_match_event(event: dict):
+    """依序執行所有 consumer；任何一個失敗就往上丟（Pub/Sub 會重送，其他 consumer 重跑也沒關係）"""
+    if event.get("type") != EVENT_MATCH_CREATED:
+        return
+    for consumer in MATCH_EVENT_CONSUMERS:
+        consumer(event)
+
+
+def _is_seen(seen_at, created_at):
+    return seen_at is not None and float(seen_at) >= float(created_at or 0)
+
+
+def _record_unseen_match(event):
+    """通知狀態：雙方各記一筆「新配對、還沒看過」；已經標記已讀的（重送的事件）不再記"""
+    a, b = event["users"]
+    match_id = event["match_id"]
+    r = get_redis()
+
+    pipe = r.pipeline(transaction=False)
+    for owner_id in (a, b):
+        pipe.hget(SEEN_MATCHES_KEY.format(user_id=owner_id), match_id)
+    seen = pipe.execute()
+
+    pipe = r.pipeline(transaction=False)
+    for (owner_id, other_id), seen_at in zip(((a, b), (b, a)), seen):
+        if _is_seen(seen_at, event["created_at"]):
+            continue
+        key = UNSEEN_MATCHES_KEY.format(user_id=owner_id)
+        pipe.hset(key, match_id, json.dumps({
+            "user_id": other_id,
+            "created_at": event["created_at"],
+        }))
+        pipe.expire(key, MATCH_NOTIFY_TTL_SEC)
+    pipe.execute()
+
+
+def _drop_from_decks(event):
+    """預先算好的 deck：把配對的兩個人從彼此的 deck 拿掉（下次 rebuild 前不用每次讀取都再過濾）"""
+    from app.services.swipe_deck_service import remove_from_deck
+
+    a, b = event["users"]
+    remove_from_deck(a, {b})
+    remove_from_deck(b, {a})
+
+
+# 聊天列表（match_index）和收件匣已經在 swipe 交易內同步寫好，這裡只放交易外的衍生資料
+MATCH_EVENT_CONSUMERS = [
+    _record_unseen_match,
+    _drop_from_decks,
+]
+
+
+# ======================================================
+# 通知狀態（讀取 / 標記已讀）
+# ======================================================
+def get_unseen_matches(user_id: str):
+    """
+    :return: [{match_id, user_id, created_at}]，新的在前面
+    _record_unseen_match 檢查 watermark 跟寫入之間剛好標記已讀的，這裡再濾一次並順便刪掉
+    """
+    key = UNSEEN_MATCHES_KEY.format(user_id=user_id)
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.hgetall(key)
+    pipe.hgetall(SEEN_MATCHES_KEY.format(user_id=user_id))
+    raw, seen = pipe.execute()
+
+    entries, stale = [], []
+    for match_id, value in raw.items():
+        entry = {"match_id": match_id, **json.loads(value)}
+        if _is_seen(seen.get(match_id), entry.get("created_at")):
+            stale.append(match_id)
+        else:
+            entries.append(entry)
+    if stale:
+        get_redis().hdel(key, *stale)
+
+    entries.sort(key=lambda e: e.get("created_at") or 0, reverse=True)
+    return entries
+
+
+def mark_matches_seen(user_id: str, match_ids=None):
+    """
+    match_ids 沒給就全部標記已讀。
+    記下每個配對看過的 created_at（watermark），之後同一個事件重送也不會又變成未讀。
+    """
+    r = get_redis()
+    key = UNSEEN_MATCHES_KEY.format(user_id=user_id)
+    seen_key = SEEN_MATCHES_KEY.format(user_id=user_id)
+
+    raw = r.hgetall(key)
+    match_ids = list(match_ids) if match_ids else list(raw)
+    if not match_ids:
+        return
+
+    now = int(time.time())
+    watermark = {}
+    for match_id in match_ids:
+        value = raw.get(match_id)
+        watermark[match_id] = json.loads(value).get("created_at") or now if value else now
+
+    pipe = r.pipeline(transaction=False)
+    pipe.hset(seen_key, mapping=watermark)
+    pipe.expire(seen_key, MATCH_NOTIFY_TTL_SEC)
+    pipe.hdel(key, *match_ids)
+    pipe.execute()
@@ -1,51 +1,270 @@
 from google.cloud import firestore
 from app.services.firestore_client import get_db
+from app.services.swipe_index_service import (
+    record_swipes,
+    register_likes,
+    invalidate_liked_by,
+    get_liked_back,
+    clear_likes,
+)
+from app.services.pagination import paginate_query
+from app.services.match_events import publish_match_event
+from app.services.image_variants import avatar_url_for
 from datetime import datetime
 import pytz
 
-def process_swipe_transaction(from_user_id: str, target_user_id: str, action: str):
+# 每個使用者底下的 denormalized 收件匣 / 寄件匣（liked-me / my-likes 直接查這裡）
+LIKES_RECEIVED = "likes_received"   # 喜歡我、但我還沒滑過的人
+LIKES_SENT = "likes_sent"           # 我喜歡、但還沒配對的人
+MATCH_INDEX = "match_index"         # 聊天列表用：每個配對一筆，只存列表需要的欄位
+
+# bulk swipe 一個 WriteBatch 放幾個 swipe（每個最多 4 個寫入，Firestore 一個 batch 上限 500）
+SWIPE_BATCH_CHUNK = 100
+
+# match-list 只投影這些欄位
+MATCH_INDEX_FIELDS = [
+    "match_id", "user_id", "display_name", "avatarUrl",
+    "last_message", "last_message_time", "last_activity_at", "is_active",
+]
+
+
+def _box_ref(db, owner_id: str, box: str, other_id: str):
+    return db.collection("users").document(owner_id).collection(box).document(other_id)
+
+
+def _match_index_entry(match_id: str, other_id: str, profile: dict, matched_at):
+    return {
+        "match_id": match_id,
+        "user_id": other_id,
+        "display_name": profile["display_name"],
+        "avatarUrl": profile["avatarUrl"],
+        "is_active": True,
+        "last_message": "",
+        "last_message_time": None,
+        # 排序用：有訊息就是最後訊息時間，還沒聊過就用配對時間
+        "last_activity_at": matched_at,
+    }
+
+
+def _load_like_profiles(db, user_ids):
     """
-    處理滑動邏輯的進入點。
-    設定好 Reference 後，啟動 Firestore Transaction。
+    一次 get_all 批次讀取 profile（名字 + 頭像），給收件匣 / 寄件匣 denormalize 用。
+    """
+    refs = [db.collection("users").document(uid) for uid in user_ids]
+    profiles = {
+        uid: {"display_name": "Unknown User", "avatarUrl": None}
+        for uid in user_ids
+    }
+
+    for doc in db.get_all(refs, field_paths=["display_name", "name", "avatarUrl", "avatar_variants", "photo_url"]):
+        if not doc.exists:
+            continue
+        user_data = doc.to_dict()
+        profiles[doc.id] = {
+            # 嘗試取得 display_name，若沒有則找 name，再沒有則預設值
+            "display_name": user_data.get("display_name", user_data.get("name", "Unknown User")),
+            # 列表只需要小縮圖；沒有 variants 的舊使用者退回 avatarUrl / photo_url
+            "avatarUrl": avatar_url_for(user_data, "small"),
+        }
+
+    return profiles
+
+
+def _swipe_refs(db, from_user_id: str, target_user_id: str):
+    """
+    一次 swipe 會碰到的所有 Reference：
+    :return: (swipe_ref, reverse_swipe_ref, match_ref, box_refs)
     """
-    db = get_db()
-    
     # 1. 設定 Swipes 文件 ID：使用「主動方_被動方」確保唯一性
     # 這樣 A 滑 B 永遠只會有一筆紀錄，若重複滑動則會覆蓋或更新
-    swipe_doc_id = f"{from_user_id}_{target_user_id}"
-    swipe_ref = db.collection("swipes").document(swipe_doc_id)
+    swipe_ref = db.collection("swipes").document(f"{from_user_id}_{target_user_id}")
 
     # 2. 設定反向查詢 ID：檢查「對方有沒有滑過我」
-    reverse_swipe_doc_id = f"{target_user_id}_{from_user_id}"
-    reverse_swipe_ref = db.collection("swipes").document(reverse_swipe_doc_id)
+    reverse_swipe_ref = db.collection("swipes").document(f"{target_user_id}_{from_user_id}")
 
     # 3. 設定 Matches 文件 ID：使用「排序後的 ID 組合」
     # 確保 user1 和 user2 無論誰先滑誰，產生的 Match ID 都是同一個 (如 user1_user2)
     sorted_ids = sorted([from_user_id, target_user_id])
-    match_doc_id = f"{sorted_ids[0]}_{sorted_ids[1]}"
-    match_ref = db.collection("matches").document(match_doc_id)
+    match_ref = db.collection("matches").document(f"{sorted_ids[0]}_{sorted_ids[1]}")
+
+    # 4. 收件匣 / 寄件匣 / 聊天列表的 Reference
+    box_refs = {
+        "my_sent": _box_ref(db, from_user_id, LIKES_SENT, target_user_id),
+        "my_received": _box_ref(db, from_user_id, LIKES_RECEIVED, target_user_id),
+        "their_sent": _box_ref(db, target_user_id, LIKES_SENT, from_user_id),
+        "their_received": _box_ref(db, target_user_id, LIKES_RECEIVED, from_user_id),
+        "my_match": _box_ref(db, from_user_id, MATCH_INDEX, target_user_id),
+        "their_match": _box_ref(db, target_user_id, MATCH_INDEX, from_user_id),
+    }
+    return swipe_ref, reverse_swipe_ref, match_ref, box_refs
+
 
-    # 4. 啟動交易
+def _run_swipe_transaction(db, profiles, from_user_id: str, target_user_id: str, action: str):
+    swipe_ref, reverse_swipe_ref, match_ref, box_refs = _swipe_refs(db, from_user_id, target_user_id)
     transaction = db.transaction()
+    return _execute_swipe_transaction(
+        transaction,
+        swipe_ref,
+        reverse_swipe_ref,
+        match_ref,
+        box_refs,
+        profiles,
+        from_user_id,
+        target_user_id,
+        action
+    )
 
-    # 執行交易內的邏輯
+
+def process_swipe_transaction(from_user_id: str, target_user_id: str, action: str):
+    """
+    處理單筆滑動的進入點。
+    先查 incoming likes（Redis liked_by set）再決定要不要開交易：
+    - PASS、或對方「一定還沒 LIKE 我」的 LIKE：不可能配對，直接 batch 寫入
+    - 對方可能 LIKE 過我：才啟動 Firestore Transaction 讀反向 swipe 確認配對
+    大部分 LIKE 不會被回應，所以大部分 swipe 都不用開交易（流程見 process_swipe_batch）。
+    liked_by 不可信時（見 register_likes：登記失敗過、Redis 可能淘汰 set）每個 LIKE 都照舊走交易。
+    """
     try:
-        result = _execute_swipe_transaction(
-            transaction, 
-            swipe_ref, 
-            reverse_swipe_ref, 
-            match_ref, 
-            from_user_id, 
-            target_user_id, 
-            action
-        )
-        return result
+        result = process_swipe_batch(from_user_id, [(target_user_id, action)])[0]
     except Exception as e:
-        print(f"Transaction failed: {e}")
+        print(f"Swipe failed: {e}")
         raise e
 
+    return {
+        "status": "success",
+        "is_match": result["is_match"],
+        "match_id": result["match_id"]
+    }
+
+
+def process_swipe_batch(from_user_id: str, swipes):
+    """
+    一次處理一串連續滑動（bulk swipe；單筆 /swipe 也走這裡）。
+    :param swipes: [(target_user_id, action)]，同一個 target 只算最後一次
+
+    - PASS、以及「對方一定還沒 LIKE 我」的 LIKE：不可能配對，用 WriteBatch 一次寫完（不開交易）
+    - 對方可能 LIKE 過我（liked_by set 命中）：才開 transaction，讀反向 swipe 確認配對
+    - batch 寫完之後再查一次 liked_by：寫入期間對方剛好也 LIKE 我的，補走 transaction，
+      兩邊都不會錯過配對（見 register_likes）
+    - liked_by 不可信（還沒 rebuild 過 / 有登記失敗過）：所有 LIKE 都走 transaction，背景 rebuild
+
+    :return: 和 swipes 同順序的 [{target_user_id, action, is_match, match_id}]
+    """
+    actions = {}
+    for target_user_id, action in swipes:
+        actions.pop(target_user_id, None)
+        actions[target_user_id] = action
+
+    db = get_db()
+    profiles = _load_like_profiles(db, [from_user_id, *actions])
+
+    likes = [t for t, a in actions.items() if a == "LIKE"]
+    passes = [t for t, a in actions.items() if a != "LIKE"]
+
+    try:
+        registered = register_likes(from_user_id, likes)
+    except Exception as e:
+        # 登記可能沒寫進去：liked_by 從現在起不可信（對方之後 LIKE 我時不能靠它判斷），
+        # 連 invalidate 都失敗就讓這次 swipe 失敗，不能留下一筆 liked_by 裡沒有的 LIKE
+        print(f"Incoming like registration failed, invalidating liked_by: {e}")
+        invalidate_liked_by()
+        registered = None
+
+    if registered is None:
+        batched_likes, liked_back, swiped_me = [], set(likes), set()
+    else:
+        liked_back, swiped_me = registered
+        batched_likes = [t for t in likes if t not in liked_back]
+
+    results = {}
+    now = datetime.now(pytz.utc)
+    pending = [(t, "LIKE") for t in batched_likes] + [(t, actions[t]) for t in passes]
+
+    for start in range(0, len(pending), SWIPE_BATCH_CHUNK):
+        batch = db.batch()
+        for target_user_id, action in pending[start:start + SWIPE_BATCH_CHUNK]:
+            swipe_ref, _, _, box_refs = _swipe_refs(db, from_user_id, target_user_id)
+            _write_swipe(batch, swipe_ref, box_refs, profiles, from_user_id, target_user_id, action, now,
+                         is_match=False, reverse_exists=target_user_id in swiped_me)
+            results[target_user_id] = {"is_match": False, "match_id": None}
+        batch.commit()
+
+    # batch 寫入期間對方也 LIKE 了我 → 這些也要確認配對
+    if batched_likes:
+        try:
+            liked_back |= get_liked_back(from_user_id, batched_likes)
+        except Exception as e:
+            print(f"Incoming like recheck failed, using transactions: {e}")
+            liked_back |= set(batched_likes)
+
+    for target_user_id in likes:
+        if target_user_id in liked_back:
+            result = _run_swipe_transaction(db, profiles, from_user_id, target_user_id, "LIKE")
+            results[target_user_id] = {"is_match": result["is_match"], "match_id": result["match_id"]}
+            # 交易 commit 之後才發事件（通知 / deck 等衍生資料交給 consumer，見 match_events）
+            if result["is_match"]:
+                publish_match_event(result["match_id"], [from_user_id, target_user_id])
+
+    try:
+        record_swipes(from_user_id, list(actions))
+        clear_likes(from_user_id, passes)
+    except Exception as e:
+        print(f"Swipe index update failed: {e}")
+
+    return [
+        {"target_user_id": t, "action": a, **results[t]}
+        for t, a in actions.items()
+    ]
+
+
+def _write_swipe(writer, swipe_ref, box_refs, profiles, from_user_id, target_user_id, action, now, is_match, reverse_exists):
+    """
+    swipe 紀錄 + 收件匣 / 寄件匣同步（transaction 和 WriteBatch 共用，兩者都有 set / delete）。
+    :param reverse_exists: 對方是否已經滑過我
+    """
+    # 記錄我的滑動動作
+    swipe_data = {
+        "from_user_id": from_user_id,
+        "to_user_id": target_user_id,
+        "action": action,
+        "created_at": now
+    }
+    # 使用 merge=True，如果未來有加欄位不會被洗掉
+    writer.set(swipe_ref, swipe_data, merge=True)
+
+    # 我已經滑過對方 → 對方不再是「喜歡我但我還沒處理」
+    writer.delete(box_refs["my_received"])
+
+    if action != "LIKE":
+        # PASS：把之前的 LIKE 從兩邊的清單中移除
+        writer.delete(box_refs["my_sent"])
+        writer.delete(box_refs["their_received"])
+    elif is_match:
+        # 配對成功：雙方都不再是「我喜歡但未配對」
+        writer.delete(box_refs["their_sent"])
+        writer.delete(box_refs["my_sent"])
+    else:
+        target = profiles[target_user_id]
+        writer.set(box_refs["my_sent"], {
+            "user_id": target_user_id,
+            "display_name": target["display_name"],
+            "avatarUrl": target["avatarUrl"],
+            "liked_at": now
+        })
+
+        # 對方還沒滑過我，才會出現在對方的 liked-me
+        if not reverse_exists:
+            me = profiles[from_user_id]
+            writer.set(box_refs["their_received"], {
+                "user_id": from_user_id,
+                "display_name": me["display_name"],
+                "avatarUrl": me["avatarUrl"],
+                "liked_at": now
+            })
+
+
 @firestore.transactional
-def _execute_swipe_transaction(transaction, swipe_ref, reverse_swipe_ref, match_ref, from_user_id, target_user_id, action):
+def _execute_swipe_transaction(transaction, swipe_ref, reverse_swipe_ref, match_ref, box_refs, profiles, from_user_id, target_user_id, action):
     """
     在 Transaction 內部執行的邏輯。
     規則：必須先讀取 (get)，再寫入 (set/update)。
@@ -55,31 +274,27 @@ def _execute_swipe_transaction(transaction, swipe_ref, reverse_swipe_ref, match_
     
     # 只有當我是 "LIKE" 時，才需要去檢查對方是否已經 LIKE 我
     reverse_doc_snapshot = None
+    match_snapshot = None
     if action == "LIKE":
         reverse_doc_snapshot = reverse_swipe_ref.get(transaction=transaction)
+        # 已經配對過（重複 LIKE）：不能再寫一次 match / 聊天列表，也不算新配對
+        match_snapshot = match_ref.get(transaction=transaction)
 
-    # --- STEP 2: 寫入 (Write) ---
+    now = datetime.now(pytz.utc)
 
-    # 記錄我的滑動動作
-    swipe_data = {
-        "from_user_id": from_user_id,
-        "to_user_id": target_user_id,
-        "action": action,
-        "created_at": datetime.now(pytz.utc)
-    }
-    # 使用 merge=True，如果未來有加欄位不會被洗掉
-    transaction.set(swipe_ref, swipe_data, merge=True)
-
-    # --- STEP 3: 判斷配對 (Match Logic) ---
-    is_match = False
+    # --- STEP 2: 判斷配對 (Match Logic) ---
+    is_match = False      # 這次 swipe 新成立的配對
+    mutual = False        # 雙方都是 LIKE（新配對或早就配對過）
     
     # 配對成立條件：
     # 1. 我是 LIKE
     # 2. 對方資料存在 (reverse_doc_snapshot.exists)
     # 3. 對方也是 LIKE
+    # 4. 配對文件還不存在
     if action == "LIKE" and reverse_doc_snapshot and reverse_doc_snapshot.exists:
         reverse_data = reverse_doc_snapshot.to_dict()
-        if reverse_data.get("action") == "LIKE":
+        mutual = reverse_data.get("action") == "LIKE"
+        if mutual and not (match_snapshot and match_snapshot.exists):
             is_match = True
             
             # 寫入配對資料
@@ -90,8 +305,21 @@ def _execute_swipe_transaction(transaction, swipe_ref, reverse_swipe_ref, match_
                 "last_message": "",
                 "last_message_time": None
             }
-            # 如果配對已存在，merge=True 會保留舊資料；若不存在則建立
-            transaction.set(match_ref, match_data, merge=True)
+            transaction.set(match_ref, match_data)
+
+            # 雙方的聊天列表各放一筆（存的是「對方」的資料）
+            for owner_key, other_id in (("my_match", target_user_id), ("their_match", from_user_id)):
+                transaction.set(box_refs[owner_key], _match_index_entry(
+                    match_ref.id, other_id, profiles[other_id], match_data["created_at"]
+                ), merge=True)
+
+    # --- STEP 3: 寫入我的 swipe + 同步收件匣 / 寄件匣 ---
+    # 已經配對過的人也不該出現在 likes_sent / likes_received，所以這裡用 mutual
+    _write_swipe(
+        transaction, swipe_ref, box_refs, profiles, from_user_id, target_user_id, action, now,
+        is_match=mutual,
+        reverse_exists=bool(reverse_doc_snapshot and reverse_doc_snapshot.exists),
+    )
 
     return {
         "status": "success",
@@ -99,143 +327,208 @@ def _execute_swipe_transaction(transaction, swipe_ref, reverse_swipe_ref, match_
         "match_id": match_ref.id if is_match else None
     }
 
-def get_users_who_liked_me(current_user_id: str):
+def _list_like_box(current_user_id: str, box: str, limit: int, cursor: str = None):
     """
-    取得「右滑我」但「我還沒滑過他」的使用者列表，並包含詳細資料。
+    :return: (使用者列表, next_cursor)
     """
     db = get_db()
+    box_ref = db.collection("users").document(current_user_id).collection(box)
 
-    # 1. 查詢「誰喜歡我」
-    # 使用 keyword arguments 以減少警告
-    incoming_query = db.collection("swipes")\
-        .where(field_path="to_user_id", op_string="==", value=current_user_id)\
-        .where(field_path="action", op_string="==", value="LIKE")
-    
-    incoming_docs = incoming_query.stream()
-    
-    incoming_likes_map = {}
-    for doc in incoming_docs:
-        data = doc.to_dict()
-        sender_id = data.get("from_user_id")
-        created_at = data.get("created_at")
-        if sender_id:
-            incoming_likes_map[sender_id] = created_at
+    docs, next_cursor = paginate_query(box_ref, "liked_at", limit, cursor)
+    return [doc.to_dict() for doc in docs], next_cursor
 
-    if not incoming_likes_map:
-        return []
 
-    # 2. 查詢「我滑過誰」 (用來過濾)
-    my_actions_query = db.collection("swipes")\
-        .where(field_path="from_user_id", op_string="==", value=current_user_id)
-    
-    my_actions_docs = my_actions_query.stream()
-    
-    already_swiped_ids = set()
-    for doc in my_actions_docs:
-        data = doc.to_dict()
-        target_id = data.get("to_user_id")
-        if target_id:
-            already_swiped_ids.add(target_id)
+def _count_like_box(current_user_id: str, box: str) -> int:
+    db = get_db()
+    box_ref = db.collection("users").document(current_user_id).collection(box)
+    result = box_ref.count().get()
+    return int(result[0][0].value)
+
+
+def get_users_who_liked_me(current_user_id: str, limit: int = 50, cursor: str = None):
+    """
+    取得「右滑我」但「我還沒滑過他」的使用者列表，並包含詳細資料。
+    直接讀 users/{uid}/likes_received（swipe 交易內同步維護），最新的在前面。
+    """
+    return _list_like_box(current_user_id, LIKES_RECEIVED, limit, cursor)
 
-    # 3. 整合與抓取 User 資料
-    pending_users = []
-    
-    for user_id, liked_at in incoming_likes_map.items():
-        if user_id not in already_swiped_ids:
-            
-            user_ref = db.collection("users").document(user_id)
-            user_doc = user_ref.get()
-            
-            # 預設值
-            display_name = "Unknown User"
-            avatarUrl = None
-            
-            if user_doc.exists:
-                user_data = user_doc.to_dict()
-                # 嘗試取得 display_name，若沒有則找 name，再沒有則預設值
-                display_name = user_data.get("display_name", user_data.get("name", "Unknown User"))
-                # 嘗試取得 avatarUrl，若沒有則找 photo_url
-                avatarUrl = user_data.get("avatarUrl", user_data.get("photo_url", None))
-            
-            pending_users.append({
-                "user_id": user_id,
-                "liked_at": liked_at,
-                "display_name": display_name,  # 修正：Key 改為 display_name
-                "avatarUrl": avatarUrl         # 修正：Key 改為 avatarUrl
-            })
 
-    # 4. 排序
-    pending_users.sort(key=lambda x: x["liked_at"], reverse=True)
+def count_users_who_liked_me(current_user_id: str) -> int:
+    return _count_like_box(current_user_id, LIKES_RECEIVED)
 
-    return pending_users
 
-def get_users_i_liked(current_user_id: str):
+def get_users_i_liked(current_user_id: str, limit: int = 50, cursor: str = None):
     """
     取得「我右滑過」但「尚未配對成功」的使用者列表。
+    直接讀 users/{uid}/likes_sent（swipe 交易內同步維護），最新的在前面。
+    """
+    return _list_like_box(current_user_id, LIKES_SENT, limit, cursor)
+
+
+def count_users_i_liked(current_user_id: str) -> int:
+    return _count_like_box(current_user_id, LIKES_SENT)
+
+
+# ======================================================
+# 聊天列表：直接讀 users/{uid}/match_index，已依最後活動時間排序
+# ======================================================
+def get_match_list(current_user_id: str, limit: int = 20, cursor: str = None):
+    """
+    :return: (配對列表, next_cursor)
     """
     db = get_db()
+    index_ref = db.collection("users").document(current_user_id).collection(MATCH_INDEX)
 
-    # 1. 查詢我喜歡的人 (My Likes)
-    my_likes_query = db.collection("swipes")\
-        .where(field_path="from_user_id", op_string="==", value=current_user_id)\
-        .where(field_path="action", op_string="==", value="LIKE")
-    
-    my_likes_docs = my_likes_query.stream()
-    
-    # 建立字典: { target_user_id: swiped_at_time }
-    my_likes_map = {}
-    for doc in my_likes_docs:
+    docs, next_cursor = paginate_query(
+        index_ref.select(MATCH_INDEX_FIELDS), "last_activity_at", limit, cursor
+    )
+    return [doc.to_dict() for doc in docs], next_cursor
+
+
+# ======================================================
+# 送出訊息：寫入 messages，並同步更新 match 與雙方的聊天列表
+# ======================================================
+def send_match_message(match_id: str, sender_id: str, text: str):
+    """
+    :raise LookupError: 配對不存在
+    :raise PermissionError: sender 不在這個配對裡
+    """
+    db = get_db()
+    match_ref = db.collection("matches").document(match_id)
+    match_doc = match_ref.get()
+
+    if not match_doc.exists:
+        raise LookupError("Match not found")
+
+    users_list = match_doc.to_dict().get("users", [])
+    if sender_id not in users_list or len(users_list) != 2:
+        raise PermissionError("Not a member of this match")
+
+    other_id = users_list[0] if users_list[1] == sender_id else users_list[1]
+    now = datetime.now(pytz.utc)
+
+    message = {
+        "sender_id": sender_id,
+        "text": text,
+        "created_at": now
+    }
+    summary = {
+        "last_message": text,
+        "last_message_time": now
+    }
+
+    batch = db.batch()
+    message_ref = match_ref.collection("messages").document()
+    batch.set(message_ref, message)
+    batch.update(match_ref, summary)
+    for owner_id, peer_id in ((sender_id, other_id), (other_id, sender_id)):
+        batch.set(_box_ref(db, owner_id, MATCH_INDEX, peer_id), {
+            **summary,
+            "last_activity_at": now
+        }, merge=True)
+    batch.commit()
+
+    return {"message_id": message_ref.id, **message}
+
+
+# ======================================================
+# 從 swipes / matches 重建所有人的收件匣 / 寄件匣（上線前跑一次）
+# ======================================================
+def rebuild_like_inboxes():
+    db = get_db()
+
+    # 1. 所有滑動紀錄：{(from, to): (action, created_at)}
+    swipes = {}
+    for doc in db.collection("swipes").stream():
         data = doc.to_dict()
-        target_id = data.get("to_user_id")
-        created_at = data.get("created_at")
-        if target_id:
-            my_likes_map[target_id] = created_at
-
-    if not my_likes_map:
-        return []
-
-    # 2. 查詢已經配對的人 (Matched Users)
-    # 我們只要查詢 matches 集合中包含 current_user_id 的文件
-    matches_query = db.collection("matches")\
-        .where(field_path="users", op_string="array_contains", value=current_user_id)
-    
-    matches_docs = matches_query.stream()
-    
-    matched_user_ids = set()
-    for doc in matches_docs:
+        from_id = data.get("from_user_id")
+        to_id = data.get("to_user_id")
+        if from_id and to_id:
+            swipes[(from_id, to_id)] = (data.get("action"), data.get("created_at"))
+
+    # 2. 已配對的組合
+    matched = set()
+    for doc in db.collection("matches").stream():
+        users_list = doc.to_dict().get("users", [])
+        if len(users_list) == 2:
+            matched.add(frozenset(users_list))
+
+    # 3. 算出每個人的收件匣 / 寄件匣
+    entries = []   # (owner_id, box, other_id, liked_at)
+    for (from_id, to_id), (action, created_at) in swipes.items():
+        if action != "LIKE":
+            continue
+        if frozenset([from_id, to_id]) not in matched:
+            entries.append((from_id, LIKES_SENT, to_id, created_at))
+        if (to_id, from_id) not in swipes:
+            entries.append((to_id, LIKES_RECEIVED, from_id, created_at))
+
+    # 4. 批次讀 profile
+    profile_ids = list({other_id for _, _, other_id, _ in entries})
+    profiles = {}
+    for i in range(0, len(profile_ids), 300):
+        profiles.update(_load_like_profiles(db, profile_ids[i:i + 300]))
+
+    # 5. 批次寫入（Firestore batch 上限 500）
+    batch = db.batch()
+    pending = 0
+    for owner_id, box, other_id, liked_at in entries:
+        batch.set(_box_ref(db, owner_id, box, other_id), {
+            "user_id": other_id,
+            "display_name": profiles[other_id]["display_name"],
+            "avatarUrl": profiles[other_id]["avatarUrl"],
+            "liked_at": liked_at
+        })
+        pending += 1
+        if pending >= 400:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+
+    print(f"[LikeInbox] Rebuilt {len(entries)} inbox / outbox entries")
+    return len(entries)
+
+
+# ======================================================
+# 從 matches 重建所有人的聊天列表（上線前跑一次）
+# ======================================================
+def rebuild_match_index():
+    db = get_db()
+
+    entries = []   # (owner_id, other_id, match_id, match_data)
+    for doc in db.collection("matches").stream():
         data = doc.to_dict()
         users_list = data.get("users", [])
-        # 找出配對中「另一個」人的 ID
-        for uid in users_list:
-            if uid != current_user_id:
-                matched_user_ids.add(uid)
+        if len(users_list) != 2:
+            continue
+        entries.append((users_list[0], users_list[1], doc.id, data))
+        entries.append((users_list[1], users_list[0], doc.id, data))
 
-    # 3. 過濾並抓取 User 詳細資料
-    sent_users = []
-    
-    for user_id, liked_at in my_likes_map.items():
-        # 如果這個人不在配對名單中 -> 代表是單方面喜歡 (或對方按了 PASS)
-        if user_id not in matched_user_ids:
-            
-            user_ref = db.collection("users").document(user_id)
-            user_doc = user_ref.get()
-            
-            display_name = "Unknown User"
-            avatarUrl = None
-            
-            if user_doc.exists:
-                user_data = user_doc.to_dict()
-                display_name = user_data.get("display_name", user_data.get("name", "Unknown User"))
-                avatarUrl = user_data.get("avatarUrl", user_data.get("photo_url", None))
-            
-            sent_users.append({
-                "user_id": user_id,
-                "liked_at": liked_at,
-                "display_name": display_name,
-                "avatarUrl": avatarUrl
-            })
+    profile_ids = list({other_id for _, other_id, _, _ in entries})
+    profiles = {}
+    for i in range(0, len(profile_ids), 300):
+        profiles.update(_load_like_profiles(db, profile_ids[i:i + 300]))
 
-    # 4. 排序 (最新的在前面)
-    sent_users.sort(key=lambda x: x["liked_at"], reverse=True)
+    batch = db.batch()
+    pending = 0
+    for owner_id, other_id, match_id, data in entries:
+        entry = _match_index_entry(match_id, other_id, profiles[other_id], data.get("created_at"))
+        entry.update({
+            "is_active": data.get("is_active", True),
+            "last_message": data.get("last_message", ""),
+            "last_message_time": data.get("last_message_time"),
+            "last_activity_at": data.get("last_message_time") or data.get("created_at"),
+        })
+        batch.set(_box_ref(db, owner_id, MATCH_INDEX, other_id), entry)
+        pending += 1
+        if pending >= 400:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
 
-    return sent_users
\ No newline at end of file
+    print(f"[MatchIndex] Rebuilt {len(entries)} match index entries")
+    return len(entries)
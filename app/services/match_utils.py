@@ -2,10 +2,10 @@
 
 import numpy as np
 import geohash2
-from google.cloud import bigquery
 from app.services.bigquery_client import get_bq_client
 from app.services.firestore_client import get_db
 from app.services.user_vector_service import safe_array
+from app.services.image_variants import avatar_url_for
 
 
 # ======================================================
@@ -34,11 +34,11 @@ def get_all_active_users():
     df = client.query("""
         SELECT DISTINCT user_id
         FROM (
-            SELECT user_id FROM `spotify-match-project.user_event.user_top_tracks`
+            SELECT user_id FROM `spotify-match-project.user_event.user_top_tracks_latest`
             UNION DISTINCT
-            SELECT user_id FROM `spotify-match-project.user_event.user_top_artists`
+            SELECT user_id FROM `spotify-match-project.user_event.user_top_artists_latest`
             UNION DISTINCT
-            SELECT user_id FROM `spotify-match-project.user_event.user_favorite_tracks`
+            SELECT user_id FROM `spotify-match-project.user_event.user_favorite_tracks_latest`
         )
     """).to_dataframe()
     return df["user_id"].tolist()
@@ -76,7 +76,7 @@ def get_shared_artists(user_a: str, user_b: str, limit: int = 5):
     client = get_bq_client()
     df = client.query(f"""
         SELECT artist_id, ANY_VALUE(artist_name) AS artist_name
-        FROM `spotify-match-project.user_event.user_top_artists`
+        FROM `spotify-match-project.user_event.user_top_artists_latest`
         WHERE user_id IN ('{user_a}', '{user_b}')
         GROUP BY artist_id
         HAVING COUNT(DISTINCT user_id) = 2
@@ -93,7 +93,7 @@ def get_shared_tracks(user_a: str, user_b: str, limit: int = 5):
     client = get_bq_client()
     df = client.query(f"""
         SELECT track_id, ANY_VALUE(track_name) AS track_name
-        FROM `spotify-match-project.user_event.user_top_tracks`
+        FROM `spotify-match-project.user_event.user_top_tracks_latest`
         WHERE user_id IN ('{user_a}', '{user_b}')
         GROUP BY track_id
         HAVING COUNT(DISTINCT user_id) = 2
@@ -166,7 +166,7 @@ def get_user_profile(user_id: str):
     data = doc.to_dict() or {}
     return {
         "name": data.get("name") or data.get("display_name") or "Guest",
-        "avatarUrl": data.get("avatarUrl") or "https://example.com/default-avatar.png",
+        "avatarUrl": avatar_url_for(data, "medium") or "https://example.com/default-avatar.png",
     }
 
 
@@ -178,7 +178,7 @@ def get_user_top_songs(user_id: str, limit: int = 10):
 
     df = client.query(f"""
         SELECT track_name, artist_name, album_image
-        FROM `spotify-match-project.user_event.user_top_tracks`
+        FROM `spotify-match-project.user_event.user_top_tracks_latest`
         WHERE user_id = '{user_id}'
         ORDER BY rank ASC
         LIMIT {limit}
@@ -1,11 +1,12 @@
 # app/services/match_utils_optimized.py
 
 import numpy as np
-from google.cloud import bigquery
+from collections import Counter
 from app.services.bigquery_client import get_bq_client
 from app.services.firestore_client import get_db
 from app.services.user_vector_service import safe_array
-from app.services.match_utils import similarity_score, build_similarity_reason
+from app.services.match_utils import build_similarity_reason
+from app.services.image_variants import avatar_url_for
 
 
 # ======================================================
@@ -16,11 +17,11 @@ def get_all_active_users():
     df = client.query("""
         SELECT DISTINCT user_id
         FROM (
-            SELECT user_id FROM `spotify-match-project.user_event.user_top_tracks`
+            SELECT user_id FROM `spotify-match-project.user_event.user_top_tracks_latest`
             UNION DISTINCT
-            SELECT user_id FROM `spotify-match-project.user_event.user_top_artists`
+            SELECT user_id FROM `spotify-match-project.user_event.user_top_artists_latest`
             UNION DISTINCT
-            SELECT user_id FROM `spotify-match-project.user_event.user_favorite_tracks`
+            SELECT user_id FROM `spotify-match-project.user_event.user_favorite_tracks_latest`
         )
     """).to_dataframe()
     return df["user_id"].tolist()
@@ -46,6 +47,50 @@ def load_all_user_vectors():
     return vectors
 
 
+# ======================================================
+# 向量矩陣化：給批次 / 矩陣運算用
+# ======================================================
+# 權重與 match_utils.similarity_score 相同
+SIMILARITY_WEIGHTS = {"style": 0.5, "genre": 0.3, "language": 0.2}
+
+
+def build_vector_matrices(user_ids, vectors, dtype=np.float32):
+    """
+    依 user_ids 的順序把 style / genre / language 疊成矩陣，並做 L2 正規化。
+    之後 A @ B.T 就等於逐對的 cosine_sim。
+
+    維度跟多數人不同、或是零向量的列會留 0，
+    跟 cosine_sim 遇到 shape 不同 / norm 為 0 回傳 0.0 的行為一致。
+    """
+    mats = {}
+    for key in SIMILARITY_WEIGHTS:
+        lengths = Counter(len(vectors.get(uid, {}).get(key) or []) for uid in user_ids)
+        dim = lengths.most_common(1)[0][0] if lengths else 0
+
+        m = np.zeros((len(user_ids), dim), dtype=dtype)
+        for i, uid in enumerate(user_ids):
+            v = vectors.get(uid, {}).get(key) or []
+            if dim and len(v) == dim:
+                m[i] = v
+
+        norms = np.linalg.norm(m, axis=1, keepdims=True)
+        np.divide(m, norms, out=m, where=norms > 0)
+        mats[key] = m
+    return mats
+
+
+def similarity_block(row_mats, col_mats):
+    """
+    一次算出 row users × col users 的 similarity（0~100 的 float 矩陣）。
+    取 int() 之後就是 similarity_score 的結果。
+    """
+    scores = None
+    for key, weight in SIMILARITY_WEIGHTS.items():
+        part = row_mats[key] @ col_mats[key].T
+        scores = part * weight if scores is None else scores + part * weight
+    return scores * 100
+
+
 # ======================================================
 # 批次載入所有 user profiles（Firestore）
 # ======================================================
@@ -64,7 +109,7 @@ def load_all_user_profiles(user_ids):
             d = doc.to_dict() or {}
             profiles[uid] = {
                 "name": d.get("name") or d.get("display_name") or "Guest",
-                "avatarUrl": d.get("avatarUrl") or "https://example.com/default-avatar.png",
+                "avatarUrl": avatar_url_for(d, "medium") or "https://example.com/default-avatar.png",
             }
 
     return profiles
@@ -77,7 +122,7 @@ def load_all_top_songs(user_ids):
     client = get_bq_client()
     df = client.query("""
         SELECT user_id, track_name, artist_name, album_image, rank
-        FROM `spotify-match-project.user_event.user_top_tracks`
+        FROM `spotify-match-project.user_event.user_top_tracks_latest`
         ORDER BY rank ASC
     """).to_dataframe()
 
@@ -102,7 +147,7 @@ def compute_shared_artists_map():
     client = get_bq_client()
     df = client.query("""
         SELECT user_id, artist_id, artist_name
-        FROM `spotify-match-project.user_event.user_top_artists`
+        FROM `spotify-match-project.user_event.user_top_artists_latest`
     """).to_dataframe()
 
     artist_map = {}
@@ -132,7 +177,7 @@ def compute_shared_tracks_map():
     client = get_bq_client()
     df = client.query("""
         SELECT user_id, track_name
-        FROM `spotify-match-project.user_event.user_top_tracks`
+        FROM `spotify-match-project.user_event.user_top_tracks_latest`
     """).to_dataframe()
 
     track_map = {}
@@ -159,24 +204,43 @@ def get_shared_tracks_fast(u1, u2, track_map, limit=5):
 # 主邏輯：計算所有 candidates（API 會呼叫這個）
 # ======================================================
 def compute_similarity_candidates(user_id, users, vectors, profiles, top_songs,
-                                  artists_map, tracks_map, top_k=10):
+                                  artists_map, tracks_map, top_k=10, excluded_ids=None):
+    """
+    excluded_ids：已經滑過的人（swipe index），在取 top-k 之前就用 mask 排除。
+    分數一次用矩陣算完，shared artists / tracks / reason 只替最後的 top-k 計算。
+    """
 
     if user_id not in vectors:
         return []
 
     target_vec = vectors[user_id]
-    other_users = [u for u in users if u != user_id]
+    other_users = [u for u in users if u != user_id and u in vectors]
+    if not other_users:
+        return []
 
-    candidates = []
+    # similarity score（向量化）
+    mats = build_vector_matrices([user_id] + other_users, vectors, dtype=np.float64)
+    scores = similarity_block(
+        {key: m[:1] for key, m in mats.items()},
+        {key: m[1:] for key, m in mats.items()},
+    )[0]
+    scores = np.trunc(scores)
 
-    for uid in other_users:
-        if uid not in vectors:
-            continue
+    # 排除已滑過的人
+    if excluded_ids:
+        position = {uid: i for i, uid in enumerate(other_users)}
+        masked = [position[uid] for uid in excluded_ids if uid in position]
+        scores[masked] = -np.inf
 
-        vec = vectors[uid]
+    # 分數高的在前，同分維持原本順序
+    order = np.lexsort((np.arange(len(other_users)), -scores))
+    order = [i for i in order[:top_k] if np.isfinite(scores[i])]
 
-        # similarity score
-        score = similarity_score(target_vec, vec)
+    candidates = []
+
+    for i in order:
+        uid = other_users[i]
+        vec = vectors[uid]
 
         # shared artists / tracks
         shared_artists = get_shared_artists_fast(user_id, uid, artists_map)
@@ -189,7 +253,7 @@ def compute_similarity_candidates(user_id, users, vectors, profiles, top_songs,
             "name": profiles[uid]["name"],
             "avatarUrl": profiles[uid]["avatarUrl"],
             "similarity_info": {
-                "score": score,
+                "score": int(scores[i]),
                 "reason": reason["reason"],
                 "reason_label": reason["reason_label"],
                 "shared_top_artists": shared_artists,
@@ -198,5 +262,4 @@ def compute_similarity_candidates(user_id, users, vectors, profiles, top_songs,
             }
         })
 
-    candidates.sort(key=lambda x: x["similarity_info"]["score"], reverse=True)
-    return candidates[:top_k]
\ No newline at end of file
+    return candidates
\ No newline at end of file
@@ -0,0 +1,958 @@
+# app/services/memory_backend.py
+"""
+In-memory 版本的 Firestore / BigQuery / Redis / Pub/Sub client。
+
+設定 STORAGE_BACKEND=memory 時，get_db() / get_bq_client() / get_redis() /
+get_publisher() / get_gcs_client() 會改回傳這裡的 singleton，整個 app 不需要 GCP / Redis 就能跑
+（本機開發、benchmark、load test）。
+
+只實作 app 目前實際用到的 API（collection / document / where / order_by /
+start_after / transaction / batch、BigQuery 單表 SELECT / MERGE、Redis string /
+set / hash / pipeline / pub-sub），介面跟正式的 client 相同，service 端不用改。
+"""
+import copy
+import fnmatch
+import functools
+import itertools
+import queue
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+import pandas as pd
+
+
+# ======================================================
+# Firestore
+# ======================================================
+_DOC_ID = "__name__"
+
+
+def _sort_key(value):
+    # Firestore 的型別排序：null < bool < number < timestamp < string < 其他
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return (3, value.timestamp())
+    if isinstance(value, str):
+        return (4, value)
+    return (5, str(value))
+
+
+def _resolve_sentinels(data):
+    from google.cloud import firestore
+
+    resolved = {}
+    for key, value in data.items():
+        if value is firestore.SERVER_TIMESTAMP:
+            value = datetime.now(timezone.utc)
+        resolved[key] = value
+    return resolved
+
+
+class MemoryDocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        if self._data is None:
+            return None
+        return self._data.get(field)
+
+
+class MemoryDocumentReference:
+    def __init__(self, db, collection_path, doc_id):
+        self._db = db
+        self._collection_path = collection_path
+        self.id = doc_id
+        self.path = f"{collection_path}/{doc_id}"
+
+    def collection(self, name):
+        return MemoryCollectionReference(self._db, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, transaction=None):
+        data = self._db._read(self._collection_path, self.id)
+        if data is not None and field_paths:
+            data = {k: v for k, v in data.items() if k in field_paths}
+        return MemoryDocumentSnapshot(self, data)
+
+    def set(self, data, merge=False):
+        self._db._write(self._collection_path, self.id, data, merge=merge)
+
+    def update(self, data):
+        if self._db._read(self._collection_path, self.id) is None:
+            raise KeyError(f"No document to update: {self.path}")
+        self._db._write(self._collection_path, self.id, data, merge=True)
+
+    def delete(self):
+        self._db._delete(self._collection_path, self.id)
+
+
+class MemoryAggregationResult:
+    def __init__(self, alias, value):
+        self.alias = alias
+        self.value = value
+
+
+class MemoryCountQuery:
+    def __init__(self, query, alias):
+        self._query = query
+        self._alias = alias or "field_1"
+
+    def get(self, transaction=None):
+        count = sum(1 for _ in self._query._matching())
+        return [[MemoryAggregationResult(self._alias, count)]]
+
+
+class MemoryQuery:
+    def __init__(self, db, collection_path, filters=(), orders=(), limit=None,
+                 start_after=None, projection=None):
+        self._db = db
+        self._collection_path = collection_path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._start_after = start_after
+        self._projection = projection
+
+    def _copy(self, **changes):
+        params = {
+            "filters": self._filters,
+            "orders": self._orders,
+            "limit": self._limit,
+            "start_after": self._start_after,
+            "projection": self._projection,
+        }
+        params.update(changes)
+        return MemoryQuery(self._db, self._collection_path, **params)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, document_fields):
+        if isinstance(document_fields, MemoryDocumentSnapshot):
+            values = dict(document_fields._data or {})
+            values[_DOC_ID] = document_fields.id
+            document_fields = values
+        return self._copy(start_after=document_fields)
+
+    def select(self, field_paths):
+        return self._copy(projection=list(field_paths))
+
+    def count(self, alias=None):
+        return MemoryCountQuery(self, alias)
+
+    # ---------- 執行 ----------
+    @staticmethod
+    def _match(data, doc_id, field, op, value):
+        current = doc_id if field == _DOC_ID else data.get(field)
+        if op == "==":
+            return current == value
+        if op == "!=":
+            return current != value
+        if op == "array_contains":
+            return isinstance(current, list) and value in current
+        if op == "array_contains_any":
+            return isinstance(current, list) and any(v in current for v in value)
+        if op == "in":
+            return current in value
+        if op == "not-in":
+            return current not in value
+        if current is None:
+            return False
+        if op == "<":
+            return current < value
+        if op == "<=":
+            return current <= value
+        if op == ">":
+            return current > value
+        if op == ">=":
+            return current >= value
+        raise NotImplementedError(f"Unsupported operator: {op}")
+
+    def _order_values(self, doc_id, data):
+        return [doc_id if f == _DOC_ID else data.get(f) for f, _ in self._orders]
+
+    def _compare(self, a, b):
+        for (_, direction), va, vb in zip(self._orders, a, b):
+            ka, kb = _sort_key(va), _sort_key(vb)
+            if ka == kb:
+                continue
+            result = -1 if ka < kb else 1
+            return -result if direction == "DESCENDING" else result
+        return 0
+
+    def _matching(self):
+        docs = self._db._snapshot_collection(self._collection_path)
+        for doc_id, data in docs:
+            if all(self._match(data, doc_id, f, op, v) for f, op, v in self._filters):
+                # order_by 的欄位不存在的文件不會出現在結果中
+                if any(f != _DOC_ID and f not in data for f, _ in self._orders):
+                    continue
+                yield doc_id, data
+
+    def stream(self, transaction=None):
+        rows = list(self._matching())
+        orders = self._orders
+        if not any(f == _DOC_ID for f, _ in orders):
+            orders = orders + ((_DOC_ID, orders[-1][1] if orders else "ASCENDING"),)
+        query = self._copy(orders=orders)
+
+        keyed = [(query._order_values(doc_id, data), doc_id, data) for doc_id, data in rows]
+        keyed.sort(key=functools.cmp_to_key(lambda a, b: query._compare(a[0], b[0])))
+
+        if self._start_after is not None:
+            cursor = [self._start_after.get(f) for f, _ in orders]
+            keyed = [row for row in keyed if query._compare(row[0], cursor) > 0]
+
+        if self._limit is not None:
+            keyed = keyed[:self._limit]
+
+        for _, doc_id, data in keyed:
+            if self._projection is not None:
+                data = {k: v for k, v in data.items() if k in self._projection}
+            ref = MemoryDocumentReference(self._db, self._collection_path, doc_id)
+            yield MemoryDocumentSnapshot(ref, copy.deepcopy(data))
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+
+class MemoryCollectionReference(MemoryQuery):
+    def __init__(self, db, path):
+        super().__init__(db, path)
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, doc_id=None):
+        return MemoryDocumentReference(self._db, self._collection_path, doc_id or uuid.uuid4().hex[:20])
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return None, ref
+
+    def stream(self, transaction=None):
+        return super().stream(transaction=transaction)
+
+
+class MemoryWriteBatch:
+    def __init__(self, db):
+        self._db = db
+        self._ops = []
+
+    def set(self, ref, data, merge=False):
+        self._ops.append(("set", ref, data, merge))
+
+    def update(self, ref, data):
+        self._ops.append(("update", ref, data, None))
+
+    def delete(self, ref):
+        self._ops.append(("delete", ref, None, None))
+
+    def commit(self):
+        with self._db._lock:
+            for op, ref, data, merge in self._ops:
+                if op == "set":
+                    ref.set(data, merge=merge)
+                elif op == "update":
+                    ref.update(data)
+                else:
+                    ref.delete()
+        self._ops = []
+
+
+class MemoryTransaction(MemoryWriteBatch):
+    """
+    相容 @firestore.transactional 會呼叫的內部介面。
+    整個交易持有 DB 的鎖，所以同時間只會有一個交易在跑（等同 serializable）。
+    """
+    _read_only = False
+    _max_attempts = 5
+
+    def __init__(self, db):
+        super().__init__(db)
+        self._id = None
+        self._locked = False
+
+    def _clean_up(self):
+        self._ops = []
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._db._lock.acquire()
+        self._locked = True
+        self._id = uuid.uuid4().bytes
+
+    def _release(self):
+        if self._locked:
+            self._locked = False
+            self._db._lock.release()
+
+    def _commit(self):
+        try:
+            self.commit()
+        finally:
+            self._clean_up()
+            self._release()
+        return []
+
+    def _rollback(self):
+        self._clean_up()
+        self._release()
+
+
+class MemoryFirestoreClient:
+    def __init__(self):
+        self.project = "memory-project"
+        self._lock = threading.RLock()
+        self._collections = {}
+
+    # ---------- 儲存層 ----------
+    def _read(self, collection_path, doc_id):
+        with self._lock:
+            data = self._collections.get(collection_path, {}).get(doc_id)
+            return copy.deepcopy(data) if data is not None else None
+
+    def _write(self, collection_path, doc_id, data, merge=False):
+        from google.cloud import firestore
+
+        data = _resolve_sentinels(copy.deepcopy(data))
+        with self._lock:
+            docs = self._collections.setdefault(collection_path, {})
+            current = docs.get(doc_id) if merge else None
+            merged = dict(current or {})
+            for key, value in data.items():
+                if value is firestore.DELETE_FIELD:
+                    merged.pop(key, None)
+                elif isinstance(value, firestore.ArrayUnion):
+                    existing = list(merged.get(key) or [])
+                    merged[key] = existing + [v for v in value.values if v not in existing]
+                else:
+                    merged[key] = value
+            docs[doc_id] = merged
+
+    def _delete(self, collection_path, doc_id):
+        with self._lock:
+            self._collections.get(collection_path, {}).pop(doc_id, None)
+
+    def _snapshot_collection(self, collection_path):
+        with self._lock:
+            return list(self._collections.get(collection_path, {}).items())
+
+    # ---------- Client API ----------
+    def collection(self, name):
+        return MemoryCollectionReference(self, name)
+
+    def document(self, path):
+        collection_path, doc_id = path.rsplit("/", 1)
+        return MemoryDocumentReference(self, collection_path, doc_id)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        for ref in references:
+            yield ref.get(field_paths=field_paths)
+
+    def batch(self):
+        return MemoryWriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return MemoryTransaction(self)
+
+
+# ======================================================
+# BigQuery
+# ======================================================
+class MemoryRow(dict):
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class MemoryQueryJob:
+    def __init__(self, df):
+        self._df = df
+
+    def to_dataframe(self, **kwargs):
+        return self._df.copy()
+
+    def result(self, **kwargs):
+        return [MemoryRow(r) for r in self._df.to_dict(orient="records")]
+
+
+_TABLE_RE = r"`?(?:[\w-]+\.)?(?:\w+\.)?(\w+)`?"
+
+
+class MemoryBigQueryClient:
+    """
+    以 pandas DataFrame 存每張表，只支援 app 用到的單表 SELECT 形狀：
+    SELECT [DISTINCT] cols FROM `p.d.table` [WHERE col = 'x' | @p | IN (...) | IN UNNEST(@p)]
+    [ORDER BY col [ASC|DESC]] [LIMIT n]、UNION DISTINCT 子查詢，
+    以及 save_user_vector 的單列 MERGE（upsert）。
+    """
+
+    def __init__(self, project="memory-project"):
+        self.project = project
+        self._tables = {}
+        self._lock = threading.Lock()
+
+    # ---------- 資料 ----------
+    def load_table(self, name, rows):
+        with self._lock:
+            self._tables[name] = pd.DataFrame(rows)
+
+    def table_df(self, name):
+        with self._lock:
+            if name in self._tables or not name.endswith("_latest"):
+                return self._tables.get(name, pd.DataFrame()).copy()
+            df = self._tables.get(name[:-len("_latest")], pd.DataFrame()).copy()
+        return self._latest_view(name[:-len("_latest")], df)
+
+    @staticmethod
+    def _latest_view(base, df):
+        """{table}_latest 表：每個 user / scope 只留 created_at 最新的那個版本"""
+        from app.services.spotify_snapshots import LATEST_VIEWS
+
+        keys = list(LATEST_VIEWS.get(base) or ())
+        if df.empty or not keys or "created_at" not in df.columns or not set(keys) <= set(df.columns):
+            return df
+        newest = df.groupby(keys, dropna=False)["created_at"].transform("max")
+        return df[df["created_at"] == newest].reset_index(drop=True)
+
+    def insert_rows_json(self, table_id, rows):
+        name = table_id.rsplit(".", 1)[-1]
+        with self._lock:
+            current = self._tables.get(name, pd.DataFrame())
+            self._tables[name] = pd.concat([current, pd.DataFrame(rows)], ignore_index=True)
+        return []
+
+    # ---------- 查詢 ----------
+    def query(self, sql, job_config=None):
+        params = {}
+        if job_config is not None:
+            for p in getattr(job_config, "query_parameters", None) or []:
+                params[p.name] = getattr(p, "value", None)
+                if params[p.name] is None and hasattr(p, "values"):
+                    params[p.name] = p.values
+        return MemoryQueryJob(self._run(sql, params))
+
+    def _run(self, sql, params):
+        sql = " ".join(sql.replace("\n", " ").split()).rstrip(";")
+
+        if sql.upper().startswith("MERGE "):
+            return self._merge(sql)
+
+        m = re.match(r"SELECT (DISTINCT )?(.+?) FROM \((.+)\)(?: \w+)?$", sql, re.I)
+        if m:
+            parts = re.split(r" UNION (?:DISTINCT|ALL) ", m.group(3), flags=re.I)
+            df = pd.concat([self._run(p, params) for p in parts], ignore_index=True)
+            df = self._project(df, m.group(2))
+            return df.drop_duplicates(ignore_index=True) if m.group(1) else df
+
+        m = re.match(
+            rf"SELECT (DISTINCT )?(.+?) FROM {_TABLE_RE}(?: \w+)?"
+            r"(?: WHERE (.+?))?(?: ORDER BY (\w+)(?: (ASC|DESC))?)?(?: LIMIT (\S+))?$",
+            sql, re.I,
+        )
+        if not m:
+            raise NotImplementedError(f"MemoryBigQueryClient cannot run: {sql[:120]}")
+
+        distinct, cols, table, where, order_col, order_dir, limit = m.groups()
+        df = self.table_df(table)
+
+        if where:
+            for cond in re.split(r" AND ", where, flags=re.I):
+                df = self._filter(df, cond.strip(), params)
+        if order_col and order_col in df.columns:
+            df = df.sort_values(order_col, ascending=(order_dir or "ASC").upper() == "ASC", kind="stable")
+        if limit:
+            n = params[limit[1:]] if limit.startswith("@") else int(limit)
+            df = df.head(int(n))
+
+        df = self._project(df, cols)
+        if distinct:
+            df = df.drop_duplicates(ignore_index=True)
+        return df.reset_index(drop=True)
+
+    def _merge(self, sql):
+        """MERGE `t` T USING (SELECT v AS col, ...) S ON T.key = S.key → 以 key upsert 一列"""
+        m = re.match(rf"MERGE {_TABLE_RE} T USING \( ?SELECT (.+?) \) S ON T\.(\w+) = S\.\w+", sql, re.I)
+        if not m:
+            raise NotImplementedError(f"MemoryBigQueryClient cannot run: {sql[:120]}")
+
+        table, select, key = m.groups()
+        row = {}
+        for value, alias in re.findall(
+            r"(ARRAY\[[^\]]*\]|TIMESTAMP\('[^']*'\)|'[^']*'|-?[\d.eE+-]+) AS (\w+)", select, re.I
+        ):
+            if value.upper().startswith("ARRAY["):
+                row[alias] = [float(v) for v in value[6:-1].split(",") if v.strip()]
+            elif value.upper().startswith("TIMESTAMP("):
+                row[alias] = value[11:-2]
+            else:
+                row[alias] = self._literal(value, {})
+
+        with self._lock:
+            current = self._tables.get(table, pd.DataFrame())
+            if key in current.columns:
+                current = current[current[key] != row.get(key)]
+            self._tables[table] = pd.concat([current, pd.DataFrame([row])], ignore_index=True)
+        return pd.DataFrame()
+
+    @staticmethod
+    def _literal(token, params):
+        token = token.strip()
+        if token.startswith("@"):
+            return params[token[1:]]
+        if token[0] in "'\"":
+            return token[1:-1]
+        return float(token) if "." in token else int(token)
+
+    def _filter(self, df, cond, params):
+        m = re.match(r"(\w+) IN UNNEST\((@\w+)\)$", cond, re.I)
+        if m:
+            values = list(self._literal(m.group(2), params) or [])
+            return df[df[m.group(1)].isin(values)] if m.group(1) in df.columns else df.iloc[0:0]
+        m = re.match(r"(\w+) IN \((.*)\)$", cond, re.I)
+        if m:
+            values = [self._literal(v, params) for v in m.group(2).split(",") if v.strip()]
+            return df[df[m.group(1)].isin(values)] if m.group(1) in df.columns else df.iloc[0:0]
+        m = re.match(r"(\w+) IS NOT NULL$", cond, re.I)
+        if m:
+            return df[df[m.group(1)].notna()] if m.group(1) in df.columns else df.iloc[0:0]
+        m = re.match(r"(\w+) = (.+)$", cond)
+        if m:
+            if m.group(1) not in df.columns:
+                return df.iloc[0:0]
+            return df[df[m.group(1)] == self._literal(m.group(2), params)]
+        raise NotImplementedError(f"MemoryBigQueryClient cannot filter: {cond}")
+
+    @staticmethod
+    def _project(df, cols):
+        if cols.strip() in ("*", "u.*"):
+            return df
+        out = {}
+        for col in cols.split(","):
+            m = re.match(r"\s*(\w+)(?: AS (\w+))?\s*$", col, re.I)
+            if not m:
+                raise NotImplementedError(f"MemoryBigQueryClient cannot project: {col}")
+            src, alias = m.group(1), m.group(2) or m.group(1)
+            out[alias] = df[src] if src in df.columns else pd.Series([None] * len(df), dtype=object)
+        return pd.DataFrame(out).reset_index(drop=True)
+
+
+# ======================================================
+# Redis
+# ======================================================
+class MemoryPipeline:
+    def __init__(self, redis_client):
+        self._redis = redis_client
+        self._calls = []
+        self._immediate = False   # watch() 之後、multi() 之前：跟 redis-py 一樣直接執行
+
+    def watch(self, *keys):
+        self._immediate = True
+
+    def multi(self):
+        self._immediate = False
+
+    def __getattr__(self, name):
+        method = getattr(self._redis, name)
+        if self._immediate:
+            return method
+
+        def queue(*args, **kwargs):
+            self._calls.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        results = [method(*args, **kwargs) for method, args, kwargs in self._calls]
+        self._calls = []
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class MemoryPubSub:
+    """redis.client.PubSub 的子集合：subscribe / unsubscribe / get_message"""
+
+    def __init__(self, redis_client, ignore_subscribe_messages=False):
+        self._redis = redis_client
+        self._ignore_subscribe_messages = ignore_subscribe_messages
+        self._messages = queue.Queue()
+        self.channels = set()
+
+    def _deliver(self, channel, data):
+        self._messages.put({"type": "message", "pattern": None, "channel": channel, "data": data})
+
+    def _control(self, kind, channel):
+        if not self._ignore_subscribe_messages:
+            self._messages.put({"type": kind, "pattern": None, "channel": channel, "data": len(self.channels)})
+
+    def subscribe(self, *channels):
+        with self._redis._lock:
+            for channel in channels:
+                self.channels.add(channel)
+                self._redis._subscribers.setdefault(channel, set()).add(self)
+                self._control("subscribe", channel)
+
+    def unsubscribe(self, *channels):
+        with self._redis._lock:
+            for channel in channels or list(self.channels):
+                self.channels.discard(channel)
+                self._redis._subscribers.get(channel, set()).discard(self)
+                self._control("unsubscribe", channel)
+
+    def get_message(self, ignore_subscribe_messages=False, timeout=0.0):
+        try:
+            return self._messages.get(timeout=timeout) if timeout else self._messages.get_nowait()
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.unsubscribe()
+
+
+class MemoryRedis:
+    """decode_responses=True 的 redis.Redis 子集合。"""
+
+    def __init__(self):
+        self._data = {}
+        self._expires = {}
+        self._lock = threading.RLock()
+        self._subscribers = {}   # channel → set(MemoryPubSub)
+
+    def _alive(self, key):
+        exp = self._expires.get(key)
+        if exp is not None and exp <= time.time():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return key in self._data
+
+    # ---------- keys ----------
+    def delete(self, *keys):
+        with self._lock:
+            removed = 0
+            for key in keys:
+                if self._alive(key):
+                    removed += 1
+                self._data.pop(key, None)
+                self._expires.pop(key, None)
+            return removed
+
+    def exists(self, *keys):
+        with self._lock:
+            return sum(1 for k in keys if self._alive(k))
+
+    def expire(self, key, seconds):
+        with self._lock:
+            if not self._alive(key):
+                return False
+            self._expires[key] = time.time() + seconds
+            return True
+
+    def ttl(self, key):
+        with self._lock:
+            if not self._alive(key):
+                return -2
+            exp = self._expires.get(key)
+            return -1 if exp is None else int(exp - time.time())
+
+    def scan(self, cursor=0, match=None, count=None):
+        with self._lock:
+            keys = [k for k in list(self._data) if self._alive(k)]
+        if match:
+            keys = [k for k in keys if fnmatch.fnmatchcase(k, match)]
+        return 0, keys
+
+    def scan_iter(self, match=None, count=None):
+        return iter(self.scan(match=match)[1])
+
+    # ---------- strings ----------
+    def get(self, key):
+        with self._lock:
+            return self._data.get(key) if self._alive(key) else None
+
+    def set(self, key, value, ex=None, nx=False, keepttl=False):
+        with self._lock:
+            if nx and self._alive(key):
+                return None
+            self._data[key] = value if isinstance(value, (str, bytes)) else str(value)
+            if ex is not None:
+                self._expires[key] = time.time() + ex
+            elif not keepttl:
+                self._expires.pop(key, None)
+            return True
+
+    def mget(self, keys, *args):
+        keys = list(keys) + list(args) if not isinstance(keys, str) else [keys, *args]
+        return [self.get(k) for k in keys]
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            value = int(self.get(key) or 0) + amount
+            self._data[key] = str(value)
+            return value
+
+    # ---------- sets ----------
+    def sadd(self, key, *members):
+        with self._lock:
+            if not self._alive(key):
+                self._data[key] = set()
+            s = self._data[key]
+            before = len(s)
+            s.update(members)
+            return len(s) - before
+
+    def srem(self, key, *members):
+        with self._lock:
+            s = self._data.get(key, set()) if self._alive(key) else set()
+            before = len(s)
+            s.difference_update(members)
+            return before - len(s)
+
+    def smembers(self, key):
+        with self._lock:
+            return set(self._data.get(key, set())) if self._alive(key) else set()
+
+    def sismember(self, key, member):
+        with self._lock:
+            return self._alive(key) and member in self._data[key]
+
+    def smismember(self, key, members, *args):
+        members = list(members) + list(args)
+        with self._lock:
+            s = self._data.get(key, set()) if self._alive(key) else set()
+            return [m in s for m in members]
+
+    def scard(self, key):
+        return len(self.smembers(key))
+
+    # ---------- hashes ----------
+    def hset(self, key, field=None, value=None, mapping=None):
+        with self._lock:
+            if not self._alive(key):
+                self._data[key] = {}
+            h = self._data[key]
+            items = dict(mapping or {})
+            if field is not None:
+                items[field] = value
+            added = sum(1 for f in items if f not in h)
+            h.update({f: str(v) for f, v in items.items()})
+            return added
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._data.get(key, {})) if self._alive(key) else {}
+
+    def hget(self, key, field):
+        return self.hgetall(key).get(field)
+
+    def hdel(self, key, *fields):
+        with self._lock:
+            if not self._alive(key):
+                return 0
+            h = self._data[key]
+            return sum(1 for f in fields if h.pop(f, None) is not None)
+
+    # ---------- pub/sub ----------
+    def publish(self, channel, message):
+        with self._lock:
+            receivers = list(self._subscribers.get(channel, ()))
+        for pubsub in receivers:
+            pubsub._deliver(channel, message)
+        return len(receivers)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return MemoryPubSub(self, ignore_subscribe_messages)
+
+    # ---------- pipeline ----------
+    def pipeline(self, transaction=True):
+        return MemoryPipeline(self)
+
+    def transaction(self, func, *watches, value_from_callable=False, **kwargs):
+        """WATCH / MULTI：整段拿著 lock 跑，不會有別人插進來，不用重試"""
+        with self._lock:
+            pipe = self.pipeline()
+            pipe.watch(*watches)
+            value = func(pipe)
+            results = pipe.execute()
+        return value if value_from_callable else results
+
+    def ping(self):
+        return True
+
+
+# ======================================================
+# Pub/Sub
+# ======================================================
+class MemoryFuture:
+    def __init__(self, value):
+        self._value = value
+
+    def result(self, timeout=None):
+        return self._value
+
+
+class MemoryPublisherClient:
+    def __init__(self):
+        self.messages = {}
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def topic_path(project, topic):
+        return f"projects/{project}/topics/{topic}"
+
+    def publish(self, topic, data, **attrs):
+        with self._lock:
+            self.messages.setdefault(topic, []).append((data, attrs))
+            return MemoryFuture(str(next(self._counter)))
+
+
+# ======================================================
+# Cloud Storage（bucket / blob 只實作上傳、讀取、公開 URL）
+# ======================================================
+class MemoryBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.content_type = None
+        self.cache_control = None
+
+    @property
+    def public_url(self):
+        return f"memory://{self.bucket.name}/{self.name}"
+
+    def upload_from_string(self, data, content_type=None, **kwargs):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        with self.bucket.client._lock:
+            self.bucket.client._objects[(self.bucket.name, self.name)] = {
+                "data": bytes(data),
+                "content_type": content_type,
+                "cache_control": self.cache_control,
+            }
+
+    def exists(self, **kwargs):
+        with self.bucket.client._lock:
+            return (self.bucket.name, self.name) in self.bucket.client._objects
+
+    def download_as_bytes(self, **kwargs):
+        with self.bucket.client._lock:
+            return self.bucket.client._objects[(self.bucket.name, self.name)]["data"]
+
+    def make_public(self, **kwargs):
+        pass
+
+    def patch(self, **kwargs):
+        with self.bucket.client._lock:
+            obj = self.bucket.client._objects.get((self.bucket.name, self.name))
+            if obj is not None:
+                obj["cache_control"] = self.cache_control
+
+
+class MemoryBucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def blob(self, name):
+        return MemoryBlob(self, name)
+
+
+class MemoryStorageClient:
+    def __init__(self):
+        self._objects = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, name):
+        return MemoryBucket(self, name)
+
+
+# ======================================================
+# Process-wide singletons（STORAGE_BACKEND=memory 時由各 client factory 回傳）
+# ======================================================
+_firestore = None
+_bigquery = None
+_redis = None
+_publisher = None
+_storage = None
+_singleton_lock = threading.Lock()
+
+
+def get_memory_firestore():
+    global _firestore
+    with _singleton_lock:
+        if _firestore is None:
+            _firestore = MemoryFirestoreClient()
+        return _firestore
+
+
+def get_memory_bigquery():
+    global _bigquery
+    with _singleton_lock:
+        if _bigquery is None:
+            _bigquery = MemoryBigQueryClient()
+        return _bigquery
+
+
+def get_memory_redis():
+    global _redis
+    with _singleton_lock:
+        if _redis is None:
+            _redis = MemoryRedis()
+        return _redis
+
+
+def get_memory_publisher():
+    global _publisher
+    with _singleton_lock:
+        if _publisher is None:
+            _publisher = MemoryPublisherClient()
+        return _publisher
+
+
+def get_memory_storage():
+    global _storage
+    with _singleton_lock:
+        if _storage is None:
+            _storage = MemoryStorageClient()
+        return _storage
+
+
+def reset_memory_backends():
+    """清空所有 in-memory 資料（benchmark 每個 size 之間、或測試之間用）"""
+    global _firestore, _bigquery, _redis, _publisher, _storage
+    with _singleton_lock:
+        _firestore = _bigquery = _redis = _publisher = _storage = None
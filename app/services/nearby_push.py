@@ -0,0 +1,313 @@
+# app/services/nearby_push.py
+"""
+WebSocket nearby push：client 不用再一直 poll /heartbeat-auto 才知道附近有誰。
+
+- heartbeat 真的換歌 / 換位置時（見 heartbeat_auto），publish 到
+  nearby:cell:{geohash}（給附近的人）和 nearby:user:{user_id}（給自己的連線，知道自己移動了）
+- 每個 worker 只有一條 Redis pub/sub 連線（NearbyHub），訂閱「所有本機連線需要的 cell」的聯集，
+  收到訊息後分派到各連線的 asyncio.Queue
+- NearbyConnection 記住已經推給 client 的人，只送差異（upsert / remove）
+"""
+import asyncio
+import json
+import threading
+import time
+
+from app.config.settings import HEARTBEAT_TTL_SEC, NEARBY_PUSH_PRECISION, NEARBY_RADIUS_KM
+from app.services import geo_cells
+from app.services.geo_cells import neighbor_cells
+from app.services.redis_service import HeartbeatRedisService, get_redis
+
+CELL_CHANNEL = "nearby:cell:{cell}"
+USER_CHANNEL = "nearby:user:{user_id}"
+
+# 只推「同首歌 / 同歌手」；just_near 量太大，留給 /heartbeat-auto 的完整結果
+PUSH_GROUPS = ("same_track", "same_artist")
+
+
+# ======================================================
+# Geohash cell
+# ======================================================
+def cell_of(lat, lng, precision=NEARBY_PUSH_PRECISION):
+    return geo_cells.cell_of(lat, lng, precision)
+
+
+def publish_nearby_event(heartbeat, previous=None):
+    """
+    給 heartbeat_auto 用：一次 pipeline 發到 cell channel + 自己的 user channel。
+    previous（上一次的 play_state）在別的 cell 的話也發一份，舊 cell 附近的人才會收到「離開」。
+    """
+    message = json.dumps(heartbeat)
+    cells = {cell_of(heartbeat["lat"], heartbeat["lng"])}
+    if previous and previous.get("lat") is not None and previous.get("lng") is not None:
+        cells.add(cell_of(previous["lat"], previous["lng"]))
+
+    pipe = get_redis().pipeline(transaction=False)
+    for cell in cells:
+        pipe.publish(CELL_CHANNEL.format(cell=cell), message)
+    pipe.publish(USER_CHANNEL.format(user_id=heartbeat["user_id"]), message)
+    pipe.execute()
+
+
+# ======================================================
+# 單一 WebSocket 連線的狀態
+# ======================================================
+class NearbyConnection:
+    def __init__(self, user_id, loop, km=NEARBY_RADIUS_KM):
+        self.user_id = user_id
+        self.loop = loop
+        self.km = km
+        self.queue = asyncio.Queue()
+        self.me = None          # 自己最新的 heartbeat
+        self.members = {}       # user_id → (group, heartbeat)：已經推給 client 的人
+        self.channels = {USER_CHANNEL.format(user_id=user_id)}
+
+    def _wanted_channels(self):
+        channels = {USER_CHANNEL.format(user_id=self.user_id)}
+        if self.me:
+            cell = cell_of(self.me["lat"], self.me["lng"])
+            channels |= {CELL_CHANNEL.format(cell=c) for c in neighbor_cells(cell)}
+        return channels
+
+    def _group_of(self, hb):
+        if not self.me or hb.get("user_id") == self.user_id:
+            return None
+        if HeartbeatRedisService.haversine(self.me["lat"], self.me["lng"], hb["lat"], hb["lng"]) > self.km:
+            return None
+        if hb.get("track_id") == self.me.get("track_id"):
+            return "same_track"
+        if hb.get("artist_id") == self.me.get("artist_id"):
+            return "same_artist"
+        return None
+
+    def _diff(self, hb):
+        """把一筆別人的 heartbeat 套進 members，回傳要送給 client 的訊息（可能是空的）"""
+        uid = hb["user_id"]
+        group = self._group_of(hb)
+        previous = self.members.get(uid)
+
+        if group is None:
+            if previous is None:
+                return []
+            del self.members[uid]
+            return [{"type": "remove", "user_id": uid}]
+
+        self.members[uid] = (group, hb)
+        if previous and previous[0] == group and previous[1].get("track_id") == hb.get("track_id"):
+            return []
+        return [{"type": "upsert", "group": group, "user": hb}]
+
+    @staticmethod
+    def _members_of(groups):
+        return {
+            hb["user_id"]: (name, hb)
+            for name in PUSH_GROUPS
+            for hb in (groups or {}).get(name, [])
+        }
+
+    def snapshot(self, groups):
+        """連線剛建立：用目前的 nearby 結果當初始狀態"""
+        self.members = self._members_of(groups)
+        return {"type": "snapshot", **{name: (groups or {}).get(name, []) for name in PUSH_GROUPS}}
+
+    def resync(self, groups):
+        """用一份完整的 nearby 結果對齊 members，只回傳差異"""
+        fresh = self._members_of(groups)
+        messages = [{"type": "remove", "user_id": uid} for uid in self.members if uid not in fresh]
+        for uid, (group, hb) in fresh.items():
+            previous = self.members.get(uid)
+            if previous is None or previous[0] != group or previous[1].get("track_id") != hb.get("track_id"):
+                messages.append({"type": "upsert", "group": group, "user": hb})
+        self.members = fresh
+        return messages
+
+    def apply(self, hb, my_groups=None):
+        """
+        收到一筆 heartbeat event：
+        - 別人的 → 算差異
+        - 自己的 → 更新位置 / 歌曲；有 heartbeat_auto 剛算好的 nearby 結果（my_groups）就整份對齊，
+          沒有就只重新分類已推送的人（換訂閱的 cell 由呼叫端 hub.refresh()）
+        """
+        if hb.get("user_id") != self.user_id:
+            return self._diff(hb)
+
+        self.me = hb
+        if my_groups is not None:
+            return self.resync(my_groups)
+
+        messages = []
+        for _, member_hb in list(self.members.values()):
+            messages += self._diff(member_hb)
+        return messages
+
+    def prune(self, redis_service):
+        """
+        heartbeat 沒變時不會 publish，所以 members 的 timestamp 不代表對方還在；
+        只對「看起來過期」的人批次查一次 Redis，key 不見了才送 remove。
+        """
+        cutoff = time.time() - HEARTBEAT_TTL_SEC
+        stale = [uid for uid, (_, hb) in self.members.items() if hb.get("timestamp", 0) < cutoff]
+        if not stale:
+            return []
+
+        alive = redis_service.get_heartbeats(stale)
+        messages = []
+        for uid in stale:
+            if uid in alive:
+                messages += self._diff(alive[uid])
+            else:
+                del self.members[uid]
+                messages.append({"type": "remove", "user_id": uid})
+        return messages
+
+
+# ======================================================
+# Process 內共用的 pub/sub listener
+# ======================================================
+class NearbyHub:
+    """
+    每個 worker 一條 pub/sub 連線 + 一個 listener thread。
+    subscribe / unsubscribe 先排進 _pending，由 listener thread 自己送出
+    （redis-py 的 PubSub 物件不保證 thread-safe）。
+
+    register / refresh 回傳一個 threading.Event：Redis 回了 subscribe 確認之後才 set，
+    呼叫端等它 set 了再拿 snapshot，中間 publish 的 heartbeat 才一定收得到。
+    """
+
+    # get_message 最多卡這麼久才回頭送 _pending 裡的 subscribe，也就是新連線等確認的延遲上限
+    def __init__(self, poll_timeout=0.1):
+        self.poll_timeout = poll_timeout
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._subscribers = {}   # channel → set(NearbyConnection)
+        self._pending = []       # [("subscribe" | "unsubscribe", channel)]
+        self._confirmed = set()  # Redis 已經回過 subscribe 確認的 channel
+        self._waiters = []       # [(還沒確認的 channel set, threading.Event)]
+        self._thread = None
+
+    def register(self, conn):
+        ready = self.update(conn, conn._wanted_channels(), initial=True)
+        self._ensure_thread()
+        return ready
+
+    def refresh(self, conn):
+        """自己的位置變了 → 換訂閱的 cell"""
+        wanted = conn._wanted_channels()
+        if wanted != conn.channels:
+            return self.update(conn, wanted)
+        ready = threading.Event()
+        ready.set()
+        return ready
+
+    def unregister(self, conn):
+        self.update(conn, set())
+
+    def update(self, conn, wanted, initial=False):
+        current = set() if initial else conn.channels
+        ready = threading.Event()
+        with self._lock:
+            for channel in wanted - current:
+                subs = self._subscribers.setdefault(channel, set())
+                if not subs:
+                    self._pending.append(("subscribe", channel))
+                subs.add(conn)
+            for channel in current - wanted:
+                subs = self._subscribers.get(channel, set())
+                subs.discard(conn)
+                if not subs:
+                    self._subscribers.pop(channel, None)
+                    self._pending.append(("unsubscribe", channel))
+                    # 之後再訂閱要等新的確認；等這個 channel 的 waiter 也不用再等了
+                    self._confirmed.discard(channel)
+                    self._confirm_waiters(channel)
+
+            needed = wanted - self._confirmed
+            if needed:
+                self._waiters.append((needed, ready))
+            else:
+                ready.set()
+        conn.channels = wanted
+        if self._pending:
+            self._wake.set()
+        return ready
+
+    def _confirm_waiters(self, channel):
+        """呼叫端要拿著 _lock"""
+        waiting = []
+        for needed, ready in self._waiters:
+            needed.discard(channel)
+            if needed:
+                waiting.append((needed, ready))
+            else:
+                ready.set()
+        self._waiters = waiting
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="nearby-hub", daemon=True)
+                self._thread.start()
+
+    def _apply_pending(self, pubsub):
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for op, channel in pending:
+            getattr(pubsub, op)(channel)
+
+    def _on_subscribed(self, channel):
+        with self._lock:
+            if channel in self._subscribers:
+                self._confirmed.add(channel)
+                self._confirm_waiters(channel)
+
+    def _dispatch(self, message):
+        channel = message["channel"]
+        try:
+            hb = json.loads(message["data"])
+        except (TypeError, ValueError):
+            return
+        with self._lock:
+            conns = list(self._subscribers.get(channel, ()))
+        for conn in conns:
+            conn.loop.call_soon_threadsafe(conn.queue.put_nowait, hb)
+
+    def _run(self):
+        pubsub = None
+        while True:
+            try:
+                if pubsub is None:
+                    pubsub = get_redis().pubsub()
+                    with self._lock:
+                        self._confirmed.clear()
+                        self._pending = [("subscribe", c) for c in self._subscribers]
+                self._wake.clear()
+                self._apply_pending(pubsub)
+
+                if not getattr(pubsub, "channels", None):
+                    self._wake.wait(self.poll_timeout)
+                    continue
+
+                message = pubsub.get_message(timeout=self.poll_timeout)
+                if not message:
+                    continue
+                if message.get("type") == "message":
+                    self._dispatch(message)
+                elif message.get("type") == "subscribe":
+                    self._on_subscribed(message["channel"])
+            except Exception as e:
+                # 連線斷了：重建 pub/sub，重新訂閱目前所有 channel
+                print(f"[NearbyHub] pub/sub error, reconnecting: {e}")
+                pubsub = None
+                time.sleep(1)
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_nearby_hub():
+    global _hub
+    with _hub_lock:
+        if _hub is None:
+            _hub = NearbyHub()
+        return _hub
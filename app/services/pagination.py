@@ -0,0 +1,65 @@
+# app/services/pagination.py
+import base64
+import json
+from datetime import datetime
+from google.cloud import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+
+# ======================================================
+# Opaque cursor：base64(JSON)，內容是最後一筆的排序值 + 文件 ID
+# ======================================================
+def encode_cursor(sort_value, doc_id: str) -> str:
+    if isinstance(sort_value, datetime):
+        payload = {"t": sort_value.isoformat(), "id": doc_id}
+    else:
+        payload = {"v": sort_value, "id": doc_id}
+
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def decode_cursor(cursor: str):
+    """
+    :return: (sort_value, doc_id)
+    :raise ValueError: cursor 格式錯誤
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        if "t" in payload:
+            return datetime.fromisoformat(payload["t"]), payload["id"]
+        return payload["v"], payload["id"]
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+# ======================================================
+# Keyset pagination：order_by + start_after + limit
+# ======================================================
+def paginate_query(query, sort_field: str, limit: int, cursor: str = None):
+    """
+    依 sort_field 由新到舊排序（同值再用文件 ID 排），只讀 limit + 1 筆。
+    多讀的那一筆只用來判斷有沒有下一頁。
+
+    :return: (docs, next_cursor)
+    """
+    query = query.order_by(sort_field, direction=firestore.Query.DESCENDING)\
+        .order_by(FieldPath.document_id(), direction=firestore.Query.DESCENDING)
+
+    if cursor:
+        sort_value, doc_id = decode_cursor(cursor)
+        query = query.start_after({
+            sort_field: sort_value,
+            FieldPath.document_id(): doc_id,
+        })
+
+    docs = list(query.limit(limit + 1).stream())
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        next_cursor = encode_cursor(last.get(sort_field), last.id)
+
+    return docs, next_cursor
@@ -0,0 +1,58 @@
+# app/services/rate_limit.py
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    平均分配的速率限制：每次呼叫前等到下一個可用的時間點。
+    所有 thread 共用，確保整個 process 對外部 API 的請求不超過 quota。
+    """
+
+    def __init__(self, per_minute: int):
+        self.interval = 60.0 / max(per_minute, 1)
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """被對方限流（429 Retry-After）：所有 thread 一起往後延"""
+        with self._lock:
+            self._next_at = max(self._next_at, time.monotonic() + seconds)
+
+
+class SharedMinuteBudget:
+    """
+    所有 process / instance 共用的每分鐘請求上限（Redis 固定視窗計數）。
+    用完就等到下一分鐘；Redis 連不上時只靠 process 內的 RateLimiter，不擋住呼叫端。
+    """
+
+    def __init__(self, name: str, per_minute: int):
+        self.key = f"budget:{name}:{{window}}"
+        self.per_minute = max(per_minute, 1)
+
+    def acquire(self):
+        from app.services.redis_service import get_redis
+
+        while True:
+            now = time.time()
+            key = self.key.format(window=int(now // 60))
+            try:
+                pipe = get_redis().pipeline(transaction=False)
+                pipe.incr(key)
+                pipe.expire(key, 120)
+                used = pipe.execute()[0]
+            except Exception as e:
+                print(f"[RateLimit] shared budget unavailable ({self.key}): {e}")
+                return
+
+            if used <= self.per_minute:
+                return
+            time.sleep(60 - now % 60 + 0.05)
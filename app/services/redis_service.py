@@ -1,51 +1,91 @@
 import json
 import math
 import time
+import numpy as np
 import redis
 import os
+from app.config import settings
+from app.config.settings import (
+    HEARTBEAT_LOCATION_PRECISION,
+    HEARTBEAT_REPLAY_SEC,
+    HEARTBEAT_TTL_SEC,
+    NEARBY_CACHE_SEC,
+    NEARBY_GROUP_CAP,
+    NEARBY_INDEX_PRECISION,
+    NEARBY_MAX_RINGS,
+    NEARBY_PAGE_SIZE,
+    NEARBY_TARGET_COUNT,
+    REDIS_MAX_CONNECTIONS,
+)
+from app.services.client_registry import get_or_create
+from app.services.geo_cells import cell_of, covered_radius_km, ring_cells
+from app.services.heartbeat_codec import batch_row, decode_heartbeat, decode_heartbeats, encode_heartbeat, split_heartbeat
+from app.services.tracing import traced_client
+
+# hash：user_id → 最後一次 heartbeat 的時間（unix 秒）
+LAST_ACTIVE_KEY = "user_last_active"
 
 
 class HeartbeatRedisService:
     def __init__(self, host=None, port=None, password=None):
+        # 沒指定連線資訊 → 跟其他服務共用同一個 connection pool
+        self.shared = host is None and port is None and password is None
         self.host = host or os.getenv("REDIS_HOST")
         self.port = port or int(os.getenv("REDIS_PORT", "6379"))
         self.password = password or os.getenv("REDIS_PASSWORD")
-        self.redis = self.get_redis_client()
+        self._client = None if self.shared else self.get_redis_client()
+        self._binary_client = None if self.shared else self.get_redis_client(decode_responses=False)
+
+    @property
+    def redis(self):
+        # 共用的 client 每次從 registry 拿：fork 出來的 worker 會用自己的連線
+        if self._client is None:
+            return self.get_redis_client()
+        return self._client
+
+    @property
+    def redis_binary(self):
+        # heartbeat hot record 是 binary，不能用 decode_responses=True 的 client 讀
+        if self._binary_client is None:
+            return self.get_redis_client(decode_responses=False)
+        return self._binary_client
 
     # --------------------------
     # Redis Client
     # --------------------------
-    def get_redis_client(self):
-        return redis.Redis(
+    def get_redis_client(self, decode_responses=True):
+        if settings.use_memory_backend() or self.shared:
+            return get_redis() if decode_responses else get_redis_binary()
+
+        return _traced(redis.Redis(
             host=self.host,
             port=self.port,
             password=self.password,
-            decode_responses=True
-        )
+            decode_responses=decode_responses
+        ))
 
     # --------------------------
-    # 取出所有 heartbeat（使用 SCAN）
+    # 取出所有 heartbeat（使用 SCAN），一次解成 NumPy 陣列
     # --------------------------
-    def get_all_heartbeats(self):
+    def get_heartbeat_batch(self):
         cursor = 0
-        all_data = []
+        values = []
 
         while True:
-            cursor, keys = self.redis.scan(cursor=cursor, match="*:heartbeat", count=200)
+            cursor, keys = self.redis_binary.scan(cursor=cursor, match="*:heartbeat", count=200)
 
             if keys:
-                values = self.redis.mget(keys)
-                for v in values:
-                    if v:
-                        try:
-                            all_data.append(json.loads(v))
-                        except:
-                            pass
+                values.extend(self.redis_binary.mget(keys))
 
             if cursor == 0:
                 break
 
-        return all_data
+        return decode_heartbeats(values)
+
+    def get_all_heartbeats(self):
+        """只有 hot 欄位（user / track / artist id、時間、位置、popularity）"""
+        batch = self.get_heartbeat_batch()
+        return [batch_row(batch, i) for i in range(len(batch["user_id"]))]
 
     # --------------------------
     # 過濾：時間（例如 3 分鐘內）
@@ -125,32 +165,314 @@ class HeartbeatRedisService:
             "just_near": just_near
         }
 
+    @staticmethod
+    def haversine_np(lat1, lon1, lat2, lon2):
+        """同 haversine，但 lat2 / lon2 是陣列"""
+        R = 6371
+        lat1, lon1 = math.radians(lat1), math.radians(lon1)
+        lat2, lon2 = np.radians(lat2), np.radians(lon2)
+
+        a = (
+            np.sin((lat2 - lat1) / 2) ** 2 +
+            math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        )
+
+        return R * 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
     # --------------------------
     # 綜合流程：取得附近音樂分組
     # --------------------------
     def get_nearby_music_groups(self, my_user_id, my_track_id, my_artist_id, my_lat, my_lng,
                                 max_age_sec=180, km=0.150):
-        # 1. 撈全部
-        all_data = self.get_all_heartbeats()
+        # 1. 撈全部（binary → NumPy 陣列）
+        batch = self.get_heartbeat_batch()
+        if not len(batch["user_id"]):
+            return {"same_track": [], "same_artist": [], "just_near": []}
 
-        # 2. 時間過濾
-        fresh = self.filter_by_time(all_data, max_age_sec=max_age_sec)
+        # 2. 時間 + 距離過濾、排除自己（向量化）
+        now = int(time.time())
+        nearby = (
+            (now - batch["timestamp"] <= max_age_sec)
+            & (self.haversine_np(my_lat, my_lng, batch["lat"], batch["lng"]) <= km)
+            & (batch["user_id"] != my_user_id)
+        )
 
-        # 3. 距離過濾
-        nearby = self.filter_by_location(fresh, my_lat, my_lng, km=km)
+        # 3. 分成 same_track / same_artist / just_near（規則同 classify_by_music_simple）
+        same_track = nearby & (batch["track_id"] == my_track_id)
+        same_artist = nearby & ~same_track & (batch["artist_id"] == my_artist_id)
+        just_near = nearby & ~same_track & (batch["artist_id"] != my_artist_id)
 
-        # 4. 分成 same_track / same_artist
-        groups = self.classify_by_music_simple(
-            all_data=nearby,
-            my_user_id=my_user_id,
-            my_track_id=my_track_id,
-            my_artist_id=my_artist_id
-        )
+        # 4. 只替命中的人讀顯示用欄位
+        rows = {int(i): batch_row(batch, i) for i in np.flatnonzero(nearby)}
+        self._attach_meta(list(rows.values()))
 
-        return groups
+        return {
+            "same_track": [rows[int(i)] for i in np.flatnonzero(same_track)],
+            "same_artist": [rows[int(i)] for i in np.flatnonzero(same_artist)],
+            "just_near": [rows[int(i)] for i in np.flatnonzero(just_near)],
+        }
+
+    # --------------------------
+    # Adaptive nearby：依 geohash 圈數擴大 / 依人數縮小半徑，結果排序 + 限量
+    # --------------------------
+    def _ring_members(self, cells):
+        """{ user_id: cell }（一次 pipeline 讀完這一圈所有 cell）"""
+        cells = sorted(cells)
+        pipe = self.redis.pipeline(transaction=False)
+        for cell in cells:
+            pipe.smembers(f"hbidx:{cell}")
+        members = {}
+        for cell, uids in zip(cells, pipe.execute()):
+            for uid in uids:
+                members.setdefault(uid, cell)
+        return members
+
+    def _load_ring(self, members, my_user_id, my_lat, my_lng, now, max_age_sec):
+        """讀這一圈的人的 hot record，回傳 (batch, distance_km)；index 裡已過期的人順手移除"""
+        uids = [uid for uid in members if uid != my_user_id]
+        values = self.redis_binary.mget([f"{uid}:heartbeat" for uid in uids]) if uids else []
+
+        expired = [uid for uid, raw in zip(uids, values) if raw is None]
+        if expired:
+            pipe = self.redis.pipeline(transaction=False)
+            for uid in expired:
+                pipe.srem(f"hbidx:{members[uid]}", uid)
+            pipe.execute()
+
+        batch = decode_heartbeats(values)
+        keep = (now - batch["timestamp"] <= max_age_sec) & (batch["user_id"] != my_user_id)
+        batch = {k: v[keep] for k, v in batch.items()}
+        return batch, self.haversine_np(my_lat, my_lng, batch["lat"], batch["lng"])
+
+    def get_nearby_adaptive(self, my_user_id, my_track_id, my_artist_id, my_lat, my_lng,
+                            target_count=NEARBY_TARGET_COUNT, limit=NEARBY_PAGE_SIZE,
+                            group_cap=NEARBY_GROUP_CAP, max_rings=NEARBY_MAX_RINGS, max_age_sec=180):
+        """
+        1. 從自己所在的 cell 開始一圈一圈讀 index，直到「確定看完的半徑內」有 target_count 人
+           （或到 max_rings 圈）→ 人少的地方半徑自動變大
+        2. 半徑內超過 target_count 人 → 半徑縮到第 target_count 近的人 → 人多的地方半徑自動變小
+        3. 依「音樂相似度（同首歌 > 同歌手 > 其他）+ 距離」排序，每組最多 group_cap、總共最多 limit 人
+
+        回傳跟 get_nearby_music_groups 同樣的三組（每筆多 distance_m），另外附上 radius_m / rings / total_nearby。
+        """
+        cell = cell_of(my_lat, my_lng, NEARBY_INDEX_PRECISION)
+        now = int(time.time())
+
+        seen = set()
+        batches, distances = [], []
+        radius_km, rings = 0.0, 0
+        for k in range(max_rings + 1):
+            members = {uid: c for uid, c in self._ring_members(ring_cells(cell, k)).items() if uid not in seen}
+            seen.update(members)
+            if members:
+                batch, dist = self._load_ring(members, my_user_id, my_lat, my_lng, now, max_age_sec)
+                batches.append(batch)
+                distances.append(dist)
+
+            radius_km, rings = covered_radius_km(my_lat, my_lng, cell, k), k
+            found = sum(int((d <= radius_km).sum()) for d in distances)
+            if found >= target_count:
+                break
+
+        empty = {"same_track": [], "same_artist": [], "just_near": []}
+        if not batches:
+            return {**empty, "radius_m": round(radius_km * 1000), "rings": rings, "total_nearby": 0}
+
+        batch = {k: np.concatenate([b[k] for b in batches]) for k in batches[0]}
+        dist = np.concatenate(distances)
+
+        inside = dist <= radius_km
+        total = int(inside.sum())
+        if total > target_count:
+            radius_km = float(np.partition(dist[inside], target_count - 1)[target_count - 1])
+            inside = dist <= radius_km
+
+        # 同首歌 2、同歌手 1、其他 0；同一級裡越近越前面
+        same_track = batch["track_id"] == my_track_id
+        same_artist = ~same_track & (batch["artist_id"] == my_artist_id)
+        affinity = np.where(same_track, 2.0, np.where(same_artist, 1.0, 0.0))
+        score = affinity + (1.0 - dist / max(radius_km, 1e-9))
+
+        groups = {name: [] for name in empty}
+        picked = 0
+        for i in np.argsort(-score, kind="stable"):
+            if picked >= limit:
+                break
+            if not inside[i]:
+                continue
+            name = "same_track" if same_track[i] else "same_artist" if same_artist[i] else "just_near"
+            if len(groups[name]) >= group_cap:
+                continue
+            row = batch_row(batch, i)
+            row["distance_m"] = round(float(dist[i]) * 1000, 1)
+            groups[name].append(row)
+            picked += 1
+
+        self._attach_meta([row for rows in groups.values() for row in rows])
+        return {**groups, "radius_m": round(radius_km * 1000), "rings": rings, "total_nearby": total}
+
+    def _attach_meta(self, heartbeats):
+        if not heartbeats:
+            return heartbeats
+        metas = self.redis_binary.mget([f"{hb['user_id']}:hb_meta" for hb in heartbeats])
+        for hb, raw in zip(heartbeats, metas):
+            hb.update(_loads(raw) or {})
+        return heartbeats
 
     # --------------------------
     # 存 heartbeat
     # --------------------------
-    def set_heartbeat(self, user_id, heartbeat, ttl_sec=180):
-        self.redis.set(f"{user_id}:heartbeat", json.dumps(heartbeat), ex=ttl_sec)
+    # {user_id}:heartbeat = compact binary hot record（見 heartbeat_codec）
+    # {user_id}:hb_meta    = 顯示用欄位（歌名、專輯圖、display_name、avatarUrl）的 JSON
+    # hbidx:{geohash}      = 這格裡的 user_id（adaptive nearby 用；換 cell 時從舊格移除，過期的人讀的時候順手清掉）
+    def set_heartbeat(self, user_id, heartbeat, ttl_sec=HEARTBEAT_TTL_SEC):
+        hot, meta = split_heartbeat(heartbeat)
+        pipe = self.redis_binary.pipeline(transaction=False)
+        pipe.set(f"{user_id}:heartbeat", encode_heartbeat(hot), ex=ttl_sec)
+        pipe.set(f"{user_id}:hb_meta", json.dumps(meta), ex=ttl_sec)
+        self._index_heartbeat(pipe, user_id, hot, ttl_sec)
+        pipe.execute()
+
+    @staticmethod
+    def _index_heartbeat(pipe, user_id, hot, ttl_sec, previous=None):
+        """previous：上一次的 play_state；換了 cell 就從舊的 cell 移除（不然還活著的人會留在走過的每一格）"""
+        if hot.get("lat") is None or hot.get("lng") is None:
+            return
+        cell = cell_of(hot["lat"], hot["lng"], NEARBY_INDEX_PRECISION)
+        if previous and previous.get("lat") is not None and previous.get("lng") is not None:
+            old_cell = cell_of(previous["lat"], previous["lng"], NEARBY_INDEX_PRECISION)
+            if old_cell != cell:
+                pipe.srem(f"hbidx:{old_cell}", user_id)
+        key = f"hbidx:{cell}"
+        pipe.sadd(key, user_id)
+        pipe.expire(key, ttl_sec)
+
+    def get_heartbeats(self, user_ids):
+        """{ user_id: heartbeat（含顯示用欄位）}；已過期的不會出現"""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        values = self.redis_binary.mget([f"{uid}:heartbeat" for uid in user_ids])
+        heartbeats = [hb for hb in (decode_heartbeat(raw) for raw in values) if hb]
+        self._attach_meta(heartbeats)
+        return {hb["user_id"]: hb for hb in heartbeats}
+
+    # --------------------------
+    # 播放狀態：判斷這次 heartbeat 是不是「真的換歌 / 換地方」
+    # {user_id}:play_state = { track_id, cell, started_at, lat, lng, nearby_variant }
+    # {user_id}:nearby     = 上次算好的 nearby groups（短 TTL；adaptive 是 {user_id}:nearby:{variant}）
+    # --------------------------
+    @staticmethod
+    def play_state_of(heartbeat, started_at, precision=HEARTBEAT_LOCATION_PRECISION):
+        lat = round(float(heartbeat["lat"]), precision)
+        lng = round(float(heartbeat["lng"]), precision)
+        return {
+            "track_id": heartbeat["track_id"],
+            "cell": f"{lat},{lng}",
+            "started_at": started_at,
+            "lat": heartbeat["lat"],
+            "lng": heartbeat["lng"],
+        }
+
+    @staticmethod
+    def is_play_change(prev_state, state, now, replay_after_sec=HEARTBEAT_REPLAY_SEC):
+        """
+        換歌、換位置、或同一首歌已經播超過一輪（重播）才算 change。
+        """
+        if not prev_state:
+            return True
+        if prev_state.get("track_id") != state["track_id"] or prev_state.get("cell") != state["cell"]:
+            return True
+        return now - prev_state.get("started_at", 0) >= replay_after_sec
+
+    @staticmethod
+    def _nearby_key(user_id, variant=None):
+        return f"{user_id}:nearby" if not variant else f"{user_id}:nearby:{variant}"
+
+    def get_play_state(self, user_id, nearby_variant=None):
+        """
+        一次 MGET 拿回 (play_state, cached nearby groups)；沒有就是 None。
+        nearby_variant：不同查詢模式（例如 adaptive + page size）各自一份快取
+        """
+        state_raw, nearby_raw = self.redis.mget([
+            f"{user_id}:play_state", self._nearby_key(user_id, nearby_variant)
+        ])
+        return _loads(state_raw), _loads(nearby_raw)
+
+    def get_latest_nearby(self, user_id):
+        """
+        (play_state, 上次 heartbeat_auto 算好的 nearby groups)：
+        用 play_state 記下的 nearby_variant 找快取，adaptive / 一般模式的 client 都拿得到自己那一份
+        """
+        state = _loads(self.redis.get(f"{user_id}:play_state"))
+        if state is None:
+            return None, None
+        return state, _loads(self.redis.get(self._nearby_key(user_id, state.get("nearby_variant"))))
+
+    def save_heartbeat_state(self, user_id, heartbeat, state, changed=True, ttl_sec=HEARTBEAT_TTL_SEC, previous=None):
+        """
+        heartbeat（續 TTL + 更新 timestamp，nearby 的時間過濾靠它）和 play_state 一次送出；
+        沒換歌時 meta 不用重寫，只續 TTL。previous 是上一次的 play_state（維護 hbidx 用）。
+        """
+        hot, meta = split_heartbeat(heartbeat)
+        pipe = self.redis_binary.pipeline(transaction=False)
+        pipe.set(f"{user_id}:heartbeat", encode_heartbeat(hot), ex=ttl_sec)
+        if changed:
+            pipe.set(f"{user_id}:hb_meta", json.dumps(meta), ex=ttl_sec)
+        else:
+            pipe.expire(f"{user_id}:hb_meta", ttl_sec)
+        pipe.set(f"{user_id}:play_state", json.dumps(state), ex=ttl_sec)
+        # 最後活躍時間（不過期）：history harvester 依此決定同步優先順序
+        pipe.hset(LAST_ACTIVE_KEY, user_id, int(hot.get("timestamp") or time.time()))
+        self._index_heartbeat(pipe, user_id, hot, ttl_sec, previous)
+        pipe.execute()
+
+    def cache_nearby_groups(self, user_id, groups, nearby_variant=None, ttl_sec=NEARBY_CACHE_SEC):
+        self.redis.set(self._nearby_key(user_id, nearby_variant), json.dumps(groups), ex=ttl_sec)
+
+
+def _loads(raw):
+    if not raw:
+        return None
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return None
+
+
+# --------------------------
+# 共用 Redis client（heartbeat 以外的服務用，例如 swipe deck）
+# --------------------------
+def _traced(client):
+    # pipeline 內的指令是一次送出，只追蹤 execute
+    return traced_client(client, "redis", nested={"pipeline": {"execute"}})
+
+
+def _create_redis(decode_responses=True):
+    pool = redis.ConnectionPool(
+        host=os.getenv("REDIS_HOST"),
+        port=int(os.getenv("REDIS_PORT", "6379")),
+        password=os.getenv("REDIS_PASSWORD"),
+        decode_responses=decode_responses,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        socket_keepalive=True,
+        health_check_interval=30,
+    )
+    return _traced(redis.Redis(connection_pool=pool))
+
+
+def get_redis():
+    if settings.use_memory_backend():
+        from app.services.memory_backend import get_memory_redis
+        return _traced(get_memory_redis())
+
+    return get_or_create("redis", _create_redis)
+
+
+def get_redis_binary():
+    """decode_responses=False 的 client（heartbeat binary record 用），自己一個 pool"""
+    if settings.use_memory_backend():
+        from app.services.memory_backend import get_memory_redis
+        return _traced(get_memory_redis())
+
+    return get_or_create("redis_binary", lambda: _create_redis(decode_responses=False))
@@ -1,106 +1,292 @@
-import time
-import requests
-from app.services.spotify_token_service import get_spotify_token, refresh_spotify_token
-from app.services.heartbeat_pubsub import publish_heartbeat
+# app/services/spotify_history.py
+"""
+Recently played 同步：把使用者沒開 App 時聽的歌補進 BigQuery（經 Pub/Sub heartbeat-topic）。
+
+- 從最新一頁開始，沿著 cursors.before 往回翻，直到碰到上次同步的時間點
+  （超過 50 首也不會漏；最多 SPOTIFY_HISTORY_MAX_PAGES 頁）
+- 每個使用者的所有歌一次 batch publish，last_history_sync_at 推進到抓到的最新一首；
+  publish 失敗的那幾筆存進 users.history_retry，下次同步只重送它們（成功的不會重送、不會重複寫進 BigQuery）
+- 多個使用者可以並行同步（sync_recently_played_many），對 Spotify 的請求由
+  process 共用的 spotify_limiter 控制在 SPOTIFY_REQUESTS_PER_MINUTE 以內
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.config.settings import (
+    SPOTIFY_HISTORY_MAX_PAGES,
+    SPOTIFY_REQUESTS_PER_MINUTE,
+    SPOTIFY_SYNC_WORKERS,
+)
+from app.services.client_registry import get_or_create
 from app.services.firestore_client import get_db
+from app.services.heartbeat_pubsub import publish_heartbeats
+from app.services.image_variants import avatar_url_for
+from app.services.rate_limit import RateLimiter
+from app.services.spotify_token_service import get_valid_spotify_token, refresh_spotify_token
+from app.services.tracing import span
+
+RECENTLY_PLAYED_URL = "https://api.spotify.com/v1/me/player/recently-played"
+PAGE_LIMIT = 50
+
+# 被 429 / 401 時同一頁最多試幾次
+SPOTIFY_MAX_ATTEMPTS = 3
+
+# users 文件只讀同步需要的欄位
+USER_FIELDS = [
+    "display_name", "name", "avatarUrl", "avatar_variants", "photo_url",
+    "last_history_sync_at", "history_retry",
+]
+
+# history_retry 最多留幾筆（Pub/Sub 一直掛掉時只留最新的，文件不會無限變大）
+HISTORY_RETRY_MAX = 200
+
+# 整個 process 共用：所有 thread 對 Spotify 的請求加起來不超過 quota
+spotify_limiter = RateLimiter(SPOTIFY_REQUESTS_PER_MINUTE)
+
+
+class SpotifyHistoryError(Exception):
+    pass
+
+
+def _session():
+    def create():
+        import requests
+
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=SPOTIFY_SYNC_WORKERS * 2)
+        session.mount("https://", adapter)
+        return session
+
+    return get_or_create("spotify_http", create)
+
+
+def _parse_played_at(value) -> Optional[float]:
+    # Spotify 的 played_at："2024-05-01T12:34:56.789Z"
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+# ======================================================
+# Spotify：一頁 recently-played（限速 + 429 / 401 重試）
+# ======================================================
+def _get_page(user_id: str, access_token: str, params: Dict, budget=None):
+    """
+    :param budget: 額外的共用額度（例如 harvester 的 SharedMinuteBudget），每個 request 前 acquire 一次
+    :return: (response JSON, access_token)；token 中途被拒會 refresh 一次，回傳新的 token
+    """
+    for attempt in range(SPOTIFY_MAX_ATTEMPTS):
+        if budget is not None:
+            budget.acquire()
+        spotify_limiter.acquire()
+        with span("spotify", "recently_played"):
+            r = _session().get(
+                RECENTLY_PLAYED_URL,
+                headers={"Authorization": f"Bearer {access_token}"},
+                params=params,
+                timeout=10,
+            )
+
+        if r.status_code == 200:
+            return r.json(), access_token
+
+        if r.status_code == 429:
+            # 整個 process 一起暫停，不只這個 thread
+            spotify_limiter.pause(float(r.headers.get("Retry-After") or 1))
+            continue
+
+        if r.status_code == 401 and attempt == 0:
+            token = refresh_spotify_token(user_id, rejected_access_token=access_token)
+            if token and token.get("access_token"):
+                access_token = token["access_token"]
+                continue
+
+        raise SpotifyHistoryError(f"Spotify API Error: {r.text}")
+
+    raise SpotifyHistoryError("Spotify API Error: rate limited")
+
+
+def fetch_recently_played(user_id: str, access_token: str, since: float = 0,
+                          max_pages: int = SPOTIFY_HISTORY_MAX_PAGES, budget=None) -> List[tuple]:
+    """
+    從最新的開始往回翻（cursors.before），直到碰到 since 或沒有更舊的。
+    :return: [(played_at 秒, item)]，舊到新，同一個 played_at 只留一筆
+    """
+    played = {}
+    params = {"limit": PAGE_LIMIT}
+
+    for page in range(max_pages):
+        data, access_token = _get_page(user_id, access_token, params, budget)
+        items = data.get("items") or []
+
+        reached_since = False
+        for item in items:
+            played_at = _parse_played_at(item.get("played_at"))
+            if played_at is None:
+                continue
+            if played_at <= since:
+                reached_since = True
+                continue
+            played[played_at] = item
+
+        before = (data.get("cursors") or {}).get("before")
+        if reached_since or len(items) < PAGE_LIMIT or not before:
+            break
+        params = {"limit": PAGE_LIMIT, "before": before}
+    else:
+        print(f"[History] {user_id}: stopped after {max_pages} pages, older plays not synced")
+
+    return sorted(played.items(), key=lambda kv: kv[0])
+
+
+def _heartbeat_payload(user_id: str, user_data: Dict, played_at: float, item: Dict, lat, lng) -> Dict:
+    track = item["track"]
+    images = (track.get("album") or {}).get("images") or []
+    return {
+        "user_id": user_id,
+        "track_id": track["id"],
+        "track_name": track["name"],
+        "artist_id": track["artists"][0]["id"],
+        "artist_name": track["artists"][0]["name"],
+        "popularity": track.get("popularity", 0),
+        "timestamp": int(played_at),  # 實際播放時間
+        # 位置是「現在」的位置，補歷史紀錄時當作近似值
+        "lat": lat,
+        "lng": lng,
+        "album_image": images[0]["url"] if images else None,
+        "display_name": user_data.get("display_name", user_data.get("name")),
+        "avatarUrl": avatar_url_for(user_data, "small"),
+    }
 
+
+# ======================================================
+# 單一使用者：抓 → batch publish → 算出新的 checkpoint / 待重送清單（不寫 Firestore）
+# ======================================================
+def _sync_user(user_id: str, user_data: Dict, lat=None, lng=None, budget=None, touch=True):
+    """
+    :param touch: False = 批次同步，讀 token 不算使用者「正在用」（見 get_valid_spotify_token）
+    :return: (result dict, 要寫回 users 的欄位（last_history_sync_at / history_retry）或 None（不用更新）)
+    """
+    last_sync_time = user_data.get("last_history_sync_at", 0) or 0
+    retry = list(user_data.get("history_retry") or [])
+
+    token = get_valid_spotify_token(user_id, touch=touch)
+    if not token:
+        return {"status": "error", "message": "Spotify token unavailable"}, None
+
+    try:
+        played = fetch_recently_played(user_id, token["access_token"], since=last_sync_time, budget=budget)
+    except SpotifyHistoryError as e:
+        return {"status": "error", "message": str(e)}, None
+
+    if not played and not retry:
+        return {"status": "ok", "synced_count": 0}, None
+
+    # 上次送失敗的排前面（比較舊），再接這次新抓到的
+    payloads = list(retry)
+    for played_at, item in played:
+        try:
+            payloads.append(_heartbeat_payload(user_id, user_data, played_at, item, lat, lng))
+        except (KeyError, IndexError, TypeError):
+            # 本地檔案 / podcast 之類缺欄位的項目
+            continue
+
+    sent = publish_heartbeats(payloads)
+
+    # checkpoint 直接推進到最新一首：送成功的不會再送一次，失敗的只有它們自己進 history_retry
+    failed = [payload for payload, ok in zip(payloads, sent) if not ok][-HISTORY_RETRY_MAX:]
+    update = {}
+    if played and played[-1][0] > last_sync_time:
+        update["last_history_sync_at"] = played[-1][0]
+    if failed or retry:
+        update["history_retry"] = failed
+
+    result = {"status": "ok", "synced_count": sum(sent)}
+    if failed:
+        result["failed_count"] = len(failed)
+    return result, (update or None)
+
+
+def _load_users(db, user_ids):
+    """:return: { user_id: 欄位 }；沒有 users 文件的人不會出現（也不寫 checkpoint，免得建出空的 profile）"""
+    refs = [db.collection("users").document(uid) for uid in user_ids]
+    users = {}
+    for doc in db.get_all(refs, field_paths=USER_FIELDS):
+        if doc.exists:
+            users[doc.id] = doc.to_dict() or {}
+    return users
+
+
+def write_checkpoints(db, checkpoints: Dict[str, Dict]):
+    """
+    批次寫 last_history_sync_at / history_retry（Firestore batch 上限 500）；呼叫端只傳 users 文件存在的人
+    :param checkpoints: { user_id: _sync_user 回傳的欄位 }
+    """
+    items = list(checkpoints.items())
+    for start in range(0, len(items), 400):
+        batch = db.batch()
+        for user_id, fields in items[start:start + 400]:
+            batch.set(db.collection("users").document(user_id), fields, merge=True)
+        batch.commit()
+
+
+# ======================================================
+# Public
+# ======================================================
 def sync_recently_played(user_id: str, lat: float = None, lng: float = None) -> dict:
     """
     Fetch recently played tracks from Spotify and publish to BigQuery via Pub/Sub.
     Only publishes tracks played after the last sync time.
     """
-    
-    # 1. Get User Profile for last_sync_time
     db = get_db()
-    user_ref = db.collection("users").document(user_id)
-    user_doc = user_ref.get()
-    
-    last_sync_time = 0
-    user_data = {}
-    if user_doc.exists:
-        user_data = user_doc.to_dict()
-        last_sync_time = user_data.get("last_history_sync_at", 0)
-        
-    # 2. Get Spotify Token
-    token = get_spotify_token(user_id)
-    if not token:
-        return {"status": "error", "message": "Spotify not linked"}
-        
-    now = int(time.time())
-    if token["expires_at"] < now + 30:
-        token = refresh_spotify_token(user_id)
-        if not token:
-            return {"status": "error", "message": "Token refresh failed"}
-            
-    access_token = token["access_token"]
-    
-    # 3. Call Spotify API
-    url = "https://api.spotify.com/v1/me/player/recently-played?limit=50"
-    headers = {"Authorization": f"Bearer {access_token}"}
-    
-    # If we have a last sync time, we can use 'after' parameter (timestamp in ms)
-    # Spotify API 'after' takes unix timestamp in milliseconds
-    if last_sync_time > 0:
-        url += f"&after={int(last_sync_time * 1000)}"
-        
-    r = requests.get(url, headers=headers)
-    if r.status_code != 200:
-        return {"status": "error", "message": f"Spotify API Error: {r.text}"}
-        
-    data = r.json()
-    items = data.get("items", [])
-    
-    if not items:
-        return {"status": "ok", "synced_count": 0}
-        
-    # 4. Process and Publish
-    synced_count = 0
-    max_played_at = last_sync_time
-    
-    for item in items:
-        track = item["track"]
-        played_at_str = item["played_at"] # ISO 8601 string
-        # Convert to unix timestamp
-        # Python 3.7+ fromisoformat handles 'Z' if replaced by +00:00
+    users = _load_users(db, [user_id])
+
+    result, checkpoint = _sync_user(user_id, users.get(user_id) or {}, lat, lng)
+    if checkpoint is not None and user_id in users:
+        write_checkpoints(db, {user_id: checkpoint})
+    return result
+
+
+def load_sync_users(db, user_ids) -> Dict[str, Dict]:
+    """同步需要的 users 欄位（含 last_history_sync_at / history_retry），每 300 個一次 get_all；沒有 users 文件的人不在結果裡"""
+    user_ids = list(user_ids)
+    users = {}
+    for start in range(0, len(user_ids), 300):
+        users.update(_load_users(db, user_ids[start:start + 300]))
+    return users
+
+
+def sync_recently_played_many(user_ids, workers: int = SPOTIFY_SYNC_WORKERS,
+                              users: Dict[str, Dict] = None, budget=None) -> Dict[str, dict]:
+    """
+    多個使用者並行同步（沒有位置資訊）。
+    profile 一次 get_all（呼叫端已經讀過就傳 users）、checkpoint 最後一次 batch 寫入；
+    Spotify 請求總量由 spotify_limiter（+ budget）控制。
+    批次工作：token 用 touch=False 讀，不會讓背景 refresher 替這些人一直換 token。
+    :return: { user_id: result dict }
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return {}
+
+    db = get_db()
+    if users is None:
+        users = load_sync_users(db, user_ids)
+
+    def run(user_id):
         try:
-            # Simple parsing for ISO 8601
-            import datetime
-            dt = datetime.datetime.strptime(played_at_str.replace("Z", "+0000"), "%Y-%m-%dT%H:%M:%S.%f%z")
-            played_at_ts = dt.timestamp()
-        except:
-            # Fallback or skip
-            continue
-            
-        if played_at_ts > max_played_at:
-            max_played_at = played_at_ts
-            
-        # Construct payload similar to heartbeat
-        # Note: 'lat' and 'lng' might be from where they are NOW, not where they were then.
-        # But for "filling gaps", using current location is an acceptable approximation 
-        # or we can leave it null if the schema allows.
-        # User requested to "fill gaps", so let's use current location if provided.
-        
-        payload = {
-            "user_id": user_id,
-            "track_id": track["id"],
-            "track_name": track["name"],
-            "artist_id": track["artists"][0]["id"],
-            "artist_name": track["artists"][0]["name"],
-            "popularity": track.get("popularity", 0),
-            "timestamp": int(played_at_ts), # Use the actual played time
-            "lat": lat,
-            "lng": lng,
-            # Additional fields if available
-            "album_image": track["album"]["images"][0]["url"] if track["album"]["images"] else None,
-            "display_name": user_data.get("display_name"),
-            "avatarUrl": user_data.get("avatarUrl")
-        }
-        
-        publish_heartbeat(payload)
-        synced_count += 1
-        
-    # 5. Update last_sync_time
-    if max_played_at > last_sync_time:
-        user_ref.update({"last_history_sync_at": max_played_at})
-        
-    return {"status": "ok", "synced_count": synced_count}
+            return _sync_user(user_id, users.get(user_id) or {}, budget=budget, touch=False)
+        except Exception as e:
+            return {"status": "error", "message": str(e)}, None
+
+    results, checkpoints = {}, {}
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="history-sync") as pool:
+        for user_id, (result, checkpoint) in zip(user_ids, pool.map(run, user_ids)):
+            results[user_id] = result
+            if checkpoint is not None and user_id in users:
+                checkpoints[user_id] = checkpoint
+
+    write_checkpoints(db, checkpoints)
+    return results
@@ -1,5 +1,6 @@
 # app/services/spotify_now_playing.py
 import requests
+from app.services.tracing import log_event, span
 
 def fetch_now_playing(access_token: str):
     """
@@ -13,11 +14,17 @@ def fetch_now_playing(access_token: str):
     headers = {"Authorization": f"Bearer {access_token}"}
     url = "https://api.spotify.com/v1/me/player/currently-playing"
 
-    r = requests.get(url, headers=headers)
-
-    # Debug（必要）
-    print("Spotify Status:", r.status_code)
-    print("Spotify Raw:", r.text)
+    with span("spotify", "currently_playing"):
+        r = requests.get(url, headers=headers)
+
+    # 不再整包 print raw body：取樣記錄，非預期的狀態碼一律記
+    log_event(
+        "spotify.currently_playing",
+        force=r.status_code not in (200, 204, 401),
+        status=r.status_code,
+        content_type=r.headers.get("content-type"),
+        bytes=len(r.content or b""),
+    )
 
     # 204 -> No Content
     if r.status_code == 204:
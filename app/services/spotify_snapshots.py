@@ -0,0 +1,236 @@
+# app/services/spotify_snapshots.py
+"""
+user_top_tracks / user_top_artists / user_favorite_tracks 的 delta-only 寫入。
+
+- 每次 refresh，對每個 scope（top 清單是 period，favorites 整份一個 scope）算 digest：
+  只看有序的 id（+ added_at），popularity 這種每天都在變的欄位不算
+- digest 跟上次一樣 → 不寫；不一樣 → 整份清單用同一個 created_at 寫進 BigQuery，成為新版本
+- 每個 scope 上次的 digest / 版本號存在 Firestore spotify_snapshots/{user_id}
+- 讀取端一律讀 {table}_latest 表（每個 user / scope 只留最新版本，CLUSTER BY user_id），
+  由背景 maintenance 每 SNAPSHOT_LATEST_REFRESH_SEC 秒整份重建一次（也可以手動跑 scripts/run_snapshot_views.py）；
+  新版本最多晚一個間隔才讀得到，換來每次讀取只掃最新版本，不會隨歷史版本數變大
+- 舊版本每 SNAPSHOT_PRUNE_INTERVAL_SEC 秒清一次，只留最新 SNAPSHOT_KEEP_VERSIONS 版
+"""
+import hashlib
+import threading
+import time
+from typing import Dict, List
+
+from app.config.settings import (
+    BQ_DATASET,
+    BQ_PROJECT,
+    SNAPSHOT_KEEP_VERSIONS,
+    SNAPSHOT_LATEST_REFRESH_SEC,
+    SNAPSHOT_PRUNE_INTERVAL_SEC,
+)
+from app.services.bigquery_client import get_bq_client, insert_rows_json
+from app.services.firestore_client import get_db
+
+SNAPSHOT_COLLECTION = "spotify_snapshots"
+
+# 表 → 一個版本涵蓋的範圍（PARTITION BY）
+LATEST_VIEWS = {
+    "user_top_tracks": ("user_id", "period"),
+    "user_top_artists": ("user_id", "period"),
+    "user_favorite_tracks": ("user_id",),
+}
+
+# favorites 沒有 period，整份清單是一個 scope
+ALL_SCOPE = "all"
+
+# 多個 instance 都跑 maintenance：每個間隔只有先搶到 key 的那個真的做
+REFRESH_CLAIM_KEY = "snapshot_maintenance:refresh"
+PRUNE_CLAIM_KEY = "snapshot_maintenance:prune"
+
+
+def latest_table(table: str) -> str:
+    return f"{table}_latest"
+
+
+def list_digest(rows: List[Dict], key_fields) -> str:
+    h = hashlib.sha1()
+    for row in rows:
+        h.update("\x1f".join(str(row.get(f) or "") for f in key_fields).encode("utf-8"))
+        h.update(b"\x1e")
+    return h.hexdigest()[:16]
+
+
+# ======================================================
+# 寫入：只寫有變的 scope
+# ======================================================
+def store_snapshots(user_id: str, table: str, scoped_rows: Dict[str, List[Dict]], key_fields, created_at: str):
+    """
+    :param scoped_rows: { scope: rows }（rows 的 created_at 都是同一個值 = 這個版本）
+    :param key_fields: 算 digest 用的欄位（依 rows 的順序）
+    :return: 有寫入新版本的 scope
+    """
+    ref = get_db().collection(SNAPSHOT_COLLECTION).document(user_id)
+    doc = ref.get()
+    state = dict(((doc.to_dict() or {}).get(table) or {}) if doc.exists else {})
+
+    changed, rows_out = [], []
+    for scope, rows in scoped_rows.items():
+        # 空清單沒辦法在 BigQuery 表示成一個版本，保留上一版
+        if not rows:
+            continue
+        digest = list_digest(rows, key_fields)
+        previous = state.get(scope) or {}
+        if previous.get("digest") == digest:
+            continue
+
+        state[scope] = {
+            "digest": digest,
+            "version": int(previous.get("version", 0)) + 1,
+            "created_at": created_at,
+        }
+        changed.append(scope)
+        rows_out.extend(rows)
+
+    if rows_out:
+        # BigQuery 寫成功才記 digest；寫失敗下次 refresh 會再試
+        insert_rows_json(table, rows_out)
+        ref.set({table: state}, merge=True)
+
+    return changed
+
+
+# ======================================================
+# BigQuery：latest 表 / 舊版本清理
+# ======================================================
+def _table_id(table: str) -> str:
+    return f"{BQ_PROJECT}.{BQ_DATASET}.{table}"
+
+
+def latest_table_sql(table: str) -> str:
+    keys = ", ".join(LATEST_VIEWS[table])
+    return f"""
+    CREATE OR REPLACE TABLE `{_table_id(latest_table(table))}`
+    CLUSTER BY user_id
+    AS
+    SELECT * EXCEPT (_version_rank)
+    FROM (
+        SELECT *, DENSE_RANK() OVER (PARTITION BY {keys} ORDER BY created_at DESC) AS _version_rank
+        FROM `{_table_id(table)}`
+    )
+    WHERE _version_rank = 1
+    """
+
+
+def _get_table(client, table: str):
+    from google.api_core.exceptions import NotFound
+
+    try:
+        return client.get_table(_table_id(table))
+    except NotFound:
+        return None
+
+
+def refresh_latest_table(table: str):
+    """整份重建 {table}_latest；CREATE OR REPLACE 是原子的，讀取端只會看到舊的或新的那份"""
+    client = get_bq_client()
+    existing = _get_table(client, latest_table(table))
+    # 以前是 view，CREATE OR REPLACE TABLE 不能直接蓋掉 view
+    if existing is not None and existing.table_type == "VIEW":
+        client.delete_table(_table_id(latest_table(table)))
+    client.query(latest_table_sql(table)).result()
+    print(f"[Snapshots] table {latest_table(table)} refreshed")
+
+
+def refresh_latest_tables():
+    for table in LATEST_VIEWS:
+        refresh_latest_table(table)
+
+
+def cluster_base_tables():
+    """原始表 CLUSTER BY user_id（只影響之後寫入 / 重整的資料），prune 和重建只要掃相關的 block"""
+    client = get_bq_client()
+    for table in LATEST_VIEWS:
+        bq_table = _get_table(client, table)
+        if bq_table is None or bq_table.clustering_fields == ["user_id"]:
+            continue
+        bq_table.clustering_fields = ["user_id"]
+        client.update_table(bq_table, ["clustering_fields"])
+        print(f"[Snapshots] {table} clustered by user_id")
+
+
+def ensure_latest_tables():
+    """
+    啟動時呼叫：原始表設好 clustering、*_latest 表不存在（或還是舊的 view）才建，
+    已經存在就交給 maintenance 定期重建，不會每個 instance 啟動都整份重算。
+    memory backend 的 *_latest 由 MemoryBigQueryClient.table_df 直接算，不用建。
+    """
+    from app.config import settings
+
+    if settings.use_memory_backend():
+        return
+    cluster_base_tables()
+    client = get_bq_client()
+    for table in LATEST_VIEWS:
+        existing = _get_table(client, latest_table(table))
+        if existing is None or existing.table_type == "VIEW":
+            refresh_latest_table(table)
+
+
+def prune_old_versions(keep: int = SNAPSHOT_KEEP_VERSIONS):
+    """
+    刪掉每個 user / scope 最新 keep 版以外的舊資料
+    （上線前每次 refresh 都整份重寫，舊表裡大部分是重複的版本）。
+    """
+    client = get_bq_client()
+    for table, keys in LATEST_VIEWS.items():
+        partition = ", ".join(keys)
+        join = " AND ".join(f"v.{k} = t.{k}" for k in keys)
+        client.query(f"""
+        DELETE FROM `{_table_id(table)}` t
+        WHERE EXISTS (
+            SELECT 1
+            FROM (
+                SELECT {partition}, created_at,
+                       DENSE_RANK() OVER (PARTITION BY {partition} ORDER BY created_at DESC) AS version_rank
+                FROM `{_table_id(table)}`
+            ) v
+            WHERE v.version_rank > {int(keep)} AND {join} AND v.created_at = t.created_at
+        )
+        """).result()
+        print(f"[Snapshots] pruned {table} to the latest {keep} versions")
+
+
+# ======================================================
+# 背景 maintenance：定期重建 *_latest、清舊版本
+# ======================================================
+def run_snapshot_maintenance():
+    """
+    一個 tick：這個間隔還沒有人重建過就重建 *_latest，prune 同理（間隔比較長）。
+    :return: 這次做了哪些事
+    """
+    from app.config import settings
+    from app.services.redis_service import get_redis
+
+    if settings.use_memory_backend():
+        return []
+
+    r = get_redis()
+    done = []
+    if r.set(REFRESH_CLAIM_KEY, int(time.time()), ex=max(SNAPSHOT_LATEST_REFRESH_SEC - 5, 1), nx=True):
+        refresh_latest_tables()
+        done.append("refresh")
+    if r.set(PRUNE_CLAIM_KEY, int(time.time()), ex=max(SNAPSHOT_PRUNE_INTERVAL_SEC - 5, 1), nx=True):
+        prune_old_versions()
+        done.append("prune")
+    return done
+
+
+def _maintenance_loop(stop_event: threading.Event):
+    while not stop_event.wait(SNAPSHOT_LATEST_REFRESH_SEC):
+        try:
+            run_snapshot_maintenance()
+        except Exception as e:
+            print(f"[Snapshots] maintenance failed: {e}")
+
+
+def start_snapshot_maintenance() -> threading.Event:
+    """在 daemon thread 裡定期跑 run_snapshot_maintenance；回傳的 event set() 之後停止"""
+    stop_event = threading.Event()
+    thread = threading.Thread(target=_maintenance_loop, args=(stop_event,), name="snapshot-maintenance", daemon=True)
+    thread.start()
+    return stop_event
@@ -1,54 +1,215 @@
+# app/services/spotify_token_service.py
+"""
+Spotify token：Firestore spotify_tokens/{user_id} 是 source of truth，
+process 內再放一層快取，heartbeat 幾乎不用碰 Firestore 或 Spotify accounts。
+
+- get_valid_spotify_token()：快取命中且還沒快過期就直接回傳；
+  批次工作（harvester）用 touch=False，不算「使用中」、也不塞進快取
+- refresh_spotify_token()：每個 user 一把 lock（single-flight），同時進來的 request
+  只有一個真的去換 token，其他人等它換完拿同一份
+- start_token_refresher()：背景 thread 在到期前幾分鐘替「最近活躍」的使用者先換好
+"""
+import threading
 import time
+import zlib
 import requests
 from typing import Optional, Dict
 from google.cloud import firestore
-from app.config.settings import CLIENT_ID
+from app.config.settings import (
+    CLIENT_ID,
+    SPOTIFY_TOKEN_ACTIVE_WINDOW,
+    SPOTIFY_TOKEN_REFRESH_AHEAD,
+    SPOTIFY_TOKEN_REFRESH_INTERVAL,
+)
 from app.services.firestore_client import get_db
+from app.services.tracing import span
 
+# 剩不到這麼多秒就視為過期，request path 上必須先 refresh
+TOKEN_EXPIRY_MARGIN = 30
 
+# spotify_tokens 文件上固定存一個 bucket（crc32），harvester 用 range query 只讀自己 shard 的文件
+HARVEST_BUCKET_FIELD = "harvest_bucket"
+HARVEST_BUCKETS = 1024
+
+_tokens: Dict[str, Dict] = {}        # user_id → token dict
+_last_used: Dict[str, float] = {}    # user_id → 最後一次被 request 使用的時間
+_refresh_locks: Dict[str, threading.Lock] = {}
+_lock = threading.Lock()
+
+
+def _refresh_lock(user_id: str) -> threading.Lock:
+    with _lock:
+        lock = _refresh_locks.get(user_id)
+        if lock is None:
+            lock = _refresh_locks[user_id] = threading.Lock()
+        return lock
+
+
+def _is_fresh(token: Optional[Dict], margin: int = TOKEN_EXPIRY_MARGIN) -> bool:
+    return bool(token) and token.get("expires_at", 0) > int(time.time()) + margin
+
+
+def _cache_if_active(user_id: str, token: Dict):
+    """refresh 換到的新 token：只有 request 用過（快取裡有 / 在 _last_used 裡）的人才放進快取"""
+    if user_id in _tokens or user_id in _last_used:
+        _tokens[user_id] = token
 
-def save_spotify_token(user_id: str, token_data: Dict):
-    db = get_db()
-    db.collection("spotify_tokens").document(user_id).set(token_data)
 
-def get_spotify_token(user_id: str) -> Optional[Dict]:
+def harvest_bucket_of(user_id: str) -> int:
+    # crc32：每個 process / instance 算出來都一樣（hash() 每次啟動會變）
+    return zlib.crc32(user_id.encode("utf-8")) % HARVEST_BUCKETS
+
+
+def _load_spotify_token(user_id: str) -> Optional[Dict]:
     db = get_db()
     doc = db.collection("spotify_tokens").document(user_id).get()
     return doc.to_dict() if doc.exists else None
 
-def refresh_spotify_token(user_id: str):
-    token = get_spotify_token(user_id)
-    if not token:
-        return None
 
-    now = int(time.time())
+def save_spotify_token(user_id: str, token_data: Dict, touch: bool = True):
+    """
+    :param touch: False = 不是使用者自己在用（refresh），見 _cache_if_active
+    """
+    token_data = {**token_data, HARVEST_BUCKET_FIELD: harvest_bucket_of(user_id)}
+    db = get_db()
+    db.collection("spotify_tokens").document(user_id).set(token_data)
+    if touch:
+        # OAuth callback 存的也要記 _last_used，refresh_active_tokens 才會在閒置後把它移出快取
+        _last_used[user_id] = time.time()
+        _tokens[user_id] = token_data
+    else:
+        _cache_if_active(user_id, token_data)
+
 
-    # 不需要 refresh
-    if token["expires_at"] > now + 30:
+def get_spotify_token(user_id: str, touch: bool = True) -> Optional[Dict]:
+    """
+    先看 process 內快取，沒有才讀 Firestore。
+    :param touch: False = 批次工作讀 token：不更新 _last_used（背景 refresher 不會把他當成活躍使用者），
+        快取沒命中也不放進快取
+    """
+    if touch:
+        _last_used[user_id] = time.time()
+
+    token = _tokens.get(user_id)
+    if token is not None:
         return token
 
-    refresh_token = token.get("refresh_token")
-    if not refresh_token:
-        return None
+    token = _load_spotify_token(user_id)
+    if token and touch:
+        _tokens[user_id] = token
+    return token
+
+
+def get_valid_spotify_token(user_id: str, touch: bool = True) -> Optional[Dict]:
+    """
+    回傳可以直接用的 token（快過期就先 refresh）。
+    None = 沒連結 Spotify 或 refresh 失敗。
+    """
+    token = get_spotify_token(user_id, touch=touch)
+    if not token or _is_fresh(token):
+        return token
+    return refresh_spotify_token(user_id)
+
+
+def invalidate_spotify_token(user_id: str):
+    _tokens.pop(user_id, None)
+
+
+def refresh_spotify_token(user_id: str, rejected_access_token: str = None, margin: int = TOKEN_EXPIRY_MARGIN):
+    """
+    Single-flight refresh。
+
+    :param rejected_access_token: Spotify 回 401 的那個 access token；
+        就算 expires_at 看起來還沒到也要換，除非已經有別人換過了
+    :param margin: 剩不到 margin 秒就換（背景 refresher 會給比較大的值）
+
+    不會把沒在用的使用者（例如 harvester 讀的）加進快取。
+    """
+    with _refresh_lock(user_id):
+        # 等 lock 的期間可能已經有別的 request / worker 換好了 → 重讀 Firestore 再判斷
+        token = _load_spotify_token(user_id)
+        if not token:
+            _tokens.pop(user_id, None)
+            return None
+        _cache_if_active(user_id, token)
+
+        already_replaced = rejected_access_token is None or token.get("access_token") != rejected_access_token
+        if already_replaced and _is_fresh(token, margin):
+            return token
+
+        refresh_token = token.get("refresh_token")
+        if not refresh_token:
+            return None
+
+        url = "https://accounts.spotify.com/api/token"
+        payload = {
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+            "client_id": CLIENT_ID,
+        }
+
+        with span("spotify", "refresh_token"):
+            r = requests.post(url, data=payload)
+        new_token = r.json()
+
+        if "access_token" not in new_token:
+            return None
+
+        # Spotify 有時不會回 refresh token，要沿用舊的
+        if "refresh_token" not in new_token:
+            new_token["refresh_token"] = refresh_token
+
+        new_token["expires_at"] = int(time.time()) + new_token["expires_in"]
+
+        save_spotify_token(user_id, new_token, touch=False)
+        return new_token
+
+
+# ======================================================
+# 背景 refresher
+# ======================================================
+def refresh_active_tokens():
+    """
+    替最近活躍、快過期的使用者先換 token；太久沒用的從快取移除。
+    :return: (refreshed, failed)
+    """
+    now = time.time()
+    refreshed = failed = 0
+
+    for user_id, last_used in list(_last_used.items()):
+        if now - last_used > SPOTIFY_TOKEN_ACTIVE_WINDOW:
+            _last_used.pop(user_id, None)
+            _tokens.pop(user_id, None)
+            continue
+
+        if _is_fresh(_tokens.get(user_id), SPOTIFY_TOKEN_REFRESH_AHEAD):
+            continue
 
-    url = "https://accounts.spotify.com/api/token"
-    payload = {
-        "grant_type": "refresh_token",
-        "refresh_token": refresh_token,
-        "client_id": CLIENT_ID,
-    }
+        try:
+            if refresh_spotify_token(user_id, margin=SPOTIFY_TOKEN_REFRESH_AHEAD):
+                refreshed += 1
+            else:
+                failed += 1
+        except Exception as e:
+            failed += 1
+            print(f"[SpotifyToken] Background refresh failed for {user_id}: {e}")
 
-    r = requests.post(url, data=payload)
-    new_token = r.json()
+    return refreshed, failed
 
-    if "access_token" not in new_token:
-        return None
 
-    # Spotify 有時不會回 refresh token，要沿用舊的
-    if "refresh_token" not in new_token:
-        new_token["refresh_token"] = refresh_token
+def _refresher_loop(stop_event: threading.Event):
+    while not stop_event.wait(SPOTIFY_TOKEN_REFRESH_INTERVAL):
+        try:
+            refreshed, failed = refresh_active_tokens()
+            if refreshed or failed:
+                print(f"[SpotifyToken] refreshed={refreshed}, failed={failed}, cached={len(_tokens)}")
+        except Exception as e:
+            print(f"[SpotifyToken] Refresher error: {e}")
 
-    new_token["expires_at"] = int(time.time()) + new_token["expires_in"]
 
-    save_spotify_token(user_id, new_token)
-    return new_token
\ No newline at end of file
+def start_token_refresher() -> threading.Event:
+    """在 daemon thread 裡定期跑 refresh_active_tokens；回傳的 event set() 之後停止"""
+    stop_event = threading.Event()
+    thread = threading.Thread(target=_refresher_loop, args=(stop_event,), name="spotify-token-refresher", daemon=True)
+    thread.start()
+    return stop_event
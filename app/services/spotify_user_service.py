@@ -1,14 +1,11 @@
 # app/services/spotify_user_service.py
-import time
 from datetime import datetime, timezone
 from typing import Dict, Optional
 import requests
 from fastapi import HTTPException
-from app.services.spotify_token_service import (
-    get_spotify_token,
-    refresh_spotify_token,
-)
-from app.services.bigquery_client import insert_rows_json
+from app.services.spotify_token_service import get_valid_spotify_token
+from app.services.spotify_snapshots import ALL_SCOPE, store_snapshots
+from app.services.tracing import span
 
 SPOTIFY_API_BASE = "https://api.spotify.com/v1"
 
@@ -25,19 +22,12 @@ def _get_valid_access_token(user_id: str) -> str:
     """
     統一從 spotify_token_service 取得「可用的 access_token」：
 
-    1. 先 get_spotify_token(user_id)
-    2. 如果 expires_at 快過期 → refresh_spotify_token(user_id)
-    3. 回傳 access_token
+    1. get_valid_spotify_token(user_id)（process 內快取，快過期才 single-flight refresh）
+    2. 回傳 access_token
     """
-    token = get_spotify_token(user_id)
+    token = get_valid_spotify_token(user_id)
     if not token:
-        raise HTTPException(status_code=401, detail="Spotify not linked")
-
-    now = int(time.time())
-    if token.get("expires_at", 0) <= now + 30:
-        token = refresh_spotify_token(user_id)
-        if not token:
-            raise HTTPException(status_code=401, detail="Token refresh failed")
+        raise HTTPException(status_code=401, detail="Spotify token unavailable")
 
     access_token = token.get("access_token")
     if not access_token:
@@ -50,12 +40,19 @@ def _spotify_get(access_token: str, path: str, params: Optional[Dict] = None) ->
     url = f"{SPOTIFY_API_BASE}/{path}"
     headers = {"Authorization": f"Bearer {access_token}"}
 
-    r = requests.get(url, headers=headers, params=params)
+    with span("spotify", path):
+        r = requests.get(url, headers=headers, params=params)
     if r.status_code != 200:
         raise HTTPException(status_code=r.status_code, detail=f"Spotify error: {r.text}")
 
     return r.json()
 
+def _by_period(rows):
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row["period"], []).append(row)
+    return grouped
+
 # --------- Top Tracks ---------
 def fetch_and_store_top_tracks(user_id: str) -> None:
     access_token = _get_valid_access_token(user_id)
@@ -89,7 +86,8 @@ def fetch_and_store_top_tracks(user_id: str) -> None:
                 "created_at": now,
             })
 
-    insert_rows_json("user_top_tracks", rows)
+    # 只寫清單有變的 period（popularity 不算變）
+    store_snapshots(user_id, "user_top_tracks", _by_period(rows), ("track_id",), now)
 
 # --------- Top Artists ---------
 def fetch_and_store_top_artists(user_id: str) -> None:
@@ -120,7 +118,7 @@ def fetch_and_store_top_artists(user_id: str) -> None:
                 "created_at": now,
             })
 
-    insert_rows_json("user_top_artists", rows)
+    store_snapshots(user_id, "user_top_artists", _by_period(rows), ("artist_id",), now)
 
 # --------- Favorite Tracks (Saved Tracks) ---------
 def fetch_and_store_favorite_tracks(user_id: str) -> None:
@@ -164,4 +162,4 @@ def fetch_and_store_favorite_tracks(user_id: str) -> None:
 
         offset += limit
 
-    insert_rows_json("user_favorite_tracks", rows)
\ No newline at end of file
+    store_snapshots(user_id, "user_favorite_tracks", {ALL_SCOPE: rows}, ("track_id", "added_at"), now)
\ No newline at end of file
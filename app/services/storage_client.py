@@ -1,14 +1,24 @@
 # app/services/storage_client.py
 
-import os
-import base64
-import json
-from google.cloud import storage
-from google.oauth2 import service_account
+from app.config import settings
+from app.config.gcp_credentials import get_credentials
 from app.config.settings import GCP_BUCKET_NAME
+from app.services.client_registry import build_authorized_session, get_or_create
 from datetime import timedelta
 
-_cached_gcs_client = None
+
+def _create_client():
+    credentials = get_credentials()
+
+    try:
+        from google.cloud import storage
+        return storage.Client(
+            credentials=credentials,
+            project=credentials.project_id,
+            _http=build_authorized_session(credentials),
+        )
+    except Exception as e:
+        raise Exception(f"Failed to create GCS client: {e}")
 
 
 def get_gcs_client():
@@ -16,45 +26,27 @@ def get_gcs_client():
     Lazy-load Storage client using service account credentials encoded in BASE64
     via environment variable GOOGLE_CLOUD_CREDENTIALS.
 
-    和 firestore_client.py 的邏輯完全一致。
+    和 firestore_client.py 一樣由 client_registry 管理（每個 process 一個）。
     """
+    if settings.use_memory_backend():
+        from app.services.memory_backend import get_memory_storage
+        return get_memory_storage()
 
-    global _cached_gcs_client
-
-    # 如果之前建立過 → 直接回傳
-    if _cached_gcs_client is not None:
-        return _cached_gcs_client
-
-    # 讀取 BASE64 JSON
-    raw = os.getenv("GOOGLE_CLOUD_CREDENTIALS")
-    if not raw:
-        raise Exception("Missing GOOGLE_CLOUD_CREDENTIALS in environment")
-
-    try:
-        creds_dict = json.loads(base64.b64decode(raw).decode("utf-8"))
-    except Exception as e:
-        raise Exception(f"Failed to decode GOOGLE_CLOUD_CREDENTIALS: {e}")
-
-    try:
-        credentials = service_account.Credentials.from_service_account_info(creds_dict)
-    except Exception as e:
-        raise Exception(f"Failed to create GCS credentials: {e}")
+    return get_or_create("gcs", _create_client)
 
-    try:
-        _cached_gcs_client = storage.Client(
-            credentials=credentials, project=credentials.project_id
-        )
-    except Exception as e:
-        raise Exception(f"Failed to create GCS client: {e}")
 
-    return _cached_gcs_client
+def upload_avatar_to_gcs(user_id: str, file_bytes: bytes, content_type: str) -> str:
+    return upload_image_to_gcs(f"avatars/{user_id}.png", file_bytes, content_type)
 
 
-def upload_avatar_to_gcs(user_id: str, file_bytes: bytes, content_type: str) -> str:
+def upload_image_to_gcs(path: str, file_bytes: bytes, content_type: str, cache_control: str = None) -> str:
     client = get_gcs_client()
     bucket = client.bucket(GCP_BUCKET_NAME)
 
-    blob = bucket.blob(f"avatars/{user_id}.png")
+    blob = bucket.blob(path)
+    if cache_control:
+        # 上傳時一起寫入 metadata，不用再多一次 patch
+        blob.cache_control = cache_control
     blob.upload_from_string(file_bytes, content_type=content_type)
 
     # 設成公開
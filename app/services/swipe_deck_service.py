@@ -0,0 +1,168 @@
+# app/services/swipe_deck_service.py
+
+import json
+import time
+import numpy as np
+from app.services.redis_service import get_redis
+from app.services.swipe_index_service import SWIPED_KEY, load_swiped_map
+from app.services.match_utils_optimized import (
+    get_all_active_users,
+    load_all_user_vectors,
+    build_vector_matrices,
+    similarity_block,
+)
+
+DECK_KEY = "deck:{user_id}"
+DECK_TTL_SEC = 6 * 3600      # 批次每幾小時重跑一次，過期就回頭走即時計算
+
+
+def _build_exclusion_csr(user_ids, index, swiped):
+    """
+    把 swiped map 轉成 CSR（indptr / indices），之後每個 tile 可以一次套用 mask。
+    """
+    indptr = [0]
+    indices = []
+    for uid in user_ids:
+        cols = sorted(index[t] for t in swiped.get(uid, ()) if t in index)
+        indices.extend(cols)
+        indptr.append(len(indices))
+    return np.asarray(indptr, dtype=np.int64), np.asarray(indices, dtype=np.int64)
+
+
+# ======================================================
+# 主邏輯：分塊矩陣乘法，替所有使用者算 top-k deck
+# ======================================================
+def build_all_swipe_decks(top_k=100, row_tile=512, col_tile=4096):
+    """
+    1. 載入所有向量，轉成正規化矩陣
+    2. 以 row_tile × col_tile 的區塊做矩陣乘法（記憶體上限約 row_tile * col_tile 個 float32）
+    3. 排除自己與已滑過的人，逐塊合併 running top-k
+    4. 每個 row tile 算完就用 pipeline 寫進 Redis：deck:{user_id}
+
+    :return: (參與計算的使用者數, 寫入的 deck 數)
+    """
+    users = get_all_active_users()
+    vectors = load_all_user_vectors()
+
+    # 跟 compute_similarity_candidates 一樣：沒有向量的人不能當 target 也不能當 candidate
+    user_ids = [u for u in users if u in vectors]
+    n = len(user_ids)
+    if n == 0:
+        return 0, 0
+
+    index = {uid: i for i, uid in enumerate(user_ids)}
+    mats = build_vector_matrices(user_ids, vectors)
+    indptr, indices = _build_exclusion_csr(user_ids, index, load_swiped_map())
+
+    k = max(min(top_k, n - 1), 1)
+    r = get_redis()
+    built_at = int(time.time())
+    written = 0
+
+    for r0 in range(0, n, row_tile):
+        r1 = min(r0 + row_tile, n)
+        rows = r1 - r0
+        row_mats = {key: m[r0:r1] for key, m in mats.items()}
+
+        best_scores = np.full((rows, k), -np.inf, dtype=np.float32)
+        best_idx = np.full((rows, k), -1, dtype=np.int64)
+
+        # 這個 row tile 要排除的 (row, col)
+        ex_rows = np.repeat(np.arange(rows), np.diff(indptr[r0:r1 + 1]))
+        ex_cols = indices[indptr[r0]:indptr[r1]]
+
+        for c0 in range(0, n, col_tile):
+            c1 = min(c0 + col_tile, n)
+            block = similarity_block(row_mats, {key: m[c0:c1] for key, m in mats.items()})
+
+            # 排除自己
+            self_rows = np.arange(max(r0, c0), min(r1, c1))
+            block[self_rows - r0, self_rows - c0] = -np.inf
+
+            # 排除已滑過的人
+            in_block = (ex_cols >= c0) & (ex_cols < c1)
+            block[ex_rows[in_block], ex_cols[in_block] - c0] = -np.inf
+
+            # 合併 running top-k
+            cand_scores = np.concatenate([best_scores, block], axis=1)
+            cand_idx = np.concatenate(
+                [best_idx, np.broadcast_to(np.arange(c0, c1), block.shape)], axis=1
+            )
+            top = np.argpartition(-cand_scores, k - 1, axis=1)[:, :k]
+            best_scores = np.take_along_axis(cand_scores, top, axis=1)
+            best_idx = np.take_along_axis(cand_idx, top, axis=1)
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_idx = np.take_along_axis(best_idx, order, axis=1)
+
+        pipe = r.pipeline(transaction=False)
+        for i in range(rows):
+            valid = np.isfinite(best_scores[i])
+            deck = {
+                "ids": [user_ids[j] for j in best_idx[i][valid]],
+                "scores": [int(s) for s in best_scores[i][valid]],
+                "built_at": built_at,
+            }
+            pipe.set(DECK_KEY.format(user_id=user_ids[r0 + i]), json.dumps(deck), ex=DECK_TTL_SEC)
+        pipe.execute()
+        written += rows
+
+    print(f"[Deck] Built {written} swipe decks (n={n}, top_k={k})")
+    return n, written
+
+
+# ======================================================
+# 讀取某個使用者預先算好的 deck（一次 GET）
+# ======================================================
+def get_swipe_deck(user_id: str):
+    """
+    同一個 round trip 內一起拿 deck 跟 swiped set，
+    把 deck 建好之後才滑過的人濾掉。
+    """
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.get(DECK_KEY.format(user_id=user_id))
+    pipe.smembers(SWIPED_KEY.format(user_id=user_id))
+    raw, swiped = pipe.execute()
+
+    if not raw:
+        return None
+
+    deck = json.loads(raw)
+    return {
+        "built_at": deck.get("built_at"),
+        "candidates": [
+            {"userId": uid, "score": score}
+            for uid, score in zip(deck.get("ids", []), deck.get("scores", []))
+            if uid not in swiped
+        ],
+    }
+
+
+# ======================================================
+# 增量更新：把某些人從 deck 拿掉（配對事件 consumer 用），保留原本的 TTL（SET KEEPTTL，Redis 6+）
+# ======================================================
+def remove_from_deck(user_id: str, other_ids) -> bool:
+    """
+    WATCH / MULTI：兩個配對事件同時改同一份 deck（或批次剛好重寫）時，
+    後 SET 的不會蓋掉先 SET 的結果；key 被改過 redis-py 會自動重跑。
+    """
+    key = DECK_KEY.format(user_id=user_id)
+
+    def update(pipe):
+        raw = pipe.get(key)
+        if not raw:
+            return False
+
+        deck = json.loads(raw)
+        kept = [(uid, score) for uid, score in zip(deck.get("ids", []), deck.get("scores", [])) if uid not in other_ids]
+        if len(kept) == len(deck.get("ids", [])):
+            return False
+
+        deck["ids"] = [uid for uid, _ in kept]
+        deck["scores"] = [score for _, score in kept]
+        pipe.multi()
+        pipe.set(key, json.dumps(deck), keepttl=True)
+        return True
+
+    return get_redis().transaction(update, key, value_from_callable=True)
@@ -0,0 +1,238 @@
+# app/services/swipe_index_service.py
+import threading
+import time
+
+from app.config import settings
+from app.config.settings import SWIPE_INDEX_EVICTION_SAFE
+from app.services.firestore_client import get_db
+from app.services.redis_service import get_redis
+
+# 每個使用者一個 Redis set，成員是「我已經滑過的 user_id」
+SWIPED_KEY = "swiped:{user_id}"
+
+# 每個使用者一個 Redis set，成員是「LIKE 過我的 user_id」（對方之後 PASS 會移除）
+# 只是「可能配對」的提示：多出來的成員只會讓 swipe 多走一次 transaction，不影響正確性
+LIKED_BY_KEY = "liked_by:{user_id}"
+# liked_by 能不能拿來判斷「一定沒配對」：
+# - liked_by:epoch 每次登記失敗就 +1（liked_by 可能少了一筆 LIKE）
+# - liked_by:ready 存的是 rebuild「開始時」的 epoch；跟目前的 epoch 一樣才算可信
+#   （rebuild 期間有登記失敗的話，rebuild 完也不會被當成可信）
+LIKED_BY_READY_KEY = "liked_by:ready"
+LIKED_BY_EPOCH_KEY = "liked_by:epoch"
+REBUILD_LOCK_KEY = "swipe_index:rebuild_lock"
+
+# 不可信時背景 rebuild；失敗後這麼久內不再重試
+REBUILD_RETRY_SEC = 60
+
+# liked_by set 沒有 TTL：這些 policy 不會淘汰它們。其他 policy 下任何一個 set 被淘汰都會讓配對永遠漏掉，
+# 所以不啟用預檢（見 SWIPE_INDEX_EVICTION_SAFE）
+SAFE_EVICTION_POLICIES = {"noeviction", "volatile-lru", "volatile-lfu", "volatile-random", "volatile-ttl"}
+EVICTION_CHECK_SEC = 300
+
+
+# ======================================================
+# 寫入：每次 swipe 成功後呼叫
+# ======================================================
+def record_swipe(from_user_id: str, target_user_id: str) -> None:
+    get_redis().sadd(SWIPED_KEY.format(user_id=from_user_id), target_user_id)
+
+
+def record_swipes(from_user_id: str, target_ids) -> None:
+    if target_ids:
+        get_redis().sadd(SWIPED_KEY.format(user_id=from_user_id), *target_ids)
+
+
+# ======================================================
+# Incoming likes：LIKE 之前先登記，再查對方有沒有 LIKE 過我
+# ======================================================
+def register_likes(from_user_id: str, target_ids):
+    """
+    一次 pipeline：先把我加進每個 target 的 liked_by，再查
+    - liked_back：哪些 target 在我的 liked_by 裡（可能配對 → 要走 transaction 確認）
+    - swiped_me：哪些 target 已經滑過我（決定要不要寫進對方的 liked-me）
+
+    兩邊同時互相 LIKE 時，Redis 是單執行緒，後登記的那一方一定看得到先登記的。
+    liked_by 不可信（還沒 rebuild 過 / 有登記失敗過 / Redis 可能淘汰它）就回傳 None（呼叫端全部走 transaction）。
+    這裡丟出例外的話，呼叫端必須 invalidate_liked_by()，否則這次 LIKE 會永遠不在 liked_by 裡。
+
+    :return: (liked_back set, swiped_me set) 或 None
+    """
+    target_ids = list(target_ids)
+    if not target_ids:
+        return set(), set()
+
+    pipe = get_redis().pipeline(transaction=False)
+    for target_id in target_ids:
+        pipe.sadd(LIKED_BY_KEY.format(user_id=target_id), from_user_id)
+    pipe.mget([LIKED_BY_READY_KEY, LIKED_BY_EPOCH_KEY])
+    pipe.smismember(LIKED_BY_KEY.format(user_id=from_user_id), target_ids)
+    for target_id in target_ids:
+        pipe.sismember(SWIPED_KEY.format(user_id=target_id), from_user_id)
+    results = pipe.execute()[len(target_ids):]
+
+    if not _is_ready(*results[0]):
+        schedule_rebuild()
+        return None
+    if not eviction_safe():
+        return None
+    liked_back = {t for t, hit in zip(target_ids, results[1]) if hit}
+    swiped_me = {t for t, hit in zip(target_ids, results[2:]) if hit}
+    return liked_back, swiped_me
+
+
+def _is_ready(ready, epoch) -> bool:
+    return ready is not None and ready == (epoch or "0")
+
+
+_eviction_checked_at = 0.0
+_eviction_ok = False
+
+
+def eviction_safe() -> bool:
+    """Redis 的 maxmemory-policy 會不會淘汰 liked_by（結果在 process 內快取 EVICTION_CHECK_SEC 秒）"""
+    global _eviction_checked_at, _eviction_ok
+    if SWIPE_INDEX_EVICTION_SAFE == "false":
+        return False
+    if SWIPE_INDEX_EVICTION_SAFE == "true" or settings.use_memory_backend():
+        return True
+
+    now = time.time()
+    if now - _eviction_checked_at < EVICTION_CHECK_SEC:
+        return _eviction_ok
+    try:
+        policy = get_redis().config_get("maxmemory-policy").get("maxmemory-policy")
+        _eviction_ok = policy in SAFE_EVICTION_POLICIES
+        if not _eviction_ok:
+            print(f"[SwipeIndex] maxmemory-policy={policy} may evict liked_by, incoming-like precheck disabled")
+    except Exception as e:
+        print(f"[SwipeIndex] Cannot read maxmemory-policy, incoming-like precheck disabled: {e}")
+        _eviction_ok = False
+    _eviction_checked_at = now
+    return _eviction_ok
+
+
+def invalidate_liked_by() -> None:
+    """
+    登記失敗（liked_by 可能少了這次的 LIKE）→ 之後所有 LIKE 都走 transaction，直到 rebuild 完。
+    連這個都失敗就往上丟：呼叫端要讓這次 swipe 失敗，不能在 liked_by 缺資料的情況下繼續。
+    """
+    get_redis().incr(LIKED_BY_EPOCH_KEY)
+    schedule_rebuild()
+
+
+def get_liked_back(user_id: str, target_ids) -> set:
+    """target_ids 裡面哪些人 LIKE 過 user_id"""
+    target_ids = list(target_ids)
+    if not target_ids:
+        return set()
+    flags = get_redis().smismember(LIKED_BY_KEY.format(user_id=user_id), target_ids)
+    return {t for t, hit in zip(target_ids, flags) if hit}
+
+
+def clear_likes(from_user_id: str, target_ids) -> None:
+    """PASS 之後把我從對方的 liked_by 拿掉"""
+    if not target_ids:
+        return
+    pipe = get_redis().pipeline(transaction=False)
+    for target_id in target_ids:
+        pipe.srem(LIKED_BY_KEY.format(user_id=target_id), from_user_id)
+    pipe.execute()
+
+
+# ======================================================
+# 讀取：某個使用者滑過的所有人（一次 SMEMBERS）
+# ======================================================
+def get_swiped_ids(user_id: str) -> set:
+    return set(get_redis().smembers(SWIPED_KEY.format(user_id=user_id)))
+
+
+# ======================================================
+# Firestore：一次撈出所有滑動紀錄 { from_user_id: {to_user_id, ...} }
+# ======================================================
+def load_swiped_map():
+    return _load_swipe_maps()[0]
+
+
+def _load_swipe_maps():
+    """:return: (swiped { from: {to} }, liked_by { to: {from（LIKE）} })"""
+    db = get_db()
+    docs = db.collection("swipes").select(["from_user_id", "to_user_id", "action"]).stream()
+
+    swiped, liked_by = {}, {}
+    for doc in docs:
+        data = doc.to_dict()
+        from_id = data.get("from_user_id")
+        to_id = data.get("to_user_id")
+        if from_id and to_id:
+            swiped.setdefault(from_id, set()).add(to_id)
+            if data.get("action") == "LIKE":
+                liked_by.setdefault(to_id, set()).add(from_id)
+    return swiped, liked_by
+
+
+# ======================================================
+# 從 Firestore swipes 重建整個 index（第一次上線 / Redis 資料遺失時用）
+# ======================================================
+def rebuild_swipe_index() -> int:
+    r = get_redis()
+    # 讀 Firestore 之前的 epoch：rebuild 期間有登記失敗的話，ready 會跟新的 epoch 對不上
+    epoch = r.get(LIKED_BY_EPOCH_KEY) or "0"
+    swiped, liked_by = _load_swipe_maps()
+
+    pipe = r.pipeline(transaction=False)
+    for from_id, targets in swiped.items():
+        key = SWIPED_KEY.format(user_id=from_id)
+        pipe.delete(key)
+        pipe.sadd(key, *targets)
+    # 用 SADD 合併（不先 DELETE）：rebuild 期間剛發生的 LIKE 不會被洗掉
+    for to_id, likers in liked_by.items():
+        pipe.sadd(LIKED_BY_KEY.format(user_id=to_id), *likers)
+    pipe.set(LIKED_BY_READY_KEY, epoch)
+    pipe.execute()
+
+    print(f"[SwipeIndex] Rebuilt swiped sets for {len(swiped)} users, liked_by sets for {len(liked_by)} users")
+    return len(swiped)
+
+
+def ensure_swipe_index() -> bool:
+    """
+    liked_by 不可信（第一次上線 / Redis 被清空 / 有登記失敗過）才 rebuild。
+    多個 instance 靠 lock 只跑一份；沒拿到 lock 的直接略過。
+    :return: 這次有沒有 rebuild
+    """
+    r = get_redis()
+    if _is_ready(*r.mget([LIKED_BY_READY_KEY, LIKED_BY_EPOCH_KEY])):
+        return False
+    if not r.set(REBUILD_LOCK_KEY, "1", ex=600, nx=True):
+        return False
+    try:
+        rebuild_swipe_index()
+        return True
+    finally:
+        r.delete(REBUILD_LOCK_KEY)
+
+
+_rebuild_lock = threading.Lock()
+_rebuild_running = False
+_rebuild_failed_at = 0.0
+
+
+def schedule_rebuild() -> None:
+    """在背景跑 ensure_swipe_index（同一個 process 同時只跑一個，失敗後 REBUILD_RETRY_SEC 內不重試）"""
+    global _rebuild_running
+    with _rebuild_lock:
+        if _rebuild_running or time.time() - _rebuild_failed_at < REBUILD_RETRY_SEC:
+            return
+        _rebuild_running = True
+    threading.Thread(target=_run_rebuild, name="swipe-index-rebuild", daemon=True).start()
+
+
+def _run_rebuild():
+    global _rebuild_running, _rebuild_failed_at
+    try:
+        ensure_swipe_index()
+    except Exception as e:
+        _rebuild_failed_at = time.time()
+        print(f"[SwipeIndex] Rebuild failed: {e}")
+    finally:
+        _rebuild_running = False
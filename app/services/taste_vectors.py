@@ -0,0 +1,129 @@
+# app/services/taste_vectors.py
+"""
+user_preference_vectors 的 process 內快取（已 L2 正規化的矩陣），給 nearby 排序用。
+
+- 從 BigQuery 整表載入一律在背景（warmup 或第一次用到時開 thread），request 不會等 BigQuery：
+  還沒載好就不排序，過期重載期間照樣用舊的矩陣，載入失敗 TASTE_VECTOR_RETRY_SEC 內不重試
+- rank_nearby_by_taste()：自己那一列對 nearby 的人做一次小矩陣乘法（1 × N），
+  每組依相似度重新排序
+"""
+import threading
+import time
+
+import numpy as np
+
+from app.config.settings import TASTE_VECTOR_RETRY_SEC, TASTE_VECTOR_TTL_SEC
+from app.services.match_utils_optimized import build_vector_matrices, load_all_user_vectors, similarity_block
+
+NEARBY_GROUPS = ("same_track", "same_artist", "just_near")
+
+_snapshot = None    # (loaded_at, { user_id: row }, { key: matrix })
+_failed_at = 0.0    # 上次載入失敗的時間（TASTE_VECTOR_RETRY_SEC 內不再重試）
+_lock = threading.Lock()
+_refreshing = False
+
+
+def _load():
+    vectors = load_all_user_vectors()
+    user_ids = list(vectors)
+    mats = build_vector_matrices(user_ids, vectors)
+    print(f"[TasteVectors] Loaded {len(user_ids)} preference vectors")
+    return time.time(), {uid: i for i, uid in enumerate(user_ids)}, mats
+
+
+def _claim_refresh():
+    """同時只會有一個載入；拿到的人負責把 _refreshing 還原（見 _refresh）"""
+    global _refreshing
+    with _lock:
+        if _refreshing:
+            return False
+        _refreshing = True
+        return True
+
+
+def _refresh():
+    global _snapshot, _failed_at, _refreshing
+    try:
+        _snapshot = _load()
+        _failed_at = 0.0
+    except Exception as e:
+        _failed_at = time.time()
+        print(f"[TasteVectors] Load failed, retry in {TASTE_VECTOR_RETRY_SEC}s: {e}")
+    finally:
+        _refreshing = False
+
+
+def load_taste_matrix():
+    """同步載入一次（warmup 用，本來就在背景 thread）；已經有人在載就不重複"""
+    if _claim_refresh():
+        _refresh()
+    return _snapshot
+
+
+def get_taste_matrix():
+    """
+    回傳 (loaded_at, index, mats)；還沒載好回傳 None。
+    不會在 request 裡等 BigQuery：第一次載入和過期重載都在背景 thread，
+    失敗後 TASTE_VECTOR_RETRY_SEC 內不重試。
+    """
+    snapshot = _snapshot
+    now = time.time()
+    due = snapshot is None or now - snapshot[0] > TASTE_VECTOR_TTL_SEC
+    if due and now - _failed_at >= TASTE_VECTOR_RETRY_SEC and _claim_refresh():
+        threading.Thread(target=_refresh, name="taste-vectors-refresh", daemon=True).start()
+    return snapshot
+
+
+def taste_scores(user_id, other_ids):
+    """
+    user_id 對 other_ids 的相似度（0~100，同 similarity_score）；
+    任一方沒有向量的位置是 NaN；矩陣還沒載好回傳 None。
+    """
+    snapshot = get_taste_matrix()
+    if snapshot is None:
+        return None
+
+    _, index, mats = snapshot
+    scores = np.full(len(other_ids), np.nan)
+
+    me = index.get(user_id)
+    if me is None or not other_ids:
+        return scores
+
+    pos = [i for i, uid in enumerate(other_ids) if uid in index]
+    if not pos:
+        return scores
+
+    rows = np.array([index[other_ids[i]] for i in pos])
+    block = similarity_block(
+        {key: m[me:me + 1] for key, m in mats.items()},
+        {key: m[rows] for key, m in mats.items()},
+    )
+    scores[pos] = block[0]
+    return scores
+
+
+def rank_nearby_by_taste(user_id, groups):
+    """
+    每組依口味相似度由高到低排序（沒有向量的排最後，其餘保持原順序），
+    每筆加上 taste_score。矩陣還沒載好 / 載不到時原樣回傳。
+    """
+    uids = [hb["user_id"] for name in NEARBY_GROUPS for hb in groups.get(name, [])]
+    if not uids:
+        return groups
+
+    try:
+        scores = taste_scores(user_id, uids)
+    except Exception as e:
+        print(f"[TasteVectors] Ranking skipped: {e}")
+        return groups
+    if scores is None:
+        return groups
+
+    by_user = dict(zip(uids, scores))
+    for name in NEARBY_GROUPS:
+        for hb in groups.get(name, []):
+            score = by_user.get(hb["user_id"])
+            hb["taste_score"] = None if score is None or np.isnan(score) else round(float(score), 1)
+        groups.get(name, []).sort(key=lambda hb: (hb["taste_score"] is None, -(hb["taste_score"] or 0)))
+    return groups
@@ -0,0 +1,305 @@
+# app/services/tracing.py
+"""
+輕量 tracing / metrics：
+
+- span(dependency, operation)：計時一段外部呼叫（Firestore / BigQuery / Redis /
+  Spotify / Pub/Sub），同時記到 process 內的 latency histogram，以及目前這個
+  request 的 span 清單。
+- traced_client()：把 client 包一層 proxy，每個方法呼叫自動變成一個 span。
+- tracing_middleware：每個 HTTP request 一筆 http histogram，並依取樣率 / 慢請求
+  輸出一行 JSON log（取代原本每個 request 都 print 的 debug dump）。
+- render_prometheus()：/metrics 用的 Prometheus text format。
+"""
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# 秒；涵蓋 Redis 的亞毫秒到 BigQuery 的數秒
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 一般 request 的取樣率；超過 TRACE_SLOW_MS 的 request 一律記錄
+TRACE_LOG_SAMPLE_RATE = float(os.getenv("TRACE_LOG_SAMPLE_RATE", "0.01"))
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))
+
+_request_spans: ContextVar = ContextVar("request_spans", default=None)
+
+
+# ======================================================
+# Histogram（label → bucket counts / sum / count）
+# ======================================================
+class _Histogram:
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, seconds):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[0][i] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted(self._series.items())
+            items = [(labels, (list(b), s, c)) for labels, (b, s, c) in items]
+
+        for labels, (bucket_counts, total, count) in items:
+            base = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.label_names, labels))
+            for bound, n in zip(self.buckets, bucket_counts):
+                lines.append(f'{self.name}_bucket{{{base},le="{bound}"}} {n}')
+            lines.append(f'{self.name}_bucket{{{base},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{base}}} {total:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {count}")
+        return lines
+
+
+class _Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            base = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.label_names, labels))
+            lines.append(f"{self.name}{{{base}}} {value}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+DEPENDENCY_LATENCY = _Histogram(
+    "dependency_latency_seconds", "Latency of calls to external dependencies",
+    ("dependency", "operation"),
+)
+DEPENDENCY_ERRORS = _Counter(
+    "dependency_errors_total", "Failed calls to external dependencies",
+    ("dependency", "operation"),
+)
+HTTP_LATENCY = _Histogram(
+    "http_request_duration_seconds", "HTTP request latency",
+    ("method", "route", "status"),
+)
+
+
+# ======================================================
+# Span
+# ======================================================
+@contextmanager
+def span(dependency: str, operation: str):
+    t0 = time.perf_counter()
+    error = False
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        _finish_span(dependency, operation, time.perf_counter() - t0, error)
+
+
+def _finish_span(dependency, operation, elapsed, error):
+    DEPENDENCY_LATENCY.observe((dependency, operation), elapsed)
+    if error:
+        DEPENDENCY_ERRORS.inc((dependency, operation))
+
+    spans = _request_spans.get()
+    if spans is not None:
+        spans.append((dependency, operation, elapsed, error))
+
+
+class _TracedIterator:
+    """串流結果（Firestore run_query 等）：計時到整個 iterator 讀完為止"""
+
+    def __init__(self, iterator, dependency, operation, started):
+        self._iterator = iterator
+        self._dependency = dependency
+        self._operation = operation
+        self._started = started
+        self._done = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            self._finish(False)
+            raise
+        except Exception:
+            self._finish(True)
+            raise
+
+    def _finish(self, error):
+        if not self._done:
+            self._done = True
+            _finish_span(self._dependency, self._operation, time.perf_counter() - self._started, error)
+
+    def __getattr__(self, name):
+        return getattr(self._iterator, name)
+
+
+class TracedProxy:
+    """
+    包住任意 client：public 方法呼叫都會變成一個 span。
+    nested = {method: methods}：該方法的回傳物件（pipeline / query job / future）
+    也包一層，繼續追蹤它的方法。
+    """
+
+    def __init__(self, target, dependency, methods=None, nested=None, stream_methods=()):
+        self._target = target
+        self._dependency = dependency
+        self._methods = methods
+        self._nested = nested or {}
+        self._stream_methods = stream_methods
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+        if self._methods is not None and name not in self._methods and name not in self._nested:
+            return attr
+
+        dependency = self._dependency
+
+        def call(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception:
+                _finish_span(dependency, name, time.perf_counter() - t0, True)
+                raise
+
+            if name in self._stream_methods:
+                return _TracedIterator(iter(result), dependency, name, t0)
+
+            _finish_span(dependency, name, time.perf_counter() - t0, False)
+            if name in self._nested:
+                return TracedProxy(result, dependency, methods=self._nested[name])
+            return result
+
+        return call
+
+    def __enter__(self):
+        self._target.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._target.__exit__(*exc)
+
+
+def traced_client(client, dependency, methods=None, nested=None, stream_methods=()):
+    if client is None or isinstance(client, TracedProxy):
+        return client
+    return TracedProxy(client, dependency, methods, nested, stream_methods)
+
+
+# ======================================================
+# Firestore：Firestore 的 ref / query 物件會被 SDK 內部做 isinstance 檢查，
+# 不能整個 client 包 proxy，改包底層的 GAPIC API（所有 RPC 都從這裡出去）
+# ======================================================
+_FIRESTORE_STREAM_RPCS = ("batch_get_documents", "run_query", "run_aggregation_query")
+
+
+def instrument_firestore(client):
+    try:
+        api = client._firestore_api
+        if not isinstance(api, TracedProxy):
+            client._firestore_api_internal = TracedProxy(api, "firestore", stream_methods=_FIRESTORE_STREAM_RPCS)
+    except AttributeError:
+        # in-memory backend 沒有 GAPIC 層
+        pass
+    return client
+
+
+# ======================================================
+# Structured log（取樣）
+# ======================================================
+def log_event(event: str, sample_rate: float = None, force: bool = False, **fields):
+    rate = TRACE_LOG_SAMPLE_RATE if sample_rate is None else sample_rate
+    if not force and random.random() >= rate:
+        return
+    print(json.dumps({"event": event, "ts": round(time.time(), 3), **fields}, default=str))
+
+
+# ======================================================
+# HTTP middleware
+# ======================================================
+async def tracing_middleware(request, call_next):
+    spans = []
+    token = _request_spans.set(spans)
+    t0 = time.perf_counter()
+    status = 500
+
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - t0
+        _request_spans.reset(token)
+
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", None) or "unmatched"
+        HTTP_LATENCY.observe((request.method, route_path, str(status)), elapsed)
+
+        duration_ms = elapsed * 1000
+        if request.url.path != "/metrics":
+            log_event(
+                "http_request",
+                force=duration_ms >= TRACE_SLOW_MS or status >= 500,
+                method=request.method,
+                route=route_path,
+                status=status,
+                duration_ms=round(duration_ms, 2),
+                spans=_summarize(spans),
+            )
+
+
+def _summarize(spans):
+    """依 dependency 彙總：次數、總耗時、錯誤數"""
+    summary = {}
+    for dependency, _, elapsed, error in spans:
+        entry = summary.setdefault(dependency, {"calls": 0, "ms": 0.0, "errors": 0})
+        entry["calls"] += 1
+        entry["ms"] += elapsed * 1000
+        entry["errors"] += int(error)
+    for entry in summary.values():
+        entry["ms"] = round(entry["ms"], 2)
+    return summary
+
+
+# ======================================================
+# Prometheus text format
+# ======================================================
+def render_prometheus() -> str:
+    lines = []
+    for metric in (HTTP_LATENCY, DEPENDENCY_LATENCY, DEPENDENCY_ERRORS):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
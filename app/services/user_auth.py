@@ -7,6 +7,20 @@ from app.services.firestore_client import get_db
 
 JWT_ALGORITHM = "HS256"
 
+def decode_user_token(token: str) -> str:
+    """JWT → user_id（WebSocket 之類拿不到 Header dependency 的地方也用這個）"""
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        user_id = payload.get("user_id")
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Invalid token payload")
+
+    return user_id
+
+
 def get_current_user(authorization: str = Header(None, alias="Authorization")):
     """
     從 Authorization: Bearer <JWT token> 解析 user_id
@@ -19,16 +33,7 @@ def get_current_user(authorization: str = Header(None, alias="Authorization")):
     if not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Invalid token format")
 
-    token = authorization.split(" ")[1]
-
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user_id = payload.get("user_id")
-    except Exception:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
-
-    if not user_id:
-        raise HTTPException(status_code=401, detail="Invalid token payload")
+    user_id = decode_user_token(authorization.split(" ")[1])
 
     db = get_db()
     doc = db.collection("users").document(user_id).get()
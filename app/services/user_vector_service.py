@@ -1,6 +1,5 @@
 # app/services/user_vector_service.py
 
-from google.cloud import bigquery
 from app.services.bigquery_client import get_bq_client
 import numpy as np
 from datetime import datetime, timezone
@@ -60,19 +59,19 @@ def compute_user_vector(user_id):
     # 1. 讀取 user 的資料
     tracks = client.query(f"""
         SELECT track_id, period
-        FROM `spotify-match-project.user_event.user_top_tracks`
+        FROM `spotify-match-project.user_event.user_top_tracks_latest`
         WHERE user_id = '{user_id}'
     """).to_dataframe()
 
     artists = client.query(f"""
         SELECT artist_id, period
-        FROM `spotify-match-project.user_event.user_top_artists`
+        FROM `spotify-match-project.user_event.user_top_artists_latest`
         WHERE user_id = '{user_id}'
     """).to_dataframe()
 
     favorites = client.query(f"""
         SELECT track_id
-        FROM `spotify-match-project.user_event.user_favorite_tracks`
+        FROM `spotify-match-project.user_event.user_favorite_tracks_latest`
         WHERE user_id = '{user_id}'
     """).to_dataframe()
 
@@ -2,7 +2,6 @@
 import json
 import pandas as pd
 from google.cloud import bigquery
-import google.generativeai as genai
 
 from app.services.bigquery_client import get_bq_client, insert_rows_json
 from app.config.settings import BQ_PROJECT, BQ_DATASET, GEMINI_API_KEY
@@ -12,16 +11,23 @@ from datetime import datetime, timezone
 def _now():
     return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
 # =====================================
-# 初始化
+# 初始化（lazy：import 這個模組不會碰 Gemini / BigQuery）
 # =====================================
+_llm = None
 
-if not GEMINI_API_KEY:
-    raise Exception("Missing GEMINI_API_KEY in environment variables")
 
-genai.configure(api_key=GEMINI_API_KEY)
-llm = genai.GenerativeModel("gemini-2.0-flash")
+def _get_llm():
+    global _llm
 
-bq = get_bq_client()
+    if _llm is None:
+        if not GEMINI_API_KEY:
+            raise Exception("Missing GEMINI_API_KEY in environment variables")
+
+        import google.generativeai as genai
+        genai.configure(api_key=GEMINI_API_KEY)
+        _llm = genai.GenerativeModel("gemini-2.0-flash")
+
+    return _llm
 
 
 # =====================================
@@ -31,13 +37,13 @@ def fetch_new_tracks(batch_size=50):
     sql = f"""
     WITH union_tracks AS (
         SELECT track_id, track_name, artist_id, artist_name, popularity
-        FROM `{BQ_PROJECT}.{BQ_DATASET}.user_favorite_tracks`
+        FROM `{BQ_PROJECT}.{BQ_DATASET}.user_favorite_tracks_latest`
         WHERE track_id IS NOT NULL
 
         UNION DISTINCT
 
         SELECT track_id, track_name, artist_id, artist_name, popularity
-        FROM `{BQ_PROJECT}.{BQ_DATASET}.user_top_tracks`
+        FROM `{BQ_PROJECT}.{BQ_DATASET}.user_top_tracks_latest`
         WHERE track_id IS NOT NULL
     )
     SELECT u.*
@@ -52,7 +58,7 @@ def fetch_new_tracks(batch_size=50):
         query_parameters=[bigquery.ScalarQueryParameter("limit", "INT64", batch_size)]
     )
 
-    return bq.query(sql, job_config=job_config).to_dataframe()
+    return get_bq_client().query(sql, job_config=job_config).to_dataframe()
 
 
 # =====================================
@@ -62,13 +68,13 @@ def fetch_new_artists(batch_size=50):
     sql = f"""
     WITH union_artists AS (
         SELECT artist_id, artist_name, popularity
-        FROM `{BQ_PROJECT}.{BQ_DATASET}.user_top_artists`
+        FROM `{BQ_PROJECT}.{BQ_DATASET}.user_top_artists_latest`
         WHERE artist_id IS NOT NULL
 
         UNION DISTINCT
 
         SELECT artist_id, artist_name, popularity
-        FROM `{BQ_PROJECT}.{BQ_DATASET}.user_favorite_tracks`
+        FROM `{BQ_PROJECT}.{BQ_DATASET}.user_favorite_tracks_latest`
         WHERE artist_id IS NOT NULL
     )
     SELECT u.*
@@ -83,7 +89,7 @@ def fetch_new_artists(batch_size=50):
         query_parameters=[bigquery.ScalarQueryParameter("limit", "INT64", batch_size)]
     )
 
-    return bq.query(sql, job_config=job_config).to_dataframe()
+    return get_bq_client().query(sql, job_config=job_config).to_dataframe()
 
 
 # =====================================
@@ -323,7 +329,7 @@ def ask_llm(prompt: str):
     呼叫 Gemini，強制要求回傳純 JSON。
     如果回傳不是合法 JSON，印出原始內容方便 debug。
     """
-    response = llm.generate_content(
+    response = _get_llm().generate_content(
         prompt,
         generation_config={
             "response_mime_type": "application/json"
@@ -0,0 +1,59 @@
+# app/services/warmup.py
+import importlib
+import threading
+import time
+
+from app.services.bigquery_client import get_bq_client
+from app.services.firestore_client import get_db
+from app.services.heartbeat_pubsub import get_publisher
+from app.services.redis_service import get_redis
+from app.services.taste_vectors import load_taste_matrix
+
+
+def _ensure_latest_tables():
+    from app.services.spotify_snapshots import ensure_latest_tables
+    ensure_latest_tables()
+
+
+def _ensure_swipe_index():
+    from app.services.swipe_index_service import ensure_swipe_index
+    ensure_swipe_index()
+
+
+def _import_vertex_sdk():
+    importlib.import_module("vertexai.preview.vision_models")
+
+
+# 依序執行；每一步失敗都只記 log，不影響其他步驟
+WARMUP_STEPS = [
+    ("firestore", get_db),
+    ("redis", lambda: get_redis().ping()),
+    ("bigquery", get_bq_client),
+    ("pubsub", get_publisher),
+    ("vertexai", _import_vertex_sdk),
+    ("taste_vectors", load_taste_matrix),
+]
+
+
+# 資料前置條件（不是單純暖機）：讀取端依賴它們，預設每次啟動都跑；都是 idempotent
+STARTUP_SETUP_STEPS = [
+    ("bigquery_latest_tables", _ensure_latest_tables), # matching / vector 讀 *_latest 表
+    ("swipe_index", _ensure_swipe_index),              # swipe 的 incoming-like 預檢、候選過濾
+]
+
+
+def run_warmup(steps=None):
+    for name, step in steps or WARMUP_STEPS:
+        t0 = time.perf_counter()
+        try:
+            step()
+            print(f"[Warmup] {name} ready in {(time.perf_counter() - t0) * 1000:.0f} ms")
+        except Exception as e:
+            print(f"[Warmup] {name} failed: {e}")
+
+
+def start_background_warmup(steps=None):
+    """在 daemon thread 裡跑，不擋住 server 開始接 request"""
+    thread = threading.Thread(target=run_warmup, args=(steps,), name="warmup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,222 @@
+# benchmarks/datagen.py
+"""
+Synthetic data generators：N 個使用者的偏好向量、top tracks / artists、
+曲目 / 歌手特徵表，以及散布在城市裡的 M 筆 heartbeat。
+"""
+import math
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from app.services.user_vector_service import GENRE_LIST, LANG_LIST
+
+CITY_CENTER = (25.0330, 121.5654)    # 台北 101
+PERIODS = ["short_term", "medium_term", "long_term"]
+
+
+def _sparse_weights(rng, dim, k):
+    """只有少數幾個維度有值的非負向量（曲風 / 語言分布通常長這樣）"""
+    vec = np.zeros(dim)
+    idx = rng.choice(dim, size=min(k, dim), replace=False)
+    vec[idx] = rng.random(len(idx))
+    return vec / vec.sum()
+
+
+# ======================================================
+# 曲目 / 歌手目錄
+# ======================================================
+def make_catalog(rng, n_tracks, n_artists):
+    artists = []
+    for i in range(n_artists):
+        artists.append({
+            "artist_id": f"artist_{i}",
+            "artist_name": f"Artist {i}",
+            "popularity": int(rng.integers(0, 100)),
+            "genres": [str(g) for g in rng.choice(GENRE_LIST, size=2, replace=False)],
+            "languages": [str(l) for l in rng.choice(LANG_LIST, size=1)],
+            "style_vector": rng.random(8).round(3).tolist(),
+        })
+
+    tracks = []
+    for i in range(n_tracks):
+        artist = artists[int(rng.integers(0, n_artists))]
+        tracks.append({
+            "track_id": f"track_{i}",
+            "track_name": f"Track {i}",
+            "artist_id": artist["artist_id"],
+            "artist_name": artist["artist_name"],
+            "popularity": int(rng.integers(0, 100)),
+            "album_image": f"https://img.example.com/{i}.jpg",
+            "genres": artist["genres"],
+            "languages": artist["languages"],
+            "style_vector": rng.random(8).round(3).tolist(),
+        })
+
+    return tracks, artists
+
+
+def _zipf_pick(rng, n, size):
+    """熱門歌被很多人聽：用 Zipf 分布挑 index"""
+    picks = rng.zipf(1.3, size=size * 3) - 1
+    picks = picks[picks < n]
+    if len(picks) < size:
+        picks = np.concatenate([picks, rng.integers(0, n, size)])
+    return list(dict.fromkeys(picks.tolist()))[:size]
+
+
+# ======================================================
+# 使用者
+# ======================================================
+def make_users(rng, n_users, tracks, artists):
+    now = datetime.now(timezone.utc)
+    user_ids = [f"user_{i}" for i in range(n_users)]
+
+    users = {}
+    preference_vectors = []
+    top_tracks = []
+    top_artists = []
+    favorites = []
+
+    for uid in user_ids:
+        users[uid] = {
+            "email": f"{uid}@example.com",
+            "password_hash": "x" * 64,
+            "display_name": uid.replace("_", " ").title(),
+            "avatarUrl": f"https://img.example.com/avatars/{uid}.png",
+            "created_at": now,
+        }
+
+        preference_vectors.append({
+            "user_id": uid,
+            "style_vector": rng.random(8).round(4).tolist(),
+            "genre_vector": _sparse_weights(rng, len(GENRE_LIST), 4).round(4).tolist(),
+            "language_vector": _sparse_weights(rng, len(LANG_LIST), 2).round(4).tolist(),
+            "total_interactions": int(rng.integers(10, 200)),
+            "last_update": now.isoformat(),
+        })
+
+        for period in PERIODS:
+            for rank, ti in enumerate(_zipf_pick(rng, len(tracks), 10), start=1):
+                t = tracks[ti]
+                top_tracks.append({
+                    "user_id": uid, "track_id": t["track_id"], "track_name": t["track_name"],
+                    "artist_id": t["artist_id"], "artist_name": t["artist_name"],
+                    "popularity": t["popularity"], "period": period, "rank": rank,
+                    "album_image": t["album_image"], "artist_image": None,
+                    "created_at": now.isoformat(),
+                })
+            for rank, ai in enumerate(_zipf_pick(rng, len(artists), 10), start=1):
+                a = artists[ai]
+                top_artists.append({
+                    "user_id": uid, "artist_id": a["artist_id"], "artist_name": a["artist_name"],
+                    "popularity": a["popularity"], "period": period, "rank": rank,
+                    "artist_image": None, "created_at": now.isoformat(),
+                })
+
+        for ti in _zipf_pick(rng, len(tracks), 20):
+            t = tracks[ti]
+            favorites.append({
+                "user_id": uid, "track_id": t["track_id"], "track_name": t["track_name"],
+                "artist_id": t["artist_id"], "artist_name": t["artist_name"],
+                "album_image": t["album_image"], "added_at": now.isoformat(),
+                "popularity": t["popularity"], "created_at": now.isoformat(),
+            })
+
+    return {
+        "user_ids": user_ids,
+        "users": users,
+        "user_preference_vectors": preference_vectors,
+        "user_top_tracks": top_tracks,
+        "user_top_artists": top_artists,
+        "user_favorite_tracks": favorites,
+    }
+
+
+# ======================================================
+# Heartbeats：以城市中心為圓心，半徑 radius_m 內均勻散布
+# ======================================================
+def make_heartbeats(rng, user_ids, tracks, m, center=CITY_CENTER, radius_m=2000, max_age_sec=120):
+    now = int(time.time())
+    lat0, lng0 = center
+    heartbeats = []
+
+    for i in range(m):
+        uid = user_ids[i] if i < len(user_ids) else f"listener_{i}"
+        r = radius_m * math.sqrt(rng.random())
+        theta = 2 * math.pi * rng.random()
+        d_lat = (r * math.cos(theta)) / 111_320
+        d_lng = (r * math.sin(theta)) / (111_320 * math.cos(math.radians(lat0)))
+        t = tracks[_zipf_pick(rng, len(tracks), 1)[0]]
+
+        heartbeats.append({
+            "user_id": uid,
+            "track_id": t["track_id"],
+            "track_name": t["track_name"],
+            "artist_id": t["artist_id"],
+            "artist_name": t["artist_name"],
+            "album_image": t["album_image"],
+            "popularity": t["popularity"],
+            "timestamp": now - int(rng.integers(0, max_age_sec)),
+            "display_name": uid,
+            "avatarUrl": f"https://img.example.com/avatars/{uid}.png",
+            "lat": lat0 + d_lat,
+            "lng": lng0 + d_lng,
+        })
+
+    return heartbeats
+
+
+# ======================================================
+# 組合：一次產生一整份資料集
+# ======================================================
+def build_dataset(n_users, n_heartbeats=None, seed=42):
+    rng = np.random.default_rng(seed)
+    n_tracks = max(200, n_users * 5)
+    n_artists = max(50, n_users)
+
+    tracks, artists = make_catalog(rng, n_tracks, n_artists)
+    data = make_users(rng, n_users, tracks, artists)
+    data["tracks"] = tracks
+    data["artists"] = artists
+    data["track_features"] = [
+        {k: t[k] for k in ("track_id", "track_name", "artist_id", "artist_name",
+                           "popularity", "genres", "languages", "style_vector")}
+        for t in tracks
+    ]
+    data["artist_features"] = [
+        {k: a[k] for k in ("artist_id", "artist_name", "popularity",
+                           "genres", "languages", "style_vector")}
+        for a in artists
+    ]
+    data["heartbeats"] = make_heartbeats(rng, data["user_ids"], tracks, n_heartbeats or n_users)
+    data["rng"] = rng
+    return data
+
+
+def load_dataset(data, db, bq):
+    """把資料集灌進 in-memory Firestore / BigQuery"""
+    for name in ("user_preference_vectors", "user_top_tracks", "user_top_artists",
+                 "user_favorite_tracks", "track_features", "artist_features"):
+        bq.load_table(name, data[name])
+
+    batch = db.batch()
+    for uid, doc in data["users"].items():
+        batch.set(db.collection("users").document(uid), doc)
+    batch.commit()
+
+
+def make_swipes(rng, user_ids, per_user, like_ratio=0.6, hot_users=5):
+    """
+    每個人滑 per_user 張卡；前 hot_users 個人特別熱門（大家都會滑到），
+    讓 liked-me 清單有一定長度。
+    """
+    hot = user_ids[:hot_users]
+    swipes = []
+    for uid in user_ids:
+        targets = set(hot) | set(rng.choice(user_ids, size=min(per_user, len(user_ids)), replace=False).tolist())
+        targets.discard(uid)
+        for t in targets:
+            action = "LIKE" if rng.random() < like_ratio else "PASS"
+            swipes.append((uid, t, action))
+    return swipes
@@ -0,0 +1,190 @@
+# benchmarks/run_benchmarks.py
+"""
+Hot path benchmarks（強制 STORAGE_BACKEND=memory，不需要 GCP / Redis）
+
+    python -m benchmarks.run_benchmarks --sizes 200 1000 5000 --out bench_results.json
+
+每個 size 會產生一份新的資料集（N users、N * heartbeats_per_user 筆 heartbeat），
+對每個 hot path 跑 --repeat 次，輸出 min / median / max（毫秒）到 JSON，方便比對 regression。
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import time
+
+import numpy as np
+
+from app.config import settings
+from app.services import memory_backend
+from benchmarks.datagen import CITY_CENTER, build_dataset, load_dataset, make_swipes
+
+import app.services.match_service as match_service
+import app.services.match_utils_optimized as match_utils_optimized
+import app.services.redis_service as redis_service
+import app.services.swipe_deck_service as swipe_deck_service
+import app.services.swipe_index_service as swipe_index_service
+import app.services.user_vector_service as user_vector_service
+
+
+def _timed(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples, result
+
+
+def _record(results, name, size, samples, **extra):
+    row = {
+        "benchmark": name,
+        "size": size,
+        "repeat": len(samples),
+        "min_ms": round(min(samples), 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "max_ms": round(max(samples), 3),
+        **extra,
+    }
+    results.append(row)
+    print(f"  {name:<36} n={size:<7} median={row['median_ms']:>10.3f} ms  min={row['min_ms']:>10.3f} ms")
+
+
+# ======================================================
+# 各個 hot path
+# ======================================================
+def bench_similarity_candidates(results, size, repeat):
+    users = match_utils_optimized.get_all_active_users()
+    vectors = match_utils_optimized.load_all_user_vectors()
+    profiles = match_utils_optimized.load_all_user_profiles(users)
+    top_songs = match_utils_optimized.load_all_top_songs(users)
+    artists_map = match_utils_optimized.compute_shared_artists_map()
+    tracks_map = match_utils_optimized.compute_shared_tracks_map()
+    target = users[0]
+    excluded = swipe_index_service.get_swiped_ids(target)
+
+    samples, candidates = _timed(lambda: match_utils_optimized.compute_similarity_candidates(
+        user_id=target, users=users, vectors=vectors, profiles=profiles, top_songs=top_songs,
+        artists_map=artists_map, tracks_map=tracks_map, top_k=10, excluded_ids=excluded,
+    ), repeat)
+    _record(results, "compute_similarity_candidates", size, samples, returned=len(candidates))
+
+
+def bench_nearby(results, size, repeat, heartbeats):
+    service = redis_service.HeartbeatRedisService()
+    for hb in heartbeats:
+        service.set_heartbeat(hb["user_id"], hb)
+
+    me = heartbeats[0]
+    samples, groups = _timed(lambda: service.get_nearby_music_groups(
+        my_user_id=me["user_id"], my_track_id=me["track_id"], my_artist_id=me["artist_id"],
+        my_lat=CITY_CENTER[0], my_lng=CITY_CENTER[1],
+    ), repeat)
+    _record(results, "get_nearby_music_groups", size, samples,
+            heartbeats=len(heartbeats), returned=sum(len(v) for v in groups.values()))
+
+    samples, adaptive = _timed(lambda: service.get_nearby_adaptive(
+        my_user_id=me["user_id"], my_track_id=me["track_id"], my_artist_id=me["artist_id"],
+        my_lat=CITY_CENTER[0], my_lng=CITY_CENTER[1],
+    ), repeat)
+    _record(results, "get_nearby_adaptive", size, samples, heartbeats=len(heartbeats),
+            returned=sum(len(adaptive[k]) for k in ("same_track", "same_artist", "just_near")),
+            radius_m=adaptive["radius_m"])
+
+
+def bench_user_vector(results, size, repeat, user_ids, sample=10):
+    targets = user_ids[:sample]
+    samples, _ = _timed(lambda: [user_vector_service.compute_user_vector(u) for u in targets], repeat)
+    _record(results, "compute_user_vector", size, [s / len(targets) for s in samples])
+
+
+def bench_swipes(results, size, repeat, data, swipes_per_user):
+    swipes = make_swipes(data["rng"], data["user_ids"], swipes_per_user)
+    # 建好 liked_by（標記 ready），LIKE 才會走 precheck；沒有的話每個 LIKE 都開交易
+    swipe_index_service.rebuild_swipe_index()
+
+    t0 = time.perf_counter()
+    for from_id, to_id, action in swipes:
+        match_service.process_swipe_transaction(from_id, to_id, action)
+    per_swipe = (time.perf_counter() - t0) * 1000 / max(len(swipes), 1)
+    _record(results, "process_swipe_transaction", size, [per_swipe], swipes=len(swipes))
+
+    hot_user = data["user_ids"][0]
+    samples, (liked_me, _) = _timed(lambda: match_service.get_users_who_liked_me(hot_user), repeat)
+    _record(results, "get_users_who_liked_me", size, samples, returned=len(liked_me))
+
+    samples, (i_liked, _) = _timed(lambda: match_service.get_users_i_liked(hot_user), repeat)
+    _record(results, "get_users_i_liked", size, samples, returned=len(i_liked))
+
+    samples, (matches, _) = _timed(lambda: match_service.get_match_list(hot_user), repeat)
+    _record(results, "get_match_list", size, samples, returned=len(matches))
+
+
+def bench_swipe_decks(results, size, repeat):
+    samples, (_, written) = _timed(lambda: swipe_deck_service.build_all_swipe_decks(top_k=50), 1)
+    _record(results, "build_all_swipe_decks", size, samples, decks=written)
+
+
+# ======================================================
+# main
+# ======================================================
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+def run(sizes, repeat, heartbeats_per_user, swipes_per_user, seed):
+    results = []
+    settings.STORAGE_BACKEND = "memory"
+
+    for size in sizes:
+        print(f"[Bench] size={size}")
+        memory_backend.reset_memory_backends()
+
+        data = build_dataset(size, n_heartbeats=size * heartbeats_per_user, seed=seed)
+        load_dataset(data, memory_backend.get_memory_firestore(), memory_backend.get_memory_bigquery())
+
+        bench_swipes(results, size, repeat, data, swipes_per_user)
+        bench_similarity_candidates(results, size, repeat)
+        bench_nearby(results, size, repeat, data["heartbeats"])
+        bench_user_vector(results, size, repeat, data["user_ids"])
+        bench_swipe_decks(results, size, repeat)
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run hot path benchmarks against the in-memory backend")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[200, 1000, 5000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--heartbeats-per-user", type=int, default=2)
+    parser.add_argument("--swipes-per-user", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="bench_results.json")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.repeat, args.heartbeats_per_user, args.swipes_per_user, args.seed)
+
+    report = {
+        "meta": {
+            "timestamp": int(time.time()),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"[Bench] wrote {len(results)} results to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
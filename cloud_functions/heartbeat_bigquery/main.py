@@ -1,11 +1,58 @@
 import base64
 import json
+import math
 import os
+import struct
 from google.cloud import bigquery
 
-client = bigquery.Client()
 TABLE_ID = "spotify-match-project.user_event.listening_history"
 
+# 同一個 instance 的多次呼叫共用（HTTP 連線 / token 都留著）
+_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = bigquery.Client()
+    return _client
+
+# ------------------------------------------------------
+# Heartbeat binary record（格式同 app/services/heartbeat_codec.py，v1）：
+#   <BIffB  version, timestamp, lat(float32), lng(float32), popularity
+#   之後 user_id / track_id / artist_id 各一個長度 byte + UTF-8
+# 歌名等欄位在 message attributes；encoding != heartbeat-v1 的是舊的 JSON message
+# ------------------------------------------------------
+PUBSUB_ENCODING = "heartbeat-v1"
+_HEADER = struct.Struct("<BIffB")
+_ID_FIELDS = ("user_id", "track_id", "artist_id")
+
+
+def decode_heartbeat_message(message_bytes, attributes):
+    attributes = attributes or {}
+    if attributes.get("encoding") != PUBSUB_ENCODING:
+        return json.loads(message_bytes.decode("utf-8"))
+
+    if message_bytes[0] != 1:
+        raise ValueError(f"Unknown heartbeat version: {message_bytes[0]}")
+
+    _, ts, lat, lng, popularity = _HEADER.unpack_from(message_bytes)
+    data = {
+        "timestamp": ts,
+        "lat": None if math.isnan(lat) else lat,
+        "lng": None if math.isnan(lng) else lng,
+        "popularity": popularity,
+    }
+    offset = _HEADER.size
+    for field in _ID_FIELDS:
+        n = message_bytes[offset]
+        data[field] = message_bytes[offset + 1:offset + 1 + n].decode("utf-8")
+        offset += 1 + n
+
+    data.update({k: v for k, v in attributes.items() if k != "encoding"})
+    return data
+
+
 def heartbeat_to_bigquery(event, context):
     print("BigQuery Function triggered")
 
@@ -15,7 +62,7 @@ def heartbeat_to_bigquery(event, context):
 
     try:
         message_bytes = base64.urlsafe_b64decode(event["data"])        
-        data = json.loads(message_bytes.decode("utf-8"))
+        data = decode_heartbeat_message(message_bytes, event.get("attributes"))
     except Exception as e:
         print("Decode error:", e)
         return
@@ -34,7 +81,9 @@ def heartbeat_to_bigquery(event, context):
         "device_type": data.get("device_type"),
     }
 
-    errors = client.insert_rows_json(TABLE_ID, [row])
+    # insertId：Pub/Sub 重送同一筆（至少送一次）時 BigQuery 盡量去重（best effort，約一分鐘內）
+    row_id = f"{row['user_id']}:{row['timestamp']}:{row['track_id']}"
+    errors = get_client().insert_rows_json(TABLE_ID, [row], row_ids=[row_id])
 
     if errors:
         print("BigQuery Insert Error:", errors)
@@ -1,6 +1,7 @@
 import base64
 import json
-import geohash2
+import math
+import struct
 import redis
 import os
 
@@ -9,29 +10,79 @@ REDIS_HOST = os.getenv("REDIS_HOST")      # e.g. "10.0.0.3"（MemoryStore 內部
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")  # Secret Manager 拉進來
 
-# Redis client
-redis_client = redis.StrictRedis(
-    host=REDIS_HOST,
-    port=REDIS_PORT,
-    password=REDIS_PASSWORD,
-    decode_responses=True,
-)
+# Redis client（同一個 instance 的多次呼叫共用，連線留在 pool 裡）
+_redis_client = None
+
 
 def get_redis():
     """
     Lazy load Redis client.
-    避免在 cold start / import 階段初始化 Redis client。
+    避免在 cold start / import 階段初始化 Redis client；
+    建好後快取起來，不要每個 event 都重新建 pool / 連線。
     """
-    REDIS_HOST = os.getenv("REDIS_HOST")
-    REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
-    REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
+    global _redis_client
+
+    if _redis_client is None:
+        _redis_client = redis.StrictRedis(
+            host=REDIS_HOST,
+            port=REDIS_PORT,
+            password=REDIS_PASSWORD,
+            decode_responses=False,
+            socket_keepalive=True,
+            health_check_interval=30,
+        )
+
+    return _redis_client
+
+# ------------------------------------------------------
+# Heartbeat binary record（格式同 app/services/heartbeat_codec.py，v1）：
+#   <BIffB  version, timestamp, lat(float32), lng(float32), popularity
+#   之後 user_id / track_id / artist_id 各一個長度 byte + UTF-8
+# 歌名等欄位在 message attributes；encoding != heartbeat-v1 的是舊的 JSON message
+# ------------------------------------------------------
+PUBSUB_ENCODING = "heartbeat-v1"
+_HEADER = struct.Struct("<BIffB")
+_ID_FIELDS = ("user_id", "track_id", "artist_id")
+
+
+def decode_heartbeat_message(message_bytes, attributes):
+    attributes = attributes or {}
+    if attributes.get("encoding") != PUBSUB_ENCODING:
+        return json.loads(message_bytes.decode("utf-8"))
+
+    if message_bytes[0] != 1:
+        raise ValueError(f"Unknown heartbeat version: {message_bytes[0]}")
+
+    _, ts, lat, lng, popularity = _HEADER.unpack_from(message_bytes)
+    data = {
+        "timestamp": ts,
+        "lat": None if math.isnan(lat) else lat,
+        "lng": None if math.isnan(lng) else lng,
+        "popularity": popularity,
+    }
+    offset = _HEADER.size
+    for field in _ID_FIELDS:
+        n = message_bytes[offset]
+        data[field] = message_bytes[offset + 1:offset + 1 + n].decode("utf-8")
+        offset += 1 + n
+
+    data.update({k: v for k, v in attributes.items() if k != "encoding"})
+    return data
+
+
+def encode_heartbeat_record(data):
+    parts = [_HEADER.pack(
+        1,
+        int(data.get("timestamp") or 0),
+        float(data["lat"]),
+        float(data["lng"]),
+        max(0, min(255, int(data.get("popularity") or 0))),
+    )]
+    for field in _ID_FIELDS:
+        raw = str(data.get(field) or "").encode("utf-8")
+        parts.append(bytes((len(raw),)) + raw)
+    return b"".join(parts)
 
-    return redis.StrictRedis(
-        host=REDIS_HOST,
-        port=REDIS_PORT,
-        password=REDIS_PASSWORD,
-        decode_responses=True,
-    )
 
 def heartbeat_handler(event, context):
     """Triggered by Pub/Sub heartbeat message, store in Redis."""
@@ -43,7 +94,7 @@ def heartbeat_handler(event, context):
 
     try:
         message_bytes = base64.b64decode(event["data"])
-        data = json.loads(message_bytes.decode("utf-8"))
+        data = decode_heartbeat_message(message_bytes, event.get("attributes"))
     except Exception as e:
         print("Failed to decode message:", e)
         return
@@ -58,32 +109,15 @@ def heartbeat_handler(event, context):
         print("Missing field(s)")
         return
 
-    # --------- Compute geohash ---------
-    geo_hash = geohash2.encode(lat, lng, precision=8)
-
     # --------- Redis key ---------
     key = f"user:{user_id}"
 
-    # --------- Write into Redis (Hash) ---------
-    heartbeat = {
-        "user_id": user_id,
-        "track_id": data.get("track_id"),
-        "track_name": data.get("track_name"),
-        "artist_id": data.get("artist_id"),
-        "artist_name": data.get("artist_name"),
-        "popularity": data.get("popularity"),
-        "timestamp": str(data.get("timestamp")),
-        "album_image": data.get("album_image"),
-        "lat": str(lat),
-        "lng": str(lng),
-        "geohash": geo_hash,
-    }
-
+    # --------- Write into Redis（compact binary record；歌名等顯示欄位不存，geohash 可由 lat/lng 算回）---------
     try:
-        redis_client = get_redis()
-        redis_client.hset(key, mapping=heartbeat)
+        record = encode_heartbeat_record(data)
+
         # 設定 TTL（例如 120 秒），避免舊資料殘留
-        redis_client.expire(key, 120)
+        get_redis().set(key, record, ex=120)
 
         print(f"Redis updated for {user_id}")
 
@@ -0,0 +1,70 @@
+# scripts/check_import_time.py
+"""
+Import-time budget：在乾淨的子行程裡 import app.main，檢查
+1. 花費時間不超過預算（IMPORT_BUDGET_MS，預設 1500 ms）
+2. 重量級 SDK 沒有在 import 階段被載入（應該 lazy 到第一次使用）
+
+    python -m scripts.check_import_time [--budget-ms 1500] [--runs 3]
+
+超出預算或載入了禁止的模組時 exit code = 1，可以直接放進 CI。
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# 這些只能在第一次用到時才 import
+LAZY_MODULES = [
+    "vertexai",
+    "google.cloud.aiplatform",
+    "google.generativeai",
+    "google.cloud.bigquery",
+    "google.cloud.pubsub_v1",
+    "google.cloud.storage",
+]
+
+_PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import app.main
+elapsed = (time.perf_counter() - t0) * 1000
+print(json.dumps({"ms": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+
+def measure_once():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.getcwd(), env.get("PYTHONPATH")]))
+    out = subprocess.check_output(
+        [sys.executable, "-c", _PROBE % (LAZY_MODULES,)],
+        env=env, text=True, stderr=subprocess.DEVNULL,
+    )
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check app.main import time budget")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "1500")))
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    results = [measure_once() for _ in range(args.runs)]
+    best = min(r["ms"] for r in results)
+    loaded = sorted({m for r in results for m in r["loaded"]})
+
+    print(f"[ImportTime] app.main best of {args.runs}: {best:.0f} ms (budget {args.budget_ms:.0f} ms)")
+
+    ok = True
+    if best > args.budget_ms:
+        print("[ImportTime] FAIL: over budget")
+        ok = False
+    if loaded:
+        print(f"[ImportTime] FAIL: heavy SDKs imported eagerly: {', '.join(loaded)}")
+        ok = False
+
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+# scripts/check_swipe_index.py
+"""
+Swipe index（liked_by 預檢）正確性檢查，跑在 in-memory backend 上，不需要 GCP / Redis：
+1. 併發：N 對使用者同時互相 LIKE（單筆 / bulk 混合），每一對都要配對成功
+2. 登記失敗：a → b 的 liked_by 登記丟例外之後，b → a LIKE 仍然要配對成功，
+   而且 liked_by 要被標成不可信、背景 rebuild 完恢復可信
+
+    python -m scripts.check_swipe_index [--pairs 200]
+
+任何一項失敗 exit code = 1，可以直接放進 CI。
+"""
+import os
+
+os.environ["STORAGE_BACKEND"] = "memory"
+
+import argparse
+import random
+import sys
+import threading
+import time
+
+from app.services import match_service, swipe_index_service
+from app.services.firestore_client import get_db
+from app.services.redis_service import get_redis
+
+
+def _create_users(db, user_ids):
+    for uid in user_ids:
+        db.collection("users").document(uid).set({"display_name": uid})
+
+
+def _is_matched(db, a, b):
+    return db.collection("matches").document("_".join(sorted([a, b]))).get().exists
+
+
+def check_concurrent_likes(db, pairs):
+    users = [(f"cx{i}", f"cy{i}") for i in range(pairs)]
+    _create_users(db, [uid for pair in users for uid in pair])
+
+    def swipe(a, b):
+        if random.random() < 0.5:
+            match_service.process_swipe_batch(a, [(b, "LIKE")])
+        else:
+            match_service.process_swipe_transaction(a, b, "LIKE")
+
+    threads = [threading.Thread(target=swipe, args=args) for x, y in users for args in ((x, y), (y, x))]
+    random.shuffle(threads)
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    matched = sum(1 for x, y in users if _is_matched(db, x, y))
+    print(f"[SwipeIndex] concurrent mutual likes: {matched}/{pairs} matched")
+    return matched == pairs
+
+
+def check_failed_registration(db):
+    _create_users(db, ["fa", "fb", "fc", "fd"])
+    register_likes = match_service.register_likes
+    calls = {"failed": False}
+
+    def flaky_register(from_user_id, target_ids):
+        if from_user_id == "fa" and not calls["failed"]:
+            calls["failed"] = True
+            raise ConnectionError("simulated liked_by registration failure")
+        return register_likes(from_user_id, target_ids)
+
+    match_service.register_likes = flaky_register
+    try:
+        match_service.process_swipe_transaction("fa", "fb", "LIKE")
+        result = match_service.process_swipe_transaction("fb", "fa", "LIKE")
+    finally:
+        match_service.register_likes = register_likes
+
+    ok = result["is_match"] and _is_matched(db, "fa", "fb")
+    print(f"[SwipeIndex] like after failed registration: is_match={result['is_match']}")
+
+    # 背景 rebuild 完之後 liked_by 恢復可信，沒有回應的 LIKE 又可以不開交易
+    deadline = time.time() + 5
+    trusted = False
+    while not trusted and time.time() < deadline:
+        time.sleep(0.05)
+        trusted = swipe_index_service.register_likes("fc", ["fd"]) is not None
+    print(f"[SwipeIndex] liked_by trusted again after rebuild: {trusted}")
+    return ok and trusted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check swipe index / match consistency")
+    parser.add_argument("--pairs", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    db = get_db()
+    get_redis()
+    swipe_index_service.rebuild_swipe_index()
+
+    ok = check_concurrent_likes(db, args.pairs)
+    ok = check_failed_registration(db) and ok
+
+    print("[SwipeIndex] OK" if ok else "[SwipeIndex] FAIL")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
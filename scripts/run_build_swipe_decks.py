@@ -0,0 +1,5 @@
+# scripts/run_build_swipe_decks.py
+from app.services.swipe_deck_service import build_all_swipe_decks
+
+if __name__ == "__main__":
+    build_all_swipe_decks(top_k=100)
@@ -0,0 +1,14 @@
+# scripts/run_history_harvest.py
+import sys
+
+from app.services.history_harvester import backfill_harvest_buckets, harvest_all, run_harvest_tick
+
+if __name__ == "__main__":
+    # 預設跑一個 tick（給 cron / Cloud Scheduler）；--all 一次跑完所有 shard
+    # --backfill：替舊的 spotify_tokens 文件補 harvest_bucket（上線時跑一次，沒有這個欄位的人不會被 harvest）
+    if "--backfill" in sys.argv:
+        backfill_harvest_buckets()
+    elif "--all" in sys.argv:
+        harvest_all()
+    else:
+        run_harvest_tick()
@@ -0,0 +1,5 @@
+# scripts/run_rebuild_like_inboxes.py
+from app.services.match_service import rebuild_like_inboxes
+
+if __name__ == "__main__":
+    rebuild_like_inboxes()
@@ -0,0 +1,5 @@
+# scripts/run_rebuild_match_index.py
+from app.services.match_service import rebuild_match_index
+
+if __name__ == "__main__":
+    rebuild_match_index()
@@ -0,0 +1,5 @@
+# scripts/run_rebuild_swipe_index.py
+from app.services.swipe_index_service import rebuild_swipe_index
+
+if __name__ == "__main__":
+    rebuild_swipe_index()
@@ -0,0 +1,12 @@
+# scripts/run_snapshot_views.py
+import sys
+
+from app.services.spotify_snapshots import cluster_base_tables, prune_old_versions, refresh_latest_tables
+
+if __name__ == "__main__":
+    # 重建 {table}_latest 表（原始表順便設 CLUSTER BY user_id）；--prune 順便清掉舊版本
+    # 平常由背景 maintenance 定期跑（SNAPSHOT_MAINTENANCE），這裡是部署前 / 手動用
+    cluster_base_tables()
+    refresh_latest_tables()
+    if "--prune" in sys.argv:
+        prune_old_versions()
\ No newline at end of file